@@ -0,0 +1,224 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Throughput benchmarks for the data-movement paths.
+
+Measures records/sec and MB/sec for `chunked_json_slices`,
+`copy_json_to_table`, `S3UploaderThread`, reading UNLOAD-style output and,
+when a local PostgreSQL is available, `copy_table_to_s3`, across data sizes
+and slice counts. S3 is replaced by a local directory and Redshift
+statements are captured rather than run, so no AWS access is needed.
+
+Usage::
+
+    python benchmarks/bench_data_movement.py --output results.json
+    python benchmarks/bench_data_movement.py --compare results.json
+    python benchmarks/bench_data_movement.py --pg database=bench user=bench
+
+``copy_table_to_s3`` needs ``COPY ... TO PROGRAM`` rights (superuser or
+``pg_execute_server_program``) on the local database.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import gzip
+import json
+import os
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from benchmarks.common import (BenchRedshift, compare_results,  # noqa: E402
+                               describe, make_records, result_entry, timed,
+                               write_results)
+from shiftmanager.instrumentation import LoadReport  # noqa: E402
+from shiftmanager.mixins.postgres import S3UploaderThread  # noqa: E402
+from shiftmanager.storage import LocalStorage  # noqa: E402
+
+
+def bench_chunked_json_slices(records, slices, workdir, repeat,
+                              processes=1):
+    def run():
+        report = LoadReport()
+        with BenchRedshift.chunked_json_slices(records, slices, workdir,
+                                               report=report,
+                                               processes=processes):
+            pass
+        return report
+    seconds, report = timed(run, repeat)
+    params = {'slices': slices}
+    if processes != 1:
+        params['processes'] = processes
+    return result_entry('chunked_json_slices', seconds, len(records),
+                        report.raw_bytes, **params)
+
+
+def bench_copy_json_to_table(records, slices, workdir, repeat):
+    shift = BenchRedshift(os.path.join(workdir, 'bucket'))
+    jsonpaths = shift.gen_jsonpaths(records[0])
+
+    def run():
+        return shift.copy_json_to_table('bench', 'tmp/bench/', records,
+                                        jsonpaths, 'bench_table',
+                                        slices=slices,
+                                        local_path=os.path.join(workdir,
+                                                                'local'))
+    seconds, report = timed(run, repeat)
+    return result_entry('copy_json_to_table', seconds, len(records),
+                        report.raw_bytes, slices=slices)
+
+
+def _write_gz_files(directory, records, files):
+    per_file = max(1, len(records) // files)
+    total = 0
+    for i in range(files):
+        chunk = records[i * per_file:(i + 1) * per_file]
+        path = os.path.join(directory, 'chunk_{:04d}.json.gz'.format(i))
+        payload = ''.join(json.dumps(r) + '\n' for r in chunk)
+        with gzip.open(path, 'wb') as f:
+            f.write(payload.encode('utf-8'))
+        total += os.path.getsize(path)
+    return total
+
+
+def bench_s3_uploader_thread(records, files, workdir, repeat):
+    storage = LocalStorage(os.path.join(workdir, 'bucket'), 'bench')
+    staging = os.path.join(workdir, 'staging')
+    best = None
+    for _ in range(repeat):
+        os.makedirs(staging)
+        nbytes = _write_gz_files(staging, records, files)
+        thread = S3UploaderThread(staging, storage, 'tmp/bench/', None)
+        thread.finish_uploads_and_exit()
+        seconds, _ = timed(lambda: (thread.start(), thread.join()))
+        os.rmdir(staging)
+        if best is None or seconds < best[0]:
+            best = (seconds, thread.upload_seconds)
+    entry = result_entry('s3_uploader_thread', best[0], len(records),
+                         nbytes, files=files)
+    entry['upload_seconds'] = best[1]
+    return entry
+
+
+def bench_read_unload(records, slices, workdir, repeat):
+    """Read UNLOAD-style output: a manifest and gzipped JSON parts."""
+    shift = BenchRedshift(os.path.join(workdir, 'bucket'))
+    shift.copy_json_to_table('bench', 'unload/', records,
+                             shift.gen_jsonpaths(records[0]), 'bench_table',
+                             slices=slices, clean_up_s3=False,
+                             local_path=os.path.join(workdir, 'local'))
+    storage = shift.get_storage('bench')
+    manifest_key = [k for k in storage.list('unload/')
+                    if k.endswith('.manifest')][0]
+
+    def run():
+        manifest = json.loads(storage.get_string(manifest_key)
+                              .decode('utf-8'))
+        count = 0
+        nbytes = 0
+        for entry in manifest['entries']:
+            path = storage.path(entry['url'].split('/', 3)[3])
+            with gzip.open(path, 'rb') as f:
+                for line in f:
+                    nbytes += len(line)
+                    json.loads(line.decode('utf-8'))
+                    count += 1
+        return count, nbytes
+    seconds, (count, nbytes) = timed(run, repeat)
+    shutil.rmtree(os.path.join(workdir, 'bucket'))
+    return result_entry('read_unload', seconds, count, nbytes,
+                        slices=slices)
+
+
+def bench_copy_table_to_s3(pg_args, size, workdir, repeat):
+    shift = BenchRedshift(os.path.join(workdir, 'bucket'))
+    shift.create_pg_connection(**pg_args)
+    shift.pg_execute_and_commit_single_statement("""
+        DROP TABLE IF EXISTS shiftmanager_bench;
+        CREATE TABLE shiftmanager_bench AS
+        SELECT i AS id, md5(i::text) AS text, now() AS created_at
+        FROM generate_series(1, {size}) AS i;
+    """.format(size=size))
+
+    def run():
+        report = LoadReport()
+        shift.copy_table_to_s3('bench', 'tmp/bench/',
+                               pg_table_name='shiftmanager_bench',
+                               temp_file_dir=workdir, report=report)
+        return report
+    try:
+        seconds, report = timed(run, repeat)
+    finally:
+        shift.pg_execute_and_commit_single_statement(
+            "DROP TABLE IF EXISTS shiftmanager_bench")
+    return result_entry('copy_table_to_s3', seconds, report.records,
+                        report.compressed_bytes)
+
+
+def parse_pg_args(pairs):
+    return dict(pair.split('=', 1) for pair in pairs)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument('--slices', type=int, nargs='+',
+                        default=[1, 4, 16, 32])
+    parser.add_argument('--processes', type=int, nargs='+', default=[],
+                        help='also time chunked_json_slices with this many '
+                             'worker processes')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='report the best of this many runs')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='JSON results to compare against')
+    parser.add_argument('--pg', nargs='*', metavar='KEY=VALUE',
+                        help='local PostgreSQL connection parameters; '
+                             'enables the copy_table_to_s3 benchmark')
+    args = parser.parse_args(argv)
+
+    results = []
+    workdir = tempfile.mkdtemp(prefix='shiftmanager-bench-')
+    try:
+        for size in args.sizes:
+            records = make_records(size)
+            for slices in args.slices:
+                for bench in (bench_chunked_json_slices,
+                              bench_copy_json_to_table,
+                              bench_s3_uploader_thread,
+                              bench_read_unload):
+                    entry = bench(records, slices, workdir, args.repeat)
+                    entry['size'] = size
+                    print(describe(entry), '{:.0f} records/s'.format(
+                        entry['records_per_second'] or 0))
+                    results.append(entry)
+                for processes in args.processes:
+                    entry = bench_chunked_json_slices(
+                        records, slices, workdir, args.repeat, processes)
+                    entry['size'] = size
+                    print(describe(entry), '{:.0f} records/s'.format(
+                        entry['records_per_second'] or 0))
+                    results.append(entry)
+            if args.pg is not None:
+                entry = bench_copy_table_to_s3(parse_pg_args(args.pg), size,
+                                               workdir, args.repeat)
+                entry['size'] = size
+                print(describe(entry))
+                results.append(entry)
+    finally:
+        shutil.rmtree(workdir)
+
+    if args.output:
+        write_results(args.output, results)
+    if args.compare:
+        compare_results(args.compare, results)
+    return results
+
+
+if __name__ == '__main__':
+    main()
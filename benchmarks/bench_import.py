@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Import-time benchmark for ``import shiftmanager``.
+
+Each run imports the package in a fresh interpreter and reports the time
+spent beyond interpreter startup, along with any heavy dependencies
+(boto, sqlalchemy, psycopg2, multiprocessing) that were loaded eagerly.
+Exits with status 1 if a heavy dependency is loaded or the median exceeds
+``--max-ms``, 100 ms by default.
+
+Usage::
+
+    python benchmarks/bench_import.py --runs 20 --max-ms 60
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+from benchmarks.common import result_entry, write_results  # noqa: E402
+
+HEAVY_MODULES = ('boto', 'sqlalchemy', 'sqlalchemy_views',
+                 'sqlalchemy_redshift', 'psycopg2', 'multiprocessing')
+
+PROBE = """
+import json, sys
+from timeit import default_timer
+start = default_timer()
+{statement}
+elapsed = default_timer() - start
+heavy = sorted(m for m in {heavy!r} if m in sys.modules)
+print(json.dumps({{'seconds': elapsed, 'heavy': heavy}}))
+"""
+
+STATEMENTS = {
+    'import_shiftmanager': 'import shiftmanager',
+    'import_random_password':
+        'from shiftmanager.mixins.admin import random_password',
+    'import_grants_from_privileges':
+        'from shiftmanager.privileges import grants_from_privileges',
+}
+
+
+def probe(statement):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = PROBE.format(statement=statement, heavy=HEAVY_MODULES)
+    output = subprocess.check_output([sys.executable, '-c', code], cwd=root)
+    return json.loads(output.decode('utf-8').strip().splitlines()[-1])
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--max-ms', type=float, default=100,
+                        help='fail if a median import exceeds this')
+    parser.add_argument('--output', help='write results as JSON')
+    args = parser.parse_args(argv)
+
+    results = []
+    failed = False
+    for name, statement in sorted(STATEMENTS.items()):
+        probes = [probe(statement) for _ in range(args.runs)]
+        seconds = median([p['seconds'] for p in probes])
+        heavy = probes[-1]['heavy']
+        entry = result_entry(name, seconds)
+        entry['heavy_modules'] = heavy
+        results.append(entry)
+        print('{:<32} {:>8.1f} ms  heavy={}'.format(
+            name, seconds * 1000, ','.join(heavy) or '-'))
+        if heavy or (args.max_ms and seconds * 1000 > args.max_ms):
+            failed = True
+
+    if args.output:
+        write_results(args.output, results)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
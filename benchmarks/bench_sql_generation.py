@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks and regression gate for SQL generators and parsers.
+
+Times the pure-Python hot paths on synthetic worst cases: huge ACL lists
+for `grants_from_privileges`, deeply nested documents for `recur_dict` and
+`gen_jsonpaths`, and 1000-column tables for `_json_col_str`, `deep_copy`
+and `CreateTable` compilation.
+
+Each benchmark's best time is checked against a threshold in seconds from
+``thresholds.json`` (next to this script, or ``--thresholds``); the script
+exits with status 1 if any threshold is exceeded. Record fresh thresholds
+on a reference machine with ``--record``::
+
+    python benchmarks/bench_sql_generation.py
+    python benchmarks/bench_sql_generation.py --record --headroom 3
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+
+import sqlalchemy as sa  # noqa: E402
+from sqlalchemy.schema import CreateTable  # noqa: E402
+
+from benchmarks.common import (BenchRedshift, compare_results,  # noqa: E402
+                               result_entry, timed, write_results)
+from shiftmanager import util  # noqa: E402
+from shiftmanager.privileges import grants_from_privileges  # noqa: E402
+
+DEFAULT_THRESHOLDS = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                  'thresholds.json')
+
+COLUMN_TYPES = [
+    ('boolean', sa.Boolean),
+    ('integer', sa.Integer),
+    ('bigint', sa.BigInteger),
+    ('numeric(18,2)', lambda: sa.Numeric(18, 2)),
+    ('character varying(256)', lambda: sa.String(256)),
+    ('timestamp without time zone', sa.DateTime),
+]
+
+
+def huge_acl(entries):
+    """An ACL string like psql's \\dp output with *entries* grantees."""
+    patterns = ['arwdRxt', 'r', 'ar*wd*', 'r*', 'arwd', 'x*t']
+    lines = ['=r/owner']
+    for i in range(entries):
+        grantee = ('group g{}' if i % 3 == 0 else 'user{}').format(i)
+        lines.append('{}={}/owner'.format(grantee,
+                                          patterns[i % len(patterns)]))
+    return '\n'.join(lines)
+
+
+def nested_document(depth, breadth):
+    if depth == 0:
+        return {'leaf{}'.format(i): i for i in range(breadth)}
+    doc = {'node{}'.format(i): nested_document(depth - 1, breadth)
+           for i in range(breadth)}
+    doc['values'] = list(range(breadth))
+    return doc
+
+
+def wide_columns_and_types(width):
+    return [('col_{}'.format(i), COLUMN_TYPES[i % len(COLUMN_TYPES)][0])
+            for i in range(width)]
+
+
+def wide_table(width):
+    meta = sa.MetaData()
+    columns = [sa.Column('col_{}'.format(i),
+                         COLUMN_TYPES[i % len(COLUMN_TYPES)][1](),
+                         info={'encode': 'zstd'})
+               for i in range(width)]
+    return sa.Table('wide_table', meta, *columns,
+                    schema='bench',
+                    redshift_diststyle='KEY',
+                    redshift_distkey='col_1',
+                    redshift_sortkey=('col_5', 'col_1'))
+
+
+def benchmarks(scale):
+    shift = BenchRedshift(tempfile.gettempdir())
+    acl = huge_acl(int(5000 * scale))
+    doc = nested_document(5, max(2, int(5 * scale)))
+    columns_and_types = wide_columns_and_types(int(1000 * scale))
+    table = wide_table(int(1000 * scale))
+
+    return [
+        ('grants_from_privileges',
+         lambda: grants_from_privileges(acl, 'bench.wide_table')),
+        ('recur_dict', lambda: util.recur_dict(set(), doc)),
+        ('gen_jsonpaths', lambda: shift.gen_jsonpaths(doc)),
+        ('json_col_str', lambda: shift._json_col_str(columns_and_types)),
+        ('create_table_compile',
+         lambda: str(CreateTable(table).compile(shift.engine))),
+        ('deep_copy',
+         lambda: shift.deep_copy(table, copy_privileges=False,
+                                 deduplicate_partition_by='col_1',
+                                 deduplicate_order_by='col_5 DESC')),
+    ]
+
+
+def load_thresholds(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='check the best of this many runs')
+    parser.add_argument('--scale', type=float, default=1.0,
+                        help='multiply fixture sizes by this factor')
+    parser.add_argument('--thresholds', default=DEFAULT_THRESHOLDS,
+                        help='JSON file mapping benchmark names to '
+                             'maximum seconds')
+    parser.add_argument('--record', action='store_true',
+                        help='write measured times times --headroom as '
+                             'the new thresholds instead of checking')
+    parser.add_argument('--headroom', type=float, default=3.0)
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='JSON results to compare against')
+    args = parser.parse_args(argv)
+
+    thresholds = load_thresholds(args.thresholds)
+    results = []
+    failures = []
+    for name, f in benchmarks(args.scale):
+        seconds, _ = timed(f, args.repeat)
+        entry = result_entry(name, seconds, scale=args.scale)
+        results.append(entry)
+        limit = thresholds.get(name)
+        status = ''
+        if limit is not None and not args.record:
+            status = 'ok' if seconds <= limit * args.scale else 'REGRESSION'
+            if status == 'REGRESSION':
+                failures.append(name)
+        print('{:<24} {:>10.4f}s  limit={}  {}'.format(name, seconds, limit,
+                                                       status))
+
+    if args.record:
+        recorded = dict((e['benchmark'],
+                         round(e['seconds'] * args.headroom / args.scale, 4))
+                        for e in results)
+        with open(args.thresholds, 'w') as f:
+            json.dump(recorded, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('Recorded thresholds to ' + args.thresholds)
+    if args.output:
+        write_results(args.output, results)
+    if args.compare:
+        compare_results(args.compare, results)
+    if failures:
+        print('Regression threshold exceeded: ' + ', '.join(failures))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+Shared helpers for the shiftmanager benchmark scripts.
+
+Benchmarks run offline: S3 is replaced with
+`~shiftmanager.storage.LocalStorage`, which stores keys as files under a
+local directory, and Redshift statements are captured rather than executed.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import datetime
+import json
+import platform
+import random
+import string
+import sys
+from timeit import default_timer
+
+import shiftmanager
+from shiftmanager import Redshift
+from shiftmanager.storage import LocalStorage
+
+
+class BenchRedshift(Redshift):
+    """A `Redshift` that stages to `LocalStorage` and records statements."""
+
+    # Always stage and COPY, however few records are benchmarked
+    insert_threshold = 0
+
+    def __init__(self, bucket_root, **kwargs):
+        Redshift.__init__(self, "bench", "bench", "bench", "localhost",
+                          aws_access_key_id="bench",
+                          aws_secret_access_key="bench", **kwargs)
+        self.bucket_root = bucket_root
+        self.s3_conn = True
+        self.statements = []
+        self.set_storage_backend(LocalStorage.factory(bucket_root))
+
+    def execute(self, batch, parameters=None):
+        self.statements.append(batch)
+
+    def mogrify(self, batch, parameters=None, execute=False):
+        if execute:
+            self.execute(batch, parameters)
+        return batch
+
+    def _last_copy_count(self):
+        return None
+
+    def _get_identity_columns(self, table_name):
+        return set()
+
+
+def make_records(count, seed=0, mean_text_length=64, variance=0.5):
+    """Deterministic synthetic records with variable-length text fields."""
+    rand = random.Random(seed)
+    letters = string.ascii_letters + string.digits
+    low = int(mean_text_length * (1 - variance))
+    high = int(mean_text_length * (1 + variance))
+    records = []
+    for i in range(count):
+        text = ''.join(rand.choice(letters)
+                       for _ in range(rand.randint(low, high)))
+        records.append({
+            'id': i,
+            'amount': round(rand.uniform(-1e6, 1e6), 2),
+            'flag': rand.random() < 0.5,
+            'created_at': '2018-01-{:02d}T{:02d}:00:00'.format(
+                rand.randint(1, 28), rand.randint(0, 23)),
+            'text': text,
+            'nested': {'a': rand.randint(0, 1000), 'b': text[:8]},
+        })
+    return records
+
+
+def timed(f, repeat=1):
+    """Run *f* *repeat* times; return (best seconds, last result)."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = default_timer()
+        result = f()
+        elapsed = default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+# Result fields holding measurements rather than benchmark parameters
+METRIC_KEYS = {'seconds', 'records', 'records_per_second', 'bytes',
+               'mb_per_second', 'upload_seconds'}
+
+
+def result_entry(name, seconds, records=None, nbytes=None, **params):
+    entry = {'benchmark': name, 'seconds': seconds}
+    entry.update(params)
+    if records is not None:
+        entry['records'] = records
+        entry['records_per_second'] = records / seconds if seconds else None
+    if nbytes is not None:
+        entry['bytes'] = nbytes
+        entry['mb_per_second'] = (nbytes / 1e6 / seconds
+                                  if seconds else None)
+    return entry
+
+
+def environment():
+    return {
+        'shiftmanager_version': shiftmanager.__version__,
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'timestamp': datetime.datetime.utcnow().isoformat(),
+    }
+
+
+def write_results(path, results):
+    document = {'environment': environment(), 'results': results}
+    with open(path, 'w') as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+
+def result_key(entry):
+    return tuple(sorted((k, v) for k, v in entry.items()
+                        if k not in METRIC_KEYS))
+
+
+def compare_results(previous_path, results):
+    """Print the speed ratio of *results* against a saved results file."""
+    with open(previous_path) as f:
+        previous = dict((result_key(e), e) for e in json.load(f)['results'])
+    for entry in results:
+        old = previous.get(result_key(entry))
+        if old is None or not entry['seconds']:
+            continue
+        print("{:<40} {:>8.3f}s -> {:>8.3f}s ({:.2f}x)".format(
+            describe(entry), old['seconds'], entry['seconds'],
+            old['seconds'] / entry['seconds']))
+
+
+def describe(entry):
+    params = ' '.join('{}={}'.format(k, v) for k, v in sorted(entry.items())
+                      if k != 'benchmark' and k not in METRIC_KEYS)
+    return '{} {}'.format(entry['benchmark'], params).strip()
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""
+Collection settings shared by the whole source tree.
+"""
+
+import sys
+
+collect_ignore = []
+
+# The asyncio facade uses async/await syntax
+if sys.version_info < (3, 5):
+    collect_ignore += ['shiftmanager/aio.py', 'shiftmanager/tests/test_aio.py']
@@ -0,0 +1,383 @@
+"""
+Defines an AsyncRedshift class exposing awaitable versions of the
+`Redshift` execute, load, unload and admin methods.
+
+SQL runs over psycopg2's native asynchronous connections, driven by the
+event loop's reader/writer callbacks, so a single loop can keep many
+statements in flight at once. boto2 has no asynchronous API, so S3 staging
+work (chunking, uploads, cleanup) runs on an executor while the COPY itself
+is awaited on the loop.
+
+This module requires Python 3.5 or later.
+"""
+
+import asyncio
+import functools
+
+from shiftmanager.catalog import (CatalogSnapshot, RELATIONS_QUERY,
+                                  SEARCH_PATH_QUERY)
+from shiftmanager.instrumentation import LoadReport
+from shiftmanager.mixins.admin import AdminMixin
+from shiftmanager.redshift import Redshift
+
+
+class _StatementBuilder(AdminMixin):
+    """Generates admin SQL, quoting parameters with an idle connection."""
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def mogrify(self, batch, parameters=None, execute=False):
+        mogrified = self._conn.cursor().mogrify(batch, parameters)
+        return mogrified.decode('utf-8')
+
+
+async def _wait_fd(loop, fd, writer=False):
+    future = loop.create_future()
+
+    def ready():
+        if not future.done():
+            future.set_result(None)
+
+    if writer:
+        loop.add_writer(fd, ready)
+    else:
+        loop.add_reader(fd, ready)
+    try:
+        await future
+    finally:
+        if writer:
+            loop.remove_writer(fd)
+        else:
+            loop.remove_reader(fd)
+
+
+async def wait_for_connection(conn):
+    """Poll an asynchronous psycopg2 *conn* until its operation completes."""
+    import psycopg2.extensions
+
+    loop = asyncio.get_event_loop()
+    while True:
+        state = conn.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        elif state == psycopg2.extensions.POLL_READ:
+            await _wait_fd(loop, conn.fileno())
+        elif state == psycopg2.extensions.POLL_WRITE:
+            await _wait_fd(loop, conn.fileno(), writer=True)
+        else:
+            raise psycopg2.OperationalError("Bad poll state: %s" % state)
+
+
+class AsyncConnectionPool(object):
+    """
+    A bounded pool of asynchronous psycopg2 connections.
+
+    Connections are opened lazily, up to *size*; callers beyond that wait
+    for a connection to be released.
+    """
+
+    def __init__(self, connect_kwargs, size=10):
+        self.connect_kwargs = connect_kwargs
+        self.size = size
+        self._idle = []
+        self._opened = 0
+        self._semaphore = None
+
+    def _connect(self):
+        import psycopg2
+        return psycopg2.connect(async_=True, **self.connect_kwargs)
+
+    async def acquire(self):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.size)
+        await self._semaphore.acquire()
+        try:
+            if self._idle:
+                return self._idle.pop()
+            conn = self._connect()
+            await wait_for_connection(conn)
+            self._opened += 1
+            return conn
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+    def release(self, conn, discard=False):
+        if discard or conn.closed or conn.isexecuting():
+            self._opened -= 1
+            if not conn.closed:
+                conn.close()
+        else:
+            self._idle.append(conn)
+        self._semaphore.release()
+
+    def close(self):
+        while self._idle:
+            self._idle.pop().close()
+            self._opened -= 1
+
+
+class AsyncRedshift(object):
+    """Asynchronous interface to Redshift.
+
+    Takes the same arguments as `Redshift`, plus:
+
+    Parameters
+    ----------
+    pool_size : int
+        Maximum number of concurrent Redshift connections
+    executor : concurrent.futures.Executor
+        Executor for blocking S3 work; defaults to the loop's default
+    """
+
+    def __init__(self, database=None, user=None, password=None, host=None,
+                 port=5439,
+                 aws_access_key_id=None,
+                 aws_secret_access_key=None,
+                 security_token=None,
+                 pool_size=10,
+                 executor=None,
+                 **kwargs):
+        # The synchronous instance builds statements and performs S3 work;
+        # its own Redshift connection is never opened by this class.
+        self.redshift = Redshift(database, user, password, host, port,
+                                 aws_access_key_id, aws_secret_access_key,
+                                 security_token, **kwargs)
+        self.executor = executor
+        self.pg_args = None
+        connect_kwargs = dict(user=self.redshift.user,
+                              host=self.redshift.host,
+                              port=self.redshift.port,
+                              database=self.redshift.database,
+                              password=self.redshift.password)
+        connect_kwargs.update(kwargs)
+        self.pool = AsyncConnectionPool(connect_kwargs, pool_size)
+
+    random_password = staticmethod(Redshift.random_password)
+    gen_jsonpaths = staticmethod(Redshift.gen_jsonpaths)
+    infer_jsonpaths = staticmethod(Redshift.infer_jsonpaths)
+
+    def set_aws_credentials(self, *args, **kwargs):
+        """See `Redshift.set_aws_credentials`."""
+        self.redshift.set_aws_credentials(*args, **kwargs)
+
+    def set_aws_role(self, *args, **kwargs):
+        """See `Redshift.set_aws_role`."""
+        self.redshift.set_aws_role(*args, **kwargs)
+
+    def create_pg_connection(self, **kwargs):
+        """
+        Record Postgres connection parameters for `copy_table_to_redshift`.
+
+        Takes the same arguments as `Redshift.create_pg_connection`, but
+        connections are only opened when a copy runs.
+        """
+        if 'host' not in kwargs:
+            kwargs['host'] = 'localhost'
+        self.pg_args = kwargs
+
+    async def _run_sync(self, f, *args, **kwargs):
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(f, *args, **kwargs))
+
+    async def _execute_on(self, conn, batch, parameters=None):
+        cur = conn.cursor()
+        try:
+            cur.execute("BEGIN")
+            await wait_for_connection(conn)
+            try:
+                cur.execute(batch, parameters)
+                await wait_for_connection(conn)
+                cur.execute("COMMIT")
+                await wait_for_connection(conn)
+            except BaseException:
+                # A cancelled wait leaves the query running; the pool
+                # discards such connections rather than rolling back.
+                if not conn.closed and not conn.isexecuting():
+                    cur.execute("ROLLBACK")
+                    await wait_for_connection(conn)
+                raise
+        finally:
+            cur.close()
+
+    async def execute(self, batch, parameters=None):
+        """
+        Execute a batch of SQL statements on a pooled connection.
+
+        Statements are executed within a transaction.
+
+        Parameters
+        ----------
+        batch : str
+            The batch of SQL statements to execute.
+        parameters : list or dict
+            Values to bind to the batch, passed to `cursor.execute`
+        """
+        conn = await self.pool.acquire()
+        try:
+            await self._execute_on(conn, batch, parameters)
+        finally:
+            self.pool.release(conn)
+        self.redshift._invalidate_after(batch)
+
+    async def fetchall(self, query, parameters=None):
+        """Run *query* outside a transaction and return all rows."""
+        conn = await self.pool.acquire()
+        try:
+            cur = conn.cursor()
+            cur.execute(query, parameters)
+            await wait_for_connection(conn)
+            rows = cur.fetchall()
+            cur.close()
+            return rows
+        finally:
+            self.pool.release(conn)
+
+    async def mogrify(self, batch, parameters=None, execute=False):
+        conn = await self.pool.acquire()
+        try:
+            mogrified = conn.cursor().mogrify(batch, parameters)
+        finally:
+            self.pool.release(conn)
+        if execute:
+            await self.execute(batch, parameters)
+        return mogrified.decode('utf-8')
+
+    async def _admin_statement(self, method, *args, **kwargs):
+        execute = kwargs.pop('execute', False)
+        conn = await self.pool.acquire()
+        try:
+            batch = getattr(_StatementBuilder(conn), method)(*args, **kwargs)
+        finally:
+            self.pool.release(conn)
+        if execute:
+            await self.execute(batch)
+        return batch
+
+    async def create_user(self, *args, **kwargs):
+        """Awaitable version of `Redshift.create_user`."""
+        return await self._admin_statement('create_user', *args, **kwargs)
+
+    async def alter_user(self, *args, **kwargs):
+        """Awaitable version of `Redshift.alter_user`."""
+        return await self._admin_statement('alter_user', *args, **kwargs)
+
+    async def catalog(self):
+        """
+        Awaitable version of `Redshift.catalog`, sharing its cached
+        snapshot.
+        """
+        cache = self.redshift.caches.get('catalog', 1)
+        snapshot = cache.get(())
+        if snapshot is None:
+            search_path = await self.fetchall(SEARCH_PATH_QUERY)
+            rows = await self.fetchall(RELATIONS_QUERY)
+            snapshot = CatalogSnapshot(
+                rows, search_path[0][0] if search_path else None)
+            cache.set((), snapshot)
+        return snapshot
+
+    async def table_exists(self, table_name, schema=None):
+        """Awaitable version of `Redshift.table_exists`."""
+        snapshot = await self.catalog()
+        return snapshot.exists(table_name, schema, kinds='r')
+
+    async def copy_json_to_table(self, bucket, keypath, data, jsonpaths,
+                                 table, slices=32, clean_up_s3=True,
+                                 local_path=None, clean_up_local=True,
+                                 processes=1, codec='gzip',
+                                 compression_level=None, projection=None):
+        """
+        Awaitable version of `Redshift.copy_json_to_table`.
+
+        Chunking and uploads run on the executor; the COPY runs on a
+        pooled asynchronous connection.
+
+        Returns
+        -------
+        `~shiftmanager.instrumentation.LoadReport`; ``copy_count`` is not
+        collected since the COPY's session is returned to the pool.
+        """
+        rs = self.redshift
+        report = LoadReport(table)
+        if codec == 'auto':
+            codec = await self._run_sync(
+                lambda: rs._choose_codec(rs._json_sample(data), processes))
+        report.codec = codec
+        if slices == 'auto':
+            rows = await self.fetchall("SELECT COUNT(*) FROM stv_slices")
+            slices, balance = rows[0][0], 'bytes'
+            target_file_bytes = rs.target_file_bytes
+        else:
+            balance, target_file_bytes = 'records', None
+        storage = await self._run_sync(rs.get_storage, bucket)
+        s3_sweep = []
+        try:
+            mfest_path, jpaths_path = await self._run_sync(
+                rs._stage_json, storage, keypath, data, jsonpaths,
+                slices, local_path, clean_up_local, s3_sweep, report,
+                processes, codec, compression_level, balance,
+                target_file_bytes, projection)
+            statement = rs._json_copy_statement(table, mfest_path,
+                                                jpaths_path, codec)
+            with report.phase('copy'):
+                await self.execute(statement)
+        finally:
+            if clean_up_s3:
+                with report.phase('cleanup'):
+                    await self._run_sync(storage.delete, s3_sweep)
+        return report.finish()
+
+    async def unload_table_to_s3(self, bucket, keypath, table,
+                                 schema=None, col_str='*', where=None,
+                                 to_json=True, options=None):
+        """Awaitable version of `Redshift.unload_table_to_s3`."""
+        rs = self.redshift
+        if not rs.s3_conn:
+            # Resolve credentials the same way the synchronous method does
+            rs.s3_conn = await self._run_sync(rs.get_s3_connection)
+        if not options:
+            options = "MANIFEST GZIP ALLOWOVERWRITE"
+        diststyle = await self.fetchall(rs._diststyle_query(table, schema))
+        if diststyle and diststyle[0][0] == 'ALL':
+            options += ' PARALLEL OFF'
+        if to_json:
+            columns_and_types = await self.fetchall(
+                rs._columns_and_types_query(table, schema, col_str))
+            cols = rs._json_col_str(columns_and_types)
+        else:
+            cols = col_str
+        statement = rs._unload_statement(bucket, keypath, table, schema,
+                                         cols, where, options)
+        await self.execute(statement)
+
+    async def copy_table_to_redshift(self, *args, **kwargs):
+        """
+        Awaitable version of `Redshift.copy_table_to_redshift`.
+
+        The Postgres export is driven by a shell pipeline and an uploader
+        thread, so the whole operation runs on the executor against a
+        dedicated `Redshift` instance with its own connections, allowing
+        several to proceed concurrently. Call `create_pg_connection` first.
+        """
+        rs = self.redshift
+        pg_args = self.pg_args
+        if pg_args is None:
+            raise ValueError("Call create_pg_connection before "
+                             "copy_table_to_redshift")
+
+        def run():
+            clone = rs.clone()
+            clone.pg_args = pg_args
+            try:
+                return clone.copy_table_to_redshift(*args, **kwargs)
+            finally:
+                clone.close()
+
+        return await self._run_sync(run)
+
+    def close(self):
+        """Close all idle pooled connections."""
+        self.pool.close()
@@ -0,0 +1,214 @@
+"""
+Bounded caches for catalog lookups.
+
+`LRUCache` holds at most *maxsize* entries, evicting the least recently
+used, and optionally expires entries *ttl* seconds after they are stored.
+A `CacheGroup` holds one named `LRUCache` per cached method; each
+`Redshift` instance owns a group, or shares one with every instance
+connected to the same cluster. Decorate methods with `cached` to store
+their results in the instance's group.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+from collections import OrderedDict
+from functools import wraps
+import threading
+from timeit import default_timer
+
+# Distinguishes a missing entry from a cached None or False
+_MISSING = object()
+
+_cluster_groups = {}
+_cluster_groups_lock = threading.Lock()
+
+
+class LRUCache(object):
+    """
+    A thread-safe mapping bounded by size and, optionally, entry age.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum number of entries; the least recently used is evicted
+    ttl : float
+        Seconds an entry stays valid; None keeps entries until evicted
+    timer : callable
+        Returns the current time in seconds
+
+    Attributes
+    ----------
+    hits, misses, evictions, expirations : int
+        Counters since the cache was created
+    """
+
+    def __init__(self, maxsize=256, ttl=None, timer=default_timer):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.timer = timer
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._entries = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        """
+        Return the value stored for *key*, or *default* when it is
+        missing or expired.
+
+        >>> cache = LRUCache(maxsize=2)
+        >>> cache.set('a', False)
+        >>> cache.get('a', 'missing')
+        False
+        >>> cache.set('b', 2); cache.set('c', 3)
+        >>> cache.get('a', 'missing')
+        'missing'
+        """
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING:
+                value, stored = entry
+                if self.ttl is not None and \
+                        self.timer() - stored >= self.ttl:
+                    del self._entries[key]
+                    self.expirations += 1
+                else:
+                    self._entries.pop(key)
+                    self._entries[key] = entry
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return default
+
+    def set(self, key, value):
+        """Store *value* for *key*, evicting the oldest entry if full."""
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, self.timer())
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=_MISSING):
+        """Drop the entry for *key*, or every entry if no key is given."""
+        with self._lock:
+            if key is _MISSING:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        """Return the counters and current size as a dict."""
+        with self._lock:
+            return {'size': len(self._entries), 'maxsize': self.maxsize,
+                    'ttl': self.ttl, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions,
+                    'expirations': self.expirations}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<LRUCache {}/{} hits={} misses={}>'.format(
+            len(self), self.maxsize, self.hits, self.misses)
+
+
+class CacheGroup(object):
+    """
+    Named `LRUCache` instances sharing default limits.
+
+    Parameters
+    ----------
+    maxsize : int
+        Default maximum entries per cache
+    ttl : float
+        Default seconds an entry stays valid
+    """
+
+    def __init__(self, maxsize=256, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._caches = {}
+        self._lock = threading.Lock()
+
+    def get(self, name, maxsize=None, ttl=None):
+        """Return the cache called *name*, creating it if needed."""
+        with self._lock:
+            cache = self._caches.get(name)
+            if cache is None:
+                cache = self._caches[name] = LRUCache(
+                    maxsize or self.maxsize,
+                    self.ttl if ttl is None else ttl)
+            return cache
+
+    def invalidate(self, name=None):
+        """Empty the cache called *name*, or every cache."""
+        with self._lock:
+            caches = list(self._caches.values()) if name is None \
+                else [self._caches[name]] if name in self._caches else []
+        for cache in caches:
+            cache.invalidate()
+
+    def stats(self):
+        """Return `LRUCache.stats` for each cache, keyed by name."""
+        with self._lock:
+            caches = dict(self._caches)
+        return dict((name, cache.stats()) for name, cache in caches.items())
+
+
+def cluster_caches(cluster, maxsize=256, ttl=None):
+    """
+    Return the `CacheGroup` shared by everything connected to *cluster*,
+    any hashable identifying it, such as (host, port, database).
+    """
+    with _cluster_groups_lock:
+        group = _cluster_groups.get(cluster)
+        if group is None:
+            group = _cluster_groups[cluster] = CacheGroup(maxsize, ttl)
+        return group
+
+
+def cached(maxsize=None, ttl=None):
+    """
+    Decorator caching a method's results in ``self.caches``, a
+    `CacheGroup`, under the method's name.
+
+    Results are keyed on the method's arguments, which must be hashable;
+    calls with unhashable arguments are not cached. *maxsize* and *ttl*
+    override the group's defaults for this method.
+
+    >>> class Catalog(object):
+    ...     caches = CacheGroup()
+    ...     @cached(maxsize=10)
+    ...     def lookup(self, name):
+    ...         print('querying ' + name)
+    ...         return None
+    >>> catalog = Catalog()
+    >>> catalog.lookup('foo')
+    querying foo
+    >>> catalog.lookup('foo')
+    >>> catalog.caches.stats()['lookup']['hits']
+    1
+    """
+    def decorator(f):
+        name = f.__name__
+
+        @wraps(f)
+        def wrapper(self, *args, **kwargs):
+            key = args + tuple(sorted(kwargs.items())) if kwargs else args
+            try:
+                hash(key)
+            except TypeError:
+                return f(self, *args, **kwargs)
+            cache = self.caches.get(name, maxsize, ttl)
+            value = cache.get(key, _MISSING)
+            if value is _MISSING:
+                value = f(self, *args, **kwargs)
+                cache.set(key, value)
+            return value
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,162 @@
+"""
+An in-memory index of the relations in a cluster.
+
+`pg_table_def` only covers schemas on the ``search_path`` and is slow to
+query on large clusters. A `CatalogSnapshot` instead loads every schema,
+relation name, kind and OID from ``pg_class`` and ``pg_namespace`` in one
+query, then answers existence checks from a dict.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+from collections import namedtuple
+import re
+from timeit import default_timer
+
+Relation = namedtuple('Relation', ['oid', 'schema', 'name', 'kind'])
+
+RELATION_KINDS = {'r': 'table', 'v': 'view', 'm': 'materialized view',
+                  'f': 'foreign table', 'p': 'partitioned table'}
+
+RELATIONS_QUERY = """
+SELECT c.oid, n.nspname, c.relname, c.relkind
+FROM pg_catalog.pg_class c
+JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind IN ('r', 'v', 'm', 'f', 'p')
+"""
+
+SEARCH_PATH_QUERY = "SELECT current_schemas(false)"
+
+# One identifier: double-quoted with "" escapes, or bare
+IDENTIFIER_RE = re.compile(r'"((?:[^"]|"")*)"|([^".]+)')
+
+
+def split_name(name, schema=None):
+    """
+    Split a possibly schema-qualified relation *name* into (schema, name),
+    folding unquoted identifiers to lower case as Redshift does.
+
+    >>> split_name('Public.Events')
+    ('public', 'events')
+    >>> split_name('"My Schema"."Dotted.Name"')
+    ('My Schema', 'Dotted.Name')
+    >>> split_name('events', schema='staging')
+    ('staging', 'events')
+    """
+    parts = []
+    position = 0
+    while position <= len(name):
+        match = IDENTIFIER_RE.match(name, position)
+        if match is None:
+            raise ValueError("Invalid relation name {!r}".format(name))
+        quoted, bare = match.groups()
+        parts.append(quoted.replace('""', '"') if quoted is not None
+                     else bare.strip().lower())
+        position = match.end()
+        if position < len(name) and name[position] != '.':
+            raise ValueError("Invalid relation name {!r}".format(name))
+        position += 1
+    if len(parts) == 1:
+        return schema, parts[0]
+    if len(parts) == 2:
+        return parts[0], parts[1]
+    raise ValueError("Invalid relation name {!r}".format(name))
+
+
+def parse_search_path(value):
+    """
+    Return the schemas in *value*, a ``current_schemas`` result that
+    drivers may return as a list or as array text.
+
+    >>> parse_search_path('{public,"My Schema"}')
+    ['public', 'My Schema']
+    """
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    return [part.strip().strip('"')
+            for part in value.strip('{}').split(',') if part.strip()]
+
+
+class CatalogSnapshot(object):
+    """
+    Relations in a cluster as of the moment the snapshot was taken.
+
+    Parameters
+    ----------
+    rows : iterable
+        (oid, schema, name, relkind) rows from `RELATIONS_QUERY`
+    search_path : list of str
+        Schemas searched, in order, for unqualified names
+    timer : callable
+        Returns the current time in seconds
+    """
+
+    def __init__(self, rows, search_path=None, timer=default_timer):
+        self.timer = timer
+        self.loaded_at = timer()
+        self.search_path = parse_search_path(search_path)
+        self._relations = {}
+        for oid, schema, name, kind in rows:
+            self._relations[(schema, name)] = Relation(oid, schema, name,
+                                                       kind)
+
+    @classmethod
+    def load(cls, connection):
+        """Take a snapshot through the psycopg2 *connection*."""
+        with connection as conn, conn.cursor() as cur:
+            cur.execute(SEARCH_PATH_QUERY)
+            row = cur.fetchone()
+            cur.execute(RELATIONS_QUERY)
+            rows = cur.fetchall()
+        return cls(rows, row[0] if row else None)
+
+    @property
+    def age(self):
+        """Seconds since the snapshot was taken."""
+        return self.timer() - self.loaded_at
+
+    def lookup(self, name, schema=None):
+        """
+        Return the `Relation` called *name*, or None if there is none.
+
+        *name* may be schema-qualified; otherwise *schema*, or failing that
+        each schema on the search path in turn, is searched.
+
+        >>> snapshot = CatalogSnapshot([(100, 'public', 'events', 'r')],
+        ...                            '{public}')
+        >>> snapshot.lookup('events')
+        Relation(oid=100, schema='public', name='events', kind='r')
+        >>> snapshot.lookup('staging.events') is None
+        True
+        """
+        schema, name = split_name(name, schema)
+        if schema is not None:
+            return self._relations.get((schema, name))
+        for path_schema in self.search_path:
+            relation = self._relations.get((path_schema, name))
+            if relation is not None:
+                return relation
+        return None
+
+    def exists(self, name, schema=None, kinds=None):
+        """
+        Whether a relation called *name* exists, optionally restricted to
+        the ``relkind`` values in *kinds* (e.g. ``'r'`` for tables).
+        """
+        relation = self.lookup(name, schema)
+        return relation is not None and (kinds is None or
+                                         relation.kind in kinds)
+
+    def relations(self, schema=None):
+        """Return every `Relation`, or those in *schema*, sorted by name."""
+        return sorted(relation for relation in self._relations.values()
+                      if schema is None or relation.schema == schema)
+
+    def __len__(self):
+        return len(self._relations)
+
+    def __repr__(self):
+        return '<CatalogSnapshot {} relations, {:.0f}s old>'.format(
+            len(self), self.age)
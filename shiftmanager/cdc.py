@@ -0,0 +1,381 @@
+"""
+Change data capture from a Postgres logical replication slot.
+
+`stream_changes` reads wal2json output through psycopg2's replication
+support and buffers inserts, updates and deletes per table. Only the
+latest state of each key is kept. When the buffer grows past a size or
+age limit, each table's changes are applied to Redshift as one
+micro-batch. Upserted rows are staged as compressed JSON and COPYed into a
+temporary table, then merged with `merge_statement`, and deleted keys are
+removed, all in one transaction. The slot's position is confirmed only
+after every table's transaction has committed. If the stream stops early,
+the unconfirmed changes are replayed on restart, and since applying them
+is idempotent they land exactly once.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+from collections import namedtuple, OrderedDict
+import json
+import select
+from timeit import default_timer
+import uuid
+
+from shiftmanager.catalog import split_name
+from shiftmanager.instrumentation import LoadReport
+
+# A row change. *row* maps column names to new values (None for deletes);
+# *old_key* maps replica identity columns to their values before an
+# update or delete, when the server sends them.
+Change = namedtuple('Change', ['table', 'kind', 'row', 'old_key'])
+
+KINDS = {'I': 'insert', 'U': 'update', 'D': 'delete'}
+
+# Keys deleted per DELETE statement
+DELETE_BATCH_SIZE = 1000
+
+PRIMARY_KEY_QUERY = """
+SELECT a.attname
+FROM pg_index i
+JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+WHERE i.indrelid = %s::regclass AND i.indisprimary
+ORDER BY a.attnum
+"""
+
+
+def _v1_change(change):
+    row = None
+    if 'columnnames' in change:
+        row = dict(zip(change['columnnames'], change['columnvalues']))
+    old_key = None
+    if 'oldkeys' in change:
+        old_key = dict(zip(change['oldkeys']['keynames'],
+                           change['oldkeys']['keyvalues']))
+    return Change('{}.{}'.format(change['schema'], change['table']),
+                  change['kind'], row, old_key)
+
+
+def _v2_change(doc):
+    def values(columns):
+        return dict((c['name'], c['value']) for c in columns)
+
+    return Change('{}.{}'.format(doc['schema'], doc['table']),
+                  KINDS[doc['action']],
+                  values(doc['columns']) if 'columns' in doc else None,
+                  values(doc['identity']) if 'identity' in doc else None)
+
+
+def parse_wal2json(payload, format_version=1):
+    """
+    Parse one wal2json message.
+
+    Returns
+    -------
+    (list of `Change`, whether the message ends a transaction)
+
+    >>> changes, complete = parse_wal2json(
+    ...     '{"change": [{"kind": "delete", "schema": "public", '
+    ...     '"table": "users", "oldkeys": {"keynames": ["id"], '
+    ...     '"keytypes": ["integer"], "keyvalues": [7]}}]}')
+    >>> (changes[0].table, changes[0].kind, changes[0].old_key,
+    ...  complete) == ('public.users', 'delete', {'id': 7}, True)
+    True
+    >>> parse_wal2json('{"action": "B"}', format_version=2)
+    ([], False)
+    """
+    doc = json.loads(payload)
+    if format_version == 1:
+        # Each message holds a whole transaction
+        return [_v1_change(c) for c in doc.get('change', [])], True
+    action = doc.get('action')
+    if action in KINDS:
+        return [_v2_change(doc)], False
+    # Truncates ('T') and logical messages ('M') are not replicated
+    return [], action == 'C'
+
+
+def _key_list(keys):
+    if isinstance(keys, (list, tuple)):
+        return list(keys)
+    return [key.strip() for key in keys.split(',')]
+
+
+class ChangeBuffer(object):
+    """
+    Pending changes per table, keeping only the latest state of each key.
+
+    Parameters
+    ----------
+    key_columns : callable
+        Returns the list of key columns for a table name
+    timer : callable
+        Returns the current time in seconds
+    """
+
+    def __init__(self, key_columns, timer=default_timer):
+        self.key_columns = key_columns
+        self.timer = timer
+        self.clear()
+
+    def clear(self):
+        self.tables = OrderedDict()
+        self.changes = 0
+        self.bytes = 0
+        self.started = None
+
+    def _key(self, table, values, keys):
+        try:
+            return tuple(values[key] for key in keys)
+        except (KeyError, TypeError):
+            raise ValueError(
+                "A change to {} is missing key columns {}; set its REPLICA "
+                "IDENTITY to include them".format(table, ', '.join(keys)))
+
+    def add(self, change, nbytes=0):
+        """Buffer *change*, which occupied *nbytes* of the stream."""
+        keys = self.key_columns(change.table)
+        pending = self.tables.setdefault(change.table, OrderedDict())
+        if change.kind == 'delete':
+            pending[self._key(change.table, change.old_key, keys)] = None
+        else:
+            key = self._key(change.table, change.row, keys)
+            if change.kind == 'update' and change.old_key:
+                old_key = tuple(change.old_key.get(k, v)
+                                for k, v in zip(keys, key))
+                if old_key != key:
+                    # The key itself changed
+                    pending[old_key] = None
+            pending.pop(key, None)
+            pending[key] = change.row
+        if self.started is None:
+            self.started = self.timer()
+        self.changes += 1
+        self.bytes += nbytes
+
+    @property
+    def age(self):
+        """Seconds since the oldest pending change was buffered."""
+        return 0 if self.started is None else self.timer() - self.started
+
+    def ready(self, max_changes=None, max_bytes=None, max_seconds=None):
+        """Whether any limit has been reached."""
+        if not self.changes:
+            return False
+        return ((max_changes is not None and self.changes >= max_changes) or
+                (max_bytes is not None and self.bytes >= max_bytes) or
+                (max_seconds is not None and self.age >= max_seconds))
+
+    def drain(self):
+        """
+        Return {table: (rows to upsert, keys to delete)} and empty the
+        buffer.
+        """
+        batches = OrderedDict()
+        for table, pending in self.tables.items():
+            rows = [row for row in pending.values() if row is not None]
+            deletes = [key for key, row in pending.items() if row is None]
+            batches[table] = (rows, deletes)
+        self.clear()
+        return batches
+
+
+def delete_statements(redshift, table, keys, deleted):
+    """
+    Return DELETE statements removing rows of *table* whose *keys* columns
+    match any of the *deleted* key tuples.
+    """
+    statements = []
+    for start in range(0, len(deleted), DELETE_BATCH_SIZE):
+        chunk = deleted[start:start + DELETE_BATCH_SIZE]
+        if len(keys) == 1:
+            condition = '"{}" IN ({})'.format(
+                keys[0], ', '.join(['%s'] * len(chunk)))
+            params = tuple(key[0] for key in chunk)
+        else:
+            match = '(' + ' AND '.join('"{}" = %s'.format(k)
+                                       for k in keys) + ')'
+            condition = '\n   OR '.join([match] * len(chunk))
+            params = tuple(value for key in chunk for value in key)
+        statements.append(redshift.mogrify(
+            'DELETE FROM {}\nWHERE {}'.format(table, condition), params))
+    return statements
+
+
+def apply_changes(redshift, table, rows, deleted, keys, bucket, keypath,
+                  reflected=None, slices=4, codec='gzip'):
+    """
+    Apply one micro-batch of changes to the Redshift *table* in a single
+    transaction.
+
+    Parameters
+    ----------
+    redshift : `~shiftmanager.Redshift`
+    table : str
+        Target table, optionally schema-qualified
+    rows : list of dict
+        Rows to insert, replacing any with the same key
+    deleted : list of tuple
+        Key values of rows to delete
+    keys : list of str
+        Key columns
+    bucket, keypath : str
+        Where upserted rows are staged
+    reflected : :class:`~sqlalchemy.schema.Table`
+        *table* as already reflected; reflected if not given
+    slices : int
+        Files to split upserted rows into
+    codec : str
+        Compression for staged files
+
+    Returns
+    -------
+    `~shiftmanager.instrumentation.LoadReport`
+    """
+    report = LoadReport(table)
+    report.codec = codec
+    statements = delete_statements(redshift, table, keys, deleted)
+    storage = redshift.get_storage(bucket)
+    s3_sweep = []
+    try:
+        if rows:
+            if reflected is None:
+                schema, name = split_name(table)
+                reflected = redshift.reflected_table(name, schema=schema)
+            staging = '{}$staging_{}'.format(reflected.name,
+                                             uuid.uuid4().hex[:8])
+            create = "CREATE TEMP TABLE {} (LIKE {})".format(staging, table)
+            merge = redshift.merge_statement(reflected, staging, keys)
+            jsonpaths = {'jsonpaths': ["$['{}']".format(col.name)
+                                       for col in reflected.columns]}
+            manifest, jsonpaths = redshift._stage_json(
+                storage, keypath, rows, jsonpaths,
+                max(1, min(slices, len(rows))), None, True, s3_sweep,
+                report, 1, codec)
+            copy = redshift._json_copy_statement(staging, manifest,
+                                                 jsonpaths, codec)
+            statements = [create, copy.strip()] + statements + \
+                [merge.rstrip(';')]
+        with report.phase('copy'):
+            redshift.execute(';\n'.join(statements))
+        if rows:
+            report.copy_count = redshift._last_copy_count()
+    finally:
+        with report.phase('cleanup'):
+            storage.delete(s3_sweep)
+    report.records = len(rows) + len(deleted)
+    return report.finish()
+
+
+class _KeyColumns(object):
+    """Key columns per table: configured, else the Postgres primary key."""
+
+    def __init__(self, redshift, merge_keys):
+        self.redshift = redshift
+        if merge_keys is None:
+            merge_keys = {}
+        self.keys = dict((table, _key_list(keys))
+                         for table, keys in merge_keys.items())
+
+    def __call__(self, table):
+        keys = self.keys.get(table)
+        if keys is None:
+            with self.redshift.pg_connection as conn:
+                with conn.cursor() as cur:
+                    cur.execute(PRIMARY_KEY_QUERY, (table,))
+                    keys = [row[0] for row in cur.fetchall()]
+            if not keys:
+                raise ValueError("{} has no primary key; give its key "
+                                 "columns in merge_keys".format(table))
+            self.keys[table] = keys
+        return keys
+
+
+def _replication_connection(redshift):
+    import psycopg2
+    from psycopg2.extras import LogicalReplicationConnection
+
+    print("Opening replication connection to %s..." %
+          redshift.pg_args['host'])
+    return psycopg2.connect(connection_factory=LogicalReplicationConnection,
+                            **redshift.pg_args)
+
+
+def stream_changes(redshift, slot_name, bucket, keypath, tables=None,
+                   table_map=None, merge_keys=None, max_changes=10000,
+                   max_bytes=64 * 1024 * 1024, max_seconds=60,
+                   format_version=1, create_slot=False, slices=4,
+                   codec='gzip', report_callback=None, max_batches=None,
+                   connection=None):
+    """
+    Apply changes from a wal2json logical replication slot to Redshift.
+
+    See `PostgresMixin.stream_changes_to_redshift` for parameters.
+
+    Returns
+    -------
+    Number of micro-batches applied
+    """
+    table_map = table_map or {}
+    key_columns = _KeyColumns(redshift, merge_keys)
+    buffer = ChangeBuffer(key_columns)
+    reflected = {}
+    conn = connection or _replication_connection(redshift)
+    cur = conn.cursor()
+    if create_slot:
+        import psycopg2
+        try:
+            cur.create_replication_slot(slot_name, output_plugin='wal2json')
+        except psycopg2.ProgrammingError:
+            print("Replication slot {} already exists".format(slot_name))
+    options = {'format-version': str(format_version)}
+    cur.start_replication(slot_name=slot_name, decode=True, options=options)
+    print("Streaming changes from slot {}...".format(slot_name))
+
+    batches = 0
+    pending_lsn = None
+    in_transaction = False
+    while max_batches is None or batches < max_batches:
+        message = cur.read_message()
+        if message is not None:
+            changes, complete = parse_wal2json(message.payload,
+                                               format_version)
+            changes = [c for c in changes
+                       if tables is None or c.table in tables]
+            for change in changes:
+                buffer.add(change, len(message.payload) // len(changes))
+            in_transaction = not complete
+            if complete:
+                pending_lsn = message.data_start
+
+        if in_transaction:
+            continue
+        if buffer.ready(max_changes, max_bytes, max_seconds):
+            for table, (rows, deleted) in buffer.drain().items():
+                target = table_map.get(table, table)
+                if rows and target not in reflected:
+                    schema, name = split_name(target)
+                    reflected[target] = redshift.reflected_table(
+                        name, schema=schema)
+                report = apply_changes(
+                    redshift, target, rows, deleted, key_columns(table),
+                    bucket, keypath, reflected.get(target), slices, codec)
+                if report_callback is not None:
+                    report_callback(report)
+            # Only now is it safe for the server to discard these changes
+            cur.send_feedback(flush_lsn=pending_lsn)
+            pending_lsn = None
+            batches += 1
+        elif not buffer.changes and pending_lsn is not None:
+            # Nothing relevant to apply; let the server move on
+            cur.send_feedback(flush_lsn=pending_lsn)
+            pending_lsn = None
+        elif message is None:
+            # Wake up at least every 10 seconds to send keepalives
+            timeout = 10
+            if max_seconds is not None:
+                timeout = min(timeout, max_seconds - buffer.age
+                              if buffer.changes else max_seconds)
+            ready, _, _ = select.select([conn], [], [], max(0.1, timeout))
+            if not ready:
+                cur.send_feedback()
+    return batches
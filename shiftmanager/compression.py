@@ -0,0 +1,310 @@
+"""
+Compression codecs for files staged to S3 for COPY.
+
+Each `Codec` knows how to compress data in Python, the shell command that
+does the same in a pipeline, the file extension to use, and the option
+telling Redshift's COPY how to decompress. gzip and bzip2 use the standard
+library; zstd uses the ``zstandard`` package when installed and the
+``zstd`` command otherwise; lzop always uses the ``lzop`` command.
+
+`choose_codec` compresses a sample with each available codec and picks the
+one minimizing estimated compression plus upload time.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+import bz2
+import gzip
+from io import BytesIO
+import subprocess
+from timeit import default_timer
+
+from shiftmanager.util import which
+
+# Assumed upload bandwidth in bytes per second, until one is measured
+DEFAULT_UPLOAD_BANDWIDTH = 50 * 1000 * 1000
+
+
+class Codec(object):
+    """
+    A compression format Redshift can COPY from.
+
+    Attributes
+    ----------
+    name : str
+        Name used to select the codec, e.g. ``'zstd'``
+    extension : str
+        File extension for compressed files, e.g. ``'.zst'``
+    copy_option : str
+        COPY option naming the format, e.g. ``'ZSTD'``
+    command : str
+        Shell command compressing stdin to stdout
+    default_level : int
+        Level used when none is given
+    """
+
+    name = None
+    extension = ''
+    copy_option = ''
+    command = None
+    default_level = None
+
+    def available(self):
+        """Whether this codec can run in the current environment."""
+        return True
+
+    def shell_available(self):
+        """Whether `shell_command` can run in the current environment."""
+        return which(self.command.split()[0]) is not None
+
+    def compress(self, data, level=None):
+        """Return *data* (bytes) compressed at *level*."""
+        raise NotImplementedError
+
+    def decompress(self, data):
+        raise NotImplementedError
+
+    def write(self, path, data, level=None):
+        """Write *data* (bytes) compressed at *level* to the file *path*."""
+        with open(path, 'wb') as f:
+            f.write(self.compress(data, level))
+
+    def shell_command(self, level=None):
+        """
+        Return a shell command compressing stdin to stdout at *level*.
+
+        >>> print(get_codec('gzip').shell_command())
+        gzip
+        >>> print(get_codec('zstd').shell_command(9))
+        zstd -q -c -9
+        """
+        if level is None:
+            return self.command
+        return '{} -{}'.format(self.command, level)
+
+    def _level(self, level):
+        return self.default_level if level is None else level
+
+    def __repr__(self):
+        return '<Codec {}>'.format(self.name)
+
+
+class NoCodec(Codec):
+    """Uncompressed files."""
+
+    name = 'none'
+    command = 'cat'
+
+    def compress(self, data, level=None):
+        return data
+
+    def decompress(self, data):
+        return data
+
+    def shell_command(self, level=None):
+        return self.command
+
+
+class GzipCodec(Codec):
+
+    name = 'gzip'
+    extension = '.gz'
+    copy_option = 'GZIP'
+    command = 'gzip'
+    default_level = 9
+
+    def compress(self, data, level=None):
+        buf = BytesIO()
+        with gzip.GzipFile(fileobj=buf, mode='wb',
+                           compresslevel=self._level(level)) as f:
+            f.write(data)
+        return buf.getvalue()
+
+    def decompress(self, data):
+        with gzip.GzipFile(fileobj=BytesIO(data), mode='rb') as f:
+            return f.read()
+
+    def write(self, path, data, level=None):
+        with gzip.open(path, 'wb', compresslevel=self._level(level)) as f:
+            f.write(data)
+
+
+class Bzip2Codec(Codec):
+
+    name = 'bzip2'
+    extension = '.bz2'
+    copy_option = 'BZIP2'
+    command = 'bzip2'
+    default_level = 9
+
+    def compress(self, data, level=None):
+        return bz2.compress(data, self._level(level))
+
+    def decompress(self, data):
+        return bz2.decompress(data)
+
+
+class CommandCodec(Codec):
+    """A codec running its shell command in a subprocess."""
+
+    def available(self):
+        return self.shell_available()
+
+    def _run(self, args, data):
+        process = subprocess.Popen(args, stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE)
+        output, _ = process.communicate(data)
+        if process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, args)
+        return output
+
+    def compress(self, data, level=None):
+        return self._run(self.shell_command(self._level(level)).split(),
+                         data)
+
+    def decompress(self, data):
+        return self._run(self.command.split() + ['-d'], data)
+
+
+class ZstdCodec(CommandCodec):
+
+    name = 'zstd'
+    extension = '.zst'
+    copy_option = 'ZSTD'
+    command = 'zstd -q -c'
+    default_level = 3
+
+    def _module(self):
+        try:
+            import zstandard
+        except ImportError:
+            return None
+        return zstandard
+
+    def available(self):
+        return (self._module() is not None or
+                super(ZstdCodec, self).available())
+
+    def compress(self, data, level=None):
+        zstandard = self._module()
+        if zstandard is None:
+            return super(ZstdCodec, self).compress(data, level)
+        compressor = zstandard.ZstdCompressor(level=self._level(level))
+        return compressor.compress(data)
+
+    def decompress(self, data):
+        zstandard = self._module()
+        if zstandard is None:
+            return super(ZstdCodec, self).decompress(data)
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+
+
+class LzopCodec(CommandCodec):
+
+    name = 'lzop'
+    extension = '.lzo'
+    copy_option = 'LZOP'
+    command = 'lzop -q -c'
+    default_level = 3
+
+
+CODECS = dict((codec.name, codec) for codec in (
+    NoCodec(), GzipCodec(), Bzip2Codec(), ZstdCodec(), LzopCodec()))
+
+
+def get_codec(codec):
+    """
+    Return the `Codec` named *codec*; None means uncompressed.
+
+    >>> get_codec('bzip2')
+    <Codec bzip2>
+    """
+    if isinstance(codec, Codec):
+        return codec
+    if codec is None:
+        codec = 'none'
+    try:
+        return CODECS[codec.lower()]
+    except KeyError:
+        raise ValueError("Unknown codec {!r}; expected one of {}".format(
+            codec, ', '.join(sorted(CODECS))))
+
+
+def shell_codecs():
+    """
+    Return the names of codecs whose shell commands can run here, for
+    pipelines that compress with `Codec.shell_command`.
+    """
+    return sorted(name for name, codec in CODECS.items()
+                  if codec.shell_available())
+
+
+def measure_codecs(sample, codecs=None, levels=None):
+    """
+    Compress *sample* (bytes) with each available codec.
+
+    Parameters
+    ----------
+    sample : bytes
+    codecs : list of str
+        Codec names to try; defaults to every codec
+    levels : dict
+        Level to use per codec name; defaults to each codec's default
+
+    Returns
+    -------
+    list of dicts with codec, level, seconds and ratio (compressed size
+    over raw size)
+    """
+    levels = levels or {}
+    results = []
+    for name in codecs or sorted(CODECS):
+        codec = get_codec(name)
+        if not codec.available():
+            continue
+        level = levels.get(codec.name)
+        start = default_timer()
+        compressed = codec.compress(sample, level)
+        seconds = default_timer() - start
+        results.append({'codec': codec.name, 'level': level,
+                        'seconds': seconds,
+                        'ratio': len(compressed) / max(len(sample), 1)})
+    return results
+
+
+def choose_codec(sample, upload_bandwidth=None, processes=1, codecs=None,
+                 levels=None):
+    """
+    Pick the codec minimizing estimated compression plus upload time.
+
+    Per raw byte, the estimate is the sample's compression time (divided
+    among *processes* parallel compressors) plus its compressed size over
+    *upload_bandwidth*. A fast network favours cheap codecs; a slow one
+    favours smaller output.
+
+    Parameters
+    ----------
+    sample : bytes
+        Representative uncompressed data
+    upload_bandwidth : float
+        Bytes per second; defaults to `DEFAULT_UPLOAD_BANDWIDTH`
+    processes : int
+        Number of files compressed in parallel
+    codecs, levels
+        As for `measure_codecs`
+
+    Returns
+    -------
+    (codec name, list of measurements from `measure_codecs`, each with an
+    added ``estimated_seconds_per_mb``)
+    """
+    bandwidth = upload_bandwidth or DEFAULT_UPLOAD_BANDWIDTH
+    size = max(len(sample), 1)
+    results = measure_codecs(sample, codecs, levels)
+    for result in results:
+        per_byte = (result['seconds'] / size / max(processes, 1) +
+                    result['ratio'] / bandwidth)
+        result['estimated_seconds_per_mb'] = per_byte * 1e6
+    best = min(results, key=lambda r: r['estimated_seconds_per_mb'])
+    return best['codec'], results
@@ -0,0 +1,265 @@
+"""
+Stage pandas DataFrames and Arrow tables for COPY, and assemble query
+results into them.
+
+Turning columnar data into dicts only to serialize them as JSON again
+costs a Python object per value. Instead, row ranges of a frame are
+written straight to CSV, with pandas' vectorized writer, or to Parquet,
+with Arrow, and COPYed by the same staging, manifest and load mode steps
+as JSON.
+
+Query results are read back either as batches of rows from a cursor,
+assembled column by column, or as Parquet files written by UNLOAD.
+
+pandas and pyarrow are optional. Each is imported only when a frame
+needs it: CSV needs pandas and Parquet needs pyarrow.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import importlib
+from io import StringIO
+import os
+import re
+from timeit import default_timer
+
+from shiftmanager.compression import get_codec
+from shiftmanager.projection import CSV_NULL
+
+FORMATS = ('csv', 'parquet')
+
+OUTPUTS = ('pandas', 'arrow')
+
+
+def _require(module, purpose):
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise ImportError("{} requires {}, which is not installed".format(
+            purpose, module.split('.')[0]))
+
+
+def is_arrow(frame):
+    """Whether *frame* is an Arrow table rather than a DataFrame."""
+    return not hasattr(frame, 'iloc')
+
+
+def as_frame(data):
+    """
+    Return *data*, a DataFrame, Arrow table, Arrow record batch or
+    iterable of record batches, as a DataFrame or Arrow table.
+    """
+    if hasattr(data, 'iloc'):
+        return data
+    pa = _require('pyarrow', 'Loading Arrow data')
+    if isinstance(data, pa.Table):
+        return data
+    if isinstance(data, pa.RecordBatch):
+        return pa.Table.from_batches([data])
+    return pa.Table.from_batches(list(data))
+
+
+def default_format(frame):
+    """Parquet for Arrow tables, which pandas would have to convert."""
+    return 'parquet' if is_arrow(frame) else 'csv'
+
+
+def frame_columns(frame):
+    """Return the column labels of *frame*."""
+    if is_arrow(frame):
+        return list(frame.schema.names)
+    return list(frame.columns)
+
+
+def map_columns(names, table_columns, column_map=None):
+    """
+    Return (frame column, table column) pairs for the frame columns
+    *names* that are loaded, in frame order.
+
+    *column_map* renames frame columns, or leaves them out when mapped to
+    None. Other names match *table_columns* ignoring case, since Redshift
+    folds unquoted identifiers to lower case.
+
+    >>> map_columns(['ID', 'when', 'tmp'], ['id', 'created_at', 'note'],
+    ...             {'when': 'created_at', 'tmp': None})
+    [('ID', 'id'), ('when', 'created_at')]
+    """
+    column_map = column_map or {}
+    lookup = dict((col.lower(), col) for col in table_columns)
+    pairs = []
+    unknown = []
+    for name in names:
+        target = column_map.get(name, name)
+        if target is None:
+            continue
+        column = lookup.get(str(target).lower())
+        if column is None:
+            unknown.append(str(name))
+        else:
+            pairs.append((name, column))
+    if unknown:
+        raise ValueError("No table columns match frame columns {}".format(
+            ', '.join(unknown)))
+    targets = [column for _, column in pairs]
+    duplicates = sorted(set(c for c in targets if targets.count(c) > 1))
+    if duplicates:
+        raise ValueError("Several frame columns map to {}".format(
+            ', '.join(duplicates)))
+    return pairs
+
+
+def integer_columns(pairs, table):
+    """
+    Return the frame columns of (frame column, table column) *pairs* that
+    load into integer columns of *table*, a reflected
+    :class:`~sqlalchemy.schema.Table`.
+    """
+    import sqlalchemy as sa
+
+    types = dict((col.name, col.type) for col in table.columns)
+    return [name for name, col in pairs if isinstance(types[col], sa.Integer)]
+
+
+def select_columns(frame, names):
+    """Return the columns *names* of *frame*, in that order."""
+    if is_arrow(frame):
+        return frame.select(names)
+    return frame[names]
+
+
+def slice_frame(frame, start, stop):
+    """Return rows *start* up to *stop* of *frame*."""
+    if is_arrow(frame):
+        return frame.slice(start, max(0, stop - start))
+    return frame.iloc[start:stop]
+
+
+def write_csv_chunk(frame, write_path, codec='gzip', level=None,
+                    integer_columns=()):
+    """
+    Write *frame* as headerless CSV to *write_path*, compressed with
+    *codec* at *level*. Nulls are written as ``\\N``, which COPY reads
+    with NULL AS.
+
+    pandas keeps integers with nulls as floats, written like ``1.0``,
+    which COPY rejects for integer columns; *integer_columns* of float
+    type are written as nullable integers instead.
+
+    Returns
+    -------
+    dict of records, raw_bytes, compressed_bytes, serialize_seconds and
+    compress_seconds
+    """
+    start = default_timer()
+    if is_arrow(frame):
+        _require('pandas', 'Writing Arrow data as CSV')
+        frame = frame.to_pandas()
+    floats = dict((col, 'Int64') for col in integer_columns
+                  if frame[col].dtype.kind == 'f')
+    if floats:
+        frame = frame.astype(floats)
+    buf = StringIO()
+    frame.to_csv(buf, header=False, index=False, na_rep=CSV_NULL,
+                 date_format='%Y-%m-%d %H:%M:%S.%f')
+    encoded = buf.getvalue().encode('utf-8')
+    serialized = default_timer()
+    get_codec(codec).write(write_path, encoded, level)
+    compressed = default_timer()
+    return {
+        'records': len(frame),
+        'raw_bytes': len(encoded),
+        'compressed_bytes': os.path.getsize(write_path),
+        'serialize_seconds': serialized - start,
+        'compress_seconds': compressed - serialized,
+    }
+
+
+def write_parquet_chunk(frame, write_path, compression='snappy'):
+    """
+    Write *frame* as a Parquet file to *write_path*, with *compression*
+    applied inside the file. Timestamps are stored in microseconds, the
+    finest precision Redshift keeps.
+
+    Returns
+    -------
+    dict of records, compressed_bytes and serialize_seconds
+    """
+    pa = _require('pyarrow', 'Writing Parquet')
+    pq = _require('pyarrow.parquet', 'Writing Parquet')
+    start = default_timer()
+    if not is_arrow(frame):
+        frame = pa.Table.from_pandas(frame, preserve_index=False)
+    pq.write_table(frame, write_path, compression=compression,
+                   coerce_timestamps='us', allow_truncated_timestamps=True)
+    return {
+        'records': frame.num_rows,
+        'compressed_bytes': os.path.getsize(write_path),
+        'serialize_seconds': default_timer() - start,
+    }
+
+
+# Estimated rows and bytes per row of an EXPLAIN plan node
+EXPLAIN_ROWS_RE = re.compile(r'rows=(\d+) width=(\d+)')
+
+
+def estimate_result_bytes(plan):
+    """
+    Return the size of a query's result estimated from the top node of
+    its ``EXPLAIN`` *plan*, a list of lines, or None if it has no
+    estimate.
+
+    >>> estimate_result_bytes([
+    ...     'XN Seq Scan on events  (cost=0.00..2.00 rows=200 width=36)'])
+    7200
+    """
+    for line in plan:
+        match = EXPLAIN_ROWS_RE.search(line)
+        if match:
+            return int(match.group(1)) * int(match.group(2))
+    return None
+
+
+def columns_to_frame(names, columns, output='pandas'):
+    """
+    Assemble lists of column values into a DataFrame, for 'pandas'
+    *output*, or an Arrow table, for 'arrow'.
+    """
+    if output == 'arrow':
+        pa = _require('pyarrow', 'Reading into Arrow')
+        return pa.Table.from_arrays([pa.array(values) for values in columns],
+                                    names)
+    pd = _require('pandas', 'Reading into a DataFrame')
+    # Keyed by position, so repeated column names are kept
+    frame = pd.DataFrame(dict(enumerate(columns)),
+                         columns=list(range(len(names))))
+    frame.columns = names
+    return frame
+
+
+def read_parquet_keys(storage, keys, directory, max_workers=None):
+    """
+    Download the Parquet files at *keys* of *storage* into *directory* and
+    read them into a single Arrow table. Each file is downloaded and
+    decoded in its own thread, so reads overlap transfers.
+    """
+    from multiprocessing.pool import ThreadPool
+
+    pa = _require('pyarrow', 'Reading Parquet')
+    pq = _require('pyarrow.parquet', 'Reading Parquet')
+
+    def read(key):
+        path = os.path.join(directory, key.replace('/', '_'))
+        storage.get_filename(key, path)
+        try:
+            return pq.read_table(path)
+        finally:
+            os.remove(path)
+
+    workers = min(max_workers or storage.max_workers, len(keys)) or 1
+    pool = ThreadPool(workers)
+    try:
+        tables = pool.map(read, keys)
+    finally:
+        pool.close()
+        pool.join()
+    return pa.concat_tables(tables)
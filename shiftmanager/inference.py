@@ -0,0 +1,549 @@
+"""
+Infer Redshift jsonpaths and per-field statistics from streams of documents.
+
+`infer_jsonpaths` walks every document of an iterable, or a bounded
+reservoir sample of it, merging field paths and observed value types into a
+`JsonPathInference`. Memory use is proportional to the number of distinct
+paths (plus the sample, when sampling), not the number of documents.
+
+`infer_table` goes further, profiling values to build a right-sized
+:class:`~sqlalchemy.schema.Table` with encodings and suggested dist and sort
+keys.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import math
+import numbers
+import random
+import re
+
+# Type names reported in PathStats.types
+TYPE_NAMES = ('null', 'boolean', 'integer', 'number', 'string', 'array',
+              'object')
+
+# ISO 8601 dates and timestamps, as accepted by COPY's TIMEFORMAT 'auto'
+TIMESTAMP_RE = re.compile(r"""
+    ^\d{4}-\d{2}-\d{2}                         # date
+    (?P<time>[T\ ]\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?)?  # time
+    (?P<tz>Z|[+-]\d{2}(?::?\d{2})?)?$            # offset
+""", re.VERBOSE)
+
+# Final path component naming an id, like ['id'] or ['user_id']
+ID_NAME_RE = re.compile(r"\['(?:\w*_)?id'\]$", re.IGNORECASE)
+
+# Limits of Redshift's integer types
+SMALLINT_MAX = 2 ** 15 - 1
+INTEGER_MAX = 2 ** 31 - 1
+BIGINT_MAX = 2 ** 63 - 1
+
+# Longest VARCHAR Redshift allows, in bytes
+VARCHAR_MAX = 65535
+
+# VARCHAR length for fields only ever seen as null
+UNKNOWN_VARCHAR_LENGTH = 256
+
+# Encodings supported by AZ64
+AZ64_TYPES = ('smallint', 'integer', 'bigint', 'decimal', 'date',
+              'timestamp', 'timestamptz')
+
+
+def value_type(value):
+    """
+    Return the JSON type name of a parsed *value*.
+
+    >>> value_type(True), value_type(3), value_type(3.5), value_type('a')
+    ('boolean', 'integer', 'number', 'string')
+    """
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'boolean'
+    if isinstance(value, numbers.Integral):
+        return 'integer'
+    if isinstance(value, numbers.Real):
+        return 'number'
+    if isinstance(value, dict):
+        return 'object'
+    if isinstance(value, list):
+        return 'array'
+    return 'string'
+
+
+def reservoir_sample(iterable, size, seed=None):
+    """
+    Return a uniform random sample of up to *size* items from *iterable*,
+    reading it once and holding at most *size* items in memory.
+
+    >>> reservoir_sample(range(3), 5)
+    [0, 1, 2]
+    >>> len(reservoir_sample(range(1000), 10, seed=0))
+    10
+    """
+    rand = random.Random(seed)
+    sample = []
+    for i, item in enumerate(iterable):
+        if i < size:
+            sample.append(item)
+        else:
+            j = rand.randint(0, i)
+            if j < size:
+                sample[j] = item
+    return sample
+
+
+class PathStats(object):
+    """
+    Statistics for a single jsonpath.
+
+    Attributes
+    ----------
+    count : int
+        Documents in which the path is present, including as null
+    nulls : int
+        Documents in which the path is null, or the indexed array element
+        is missing
+    types : dict
+        Count of documents per observed type name, from `TYPE_NAMES`
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.nulls = 0
+        self.types = {}
+
+    def add(self, value):
+        self.count += 1
+        type_name = value_type(value)
+        if type_name == 'null':
+            self.nulls += 1
+        self.types[type_name] = self.types.get(type_name, 0) + 1
+
+    @property
+    def type(self):
+        """The most common non-null type, or 'null' if only nulls were seen"""
+        non_null = [(n, t) for t, n in self.types.items() if t != 'null']
+        if not non_null:
+            return 'null'
+        return max(non_null)[1]
+
+    def as_dict(self):
+        return {'count': self.count, 'nulls': self.nulls,
+                'types': dict(self.types), 'type': self.type}
+
+
+class ColumnProfile(PathStats):
+    """
+    `PathStats` that also profile values for choosing column types.
+
+    Distinct values are tracked by hash up to *distinct_limit*, so memory
+    stays bounded however many documents are seen.
+
+    Attributes
+    ----------
+    min, max : int or float
+        Smallest and largest numeric values
+    max_bytes : int
+        Longest string, in UTF-8 bytes; nested objects and arrays are
+        measured as serialized JSON
+    timestamps, dates, timezones : int
+        Strings parsing as ISO 8601 timestamps, as bare dates, and with a
+        UTC offset
+    distinct : set
+        Hashes of non-null values, up to *distinct_limit*
+    distinct_overflow : bool
+        True once more than *distinct_limit* distinct values were seen
+    """
+
+    distinct_limit = 10000
+
+    def __init__(self):
+        super(ColumnProfile, self).__init__()
+        self.min = None
+        self.max = None
+        self.max_bytes = 0
+        self.timestamps = 0
+        self.dates = 0
+        self.timezones = 0
+        self.distinct = set()
+        self.distinct_overflow = False
+
+    def add(self, value):
+        super(ColumnProfile, self).add(value)
+        if value is None:
+            return
+        if isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        if isinstance(value, bool):
+            text = 'true' if value else 'false'
+        elif isinstance(value, numbers.Number):
+            if self.min is None or value < self.min:
+                self.min = value
+            if self.max is None or value > self.max:
+                self.max = value
+            text = repr(value)
+        else:
+            text = value
+            match = TIMESTAMP_RE.match(value)
+            if match:
+                self.timestamps += 1
+                if match.group('time') is None:
+                    self.dates += 1
+                if match.group('tz') is not None:
+                    self.timezones += 1
+        self.max_bytes = max(self.max_bytes, len(text.encode('utf-8')))
+        if not self.distinct_overflow:
+            self.distinct.add(hash(value))
+            if len(self.distinct) > self.distinct_limit:
+                self.distinct_overflow = True
+                self.distinct = set()
+
+    @property
+    def non_null(self):
+        return self.count - self.nulls
+
+    @property
+    def cardinality(self):
+        """Fraction of non-null values that were distinct."""
+        if not self.non_null:
+            return 0.0
+        if self.distinct_overflow:
+            return 1.0
+        return len(self.distinct) / self.non_null
+
+    def redshift_type(self, varchar_headroom=1.5):
+        """
+        Return the narrowest Redshift type name holding every value seen,
+        e.g. ``'smallint'`` or ``'varchar(64)'``.
+
+        VARCHAR lengths are the longest value times *varchar_headroom*,
+        rounded up to a power of two.
+        """
+        types = set(self.types) - {'null'}
+        if not types:
+            return 'varchar({})'.format(UNKNOWN_VARCHAR_LENGTH)
+        if types == {'boolean'}:
+            return 'boolean'
+        if types == {'integer'}:
+            bound = max(abs(self.min), abs(self.max))
+            if bound <= SMALLINT_MAX:
+                return 'smallint'
+            if bound <= INTEGER_MAX:
+                return 'integer'
+            if bound <= BIGINT_MAX:
+                return 'bigint'
+            return 'decimal(38,0)'
+        if types <= {'integer', 'number'}:
+            return 'double precision'
+        if types == {'string'} and self.timestamps == self.non_null:
+            if self.dates == self.non_null:
+                return 'date'
+            if self.timezones:
+                return 'timestamptz'
+            return 'timestamp'
+        length = max(1, int(math.ceil(self.max_bytes * varchar_headroom)))
+        length = 2 ** int(math.ceil(math.log(length, 2)))
+        return 'varchar({})'.format(min(length, VARCHAR_MAX))
+
+    def as_dict(self):
+        result = super(ColumnProfile, self).as_dict()
+        result.update({'min': self.min, 'max': self.max,
+                       'max_bytes': self.max_bytes,
+                       'cardinality': self.cardinality,
+                       'redshift_type': self.redshift_type()})
+        return result
+
+
+class JsonPathInference(object):
+    """
+    Accumulates jsonpaths and statistics over a stream of documents.
+
+    Paths are built the same way as `util.recur_dict`: nested dicts are
+    followed and arrays contribute a single path at index *list_idx*.
+
+    Parameters
+    ----------
+    list_idx : int
+        Index used for array fields; defaults to 0
+    path_stats_class : type
+        Class collecting statistics per path; `ColumnProfile` additionally
+        profiles values
+    """
+
+    def __init__(self, list_idx=None, path_stats_class=PathStats):
+        self.list_idx = list_idx or 0
+        self.path_stats_class = path_stats_class
+        self.documents = 0
+        self.paths = {}
+
+    def update(self, doc):
+        """Merge the paths of *doc*, a dict or JSON string."""
+        if not isinstance(doc, dict):
+            doc = json.loads(doc)
+        self.documents += 1
+        self._walk(doc, '$')
+        return self
+
+    def update_many(self, docs):
+        for doc in docs:
+            self.update(doc)
+        return self
+
+    def _observe(self, path, value):
+        stats = self.paths.get(path)
+        if stats is None:
+            stats = self.paths[path] = self.path_stats_class()
+        stats.add(value)
+
+    def _walk(self, value, parent):
+        for k, v in value.items():
+            path = "{}['{}']".format(parent, k)
+            if isinstance(v, dict):
+                self._walk(v, path)
+            elif isinstance(v, list):
+                element = (v[self.list_idx] if len(v) > self.list_idx
+                           else None)
+                self._observe("{}[{}]".format(path, self.list_idx), element)
+            else:
+                self._observe(path, v)
+
+    def frequency(self, path):
+        """Fraction of documents in which *path* is present."""
+        if not self.documents:
+            return 0.0
+        return self.paths[path].count / self.documents
+
+    def jsonpaths(self, min_frequency=0.0):
+        """
+        Return a Redshift jsonpaths dict covering every path seen in at
+        least *min_frequency* of documents, ordered alphabetically.
+        """
+        return {"jsonpaths": sorted(
+            path for path in self.paths
+            if self.frequency(path) >= min_frequency)}
+
+    def stats(self):
+        """Return a dict of path to its statistics and frequency."""
+        result = {}
+        for path, stats in self.paths.items():
+            entry = stats.as_dict()
+            entry['frequency'] = self.frequency(path)
+            result[path] = entry
+        return result
+
+
+def infer_jsonpaths(docs, sample_size=None, list_idx=None, seed=None):
+    """
+    Infer jsonpaths and per-path statistics from an iterable of documents.
+
+    Parameters
+    ----------
+    docs : iterable of dicts or JSON strings
+    sample_size : int
+        If given, merge a uniform reservoir sample of this many documents;
+        otherwise merge every document as it streams past
+    list_idx : int
+        Index used for array fields
+    seed : int
+        Seed for the reservoir sample
+
+    Returns
+    -------
+    `JsonPathInference`
+
+    Example
+    -------
+    >>> inferred = infer_jsonpaths([{"a": 1}, {"a": 2, "b": {"c": "x"}}])
+    >>> inferred.jsonpaths()
+    {'jsonpaths': ["$['a']", "$['b']['c']"]}
+    >>> inferred.frequency("$['b']['c']")
+    0.5
+    """
+    if sample_size is not None:
+        docs = reservoir_sample(docs, sample_size, seed)
+    return JsonPathInference(list_idx).update_many(docs)
+
+
+def column_name(path):
+    """
+    Return a column name for a jsonpath, joining its components.
+
+    >>> print(column_name("$['User']['First Name']"))
+    user_first_name
+    >>> print(column_name("$['tags'][0]"))
+    tags_0
+    """
+    parts = re.findall(r"\['([^']*)'\]|\[(\d+)\]", path)
+    name = '_'.join(key or idx for key, idx in parts)
+    return re.sub(r'[^0-9a-z_$]+', '_', name.lower()).strip('_') or 'col'
+
+
+def _sqlalchemy_type(redshift_type):
+    import sqlalchemy as sa
+    from sqlalchemy.dialects.postgresql import DOUBLE_PRECISION
+
+    match = re.match(r'(varchar|decimal)\((\d+)(?:,(\d+))?\)', redshift_type)
+    if match:
+        if match.group(1) == 'varchar':
+            return sa.VARCHAR(int(match.group(2)))
+        return sa.DECIMAL(int(match.group(2)), int(match.group(3)))
+    return {
+        'boolean': sa.BOOLEAN,
+        'smallint': sa.SMALLINT,
+        'integer': sa.INTEGER,
+        'bigint': sa.BIGINT,
+        'double precision': DOUBLE_PRECISION,
+        'date': sa.DATE,
+        'timestamp': sa.TIMESTAMP,
+        'timestamptz': lambda: sa.TIMESTAMP(timezone=True),
+    }[redshift_type]()
+
+
+def suggest_encoding(profile, redshift_type, sortkey=False):
+    """
+    Suggest a column compression encoding.
+
+    The leading sort key column is left uncompressed, so range-restricted
+    scans can skip blocks cheaply. Types supported by AZ64 use it, low
+    cardinality strings use BYTEDICT and everything else uses ZSTD.
+    """
+    base_type = redshift_type.split('(')[0]
+    if sortkey or base_type == 'boolean':
+        return 'raw'
+    if base_type in AZ64_TYPES:
+        return 'az64'
+    if (base_type == 'varchar' and not profile.distinct_overflow and
+            0 < len(profile.distinct) < 256):
+        return 'bytedict'
+    return 'zstd'
+
+
+def suggest_distkey(profiles, documents, min_cardinality=0.9):
+    """
+    Return the path best suited to be the distribution key, or None.
+
+    Candidates are present and non-null in every document and have at
+    least *min_cardinality* distinct values, so rows spread evenly across
+    slices. The most distinct wins, preferring id-like names since those
+    are the usual join columns.
+    """
+    candidates = sorted(
+        (-profile.cardinality, not ID_NAME_RE.search(path), path)
+        for path, profile in profiles.items()
+        if profile.non_null == documents and
+        profile.cardinality >= min_cardinality and
+        set(profile.types) <= {'integer', 'string'})
+    if candidates:
+        return candidates[0][-1]
+
+
+def suggest_sortkey(profiles):
+    """
+    Return the path best suited to be the sort key, or None.
+
+    Loads of event-like feeds arrive roughly in time order, so the
+    timestamp or date column with the fewest nulls is preferred.
+    """
+    candidates = sorted(
+        (profile.nulls, path) for path, profile in profiles.items()
+        if set(profile.types) - {'null'} == {'string'} and
+        profile.timestamps == profile.non_null)
+    if candidates:
+        return candidates[0][1]
+
+
+def infer_table(name, docs, metadata=None, schema=None, sample_size=10000,
+                list_idx=None, seed=None, varchar_headroom=1.5,
+                distkey=None, sortkey=None):
+    """
+    Build a :class:`~sqlalchemy.schema.Table` sized for a stream of documents.
+
+    Columns follow the order of the inferred jsonpaths (available as
+    ``table.info['jsonpaths']``), so the jsonpaths can be used to COPY
+    the same feed into the table. Each column's ``info['jsonpath']``
+    records the path it was built from. All columns are nullable, since a
+    sample can't prove a field is always present.
+
+    Parameters
+    ----------
+    name : str
+        Table name
+    docs : iterable of dicts or JSON strings
+    metadata : :class:`~sqlalchemy.schema.MetaData`
+        Defaults to a new, empty MetaData
+    schema : str
+        Schema for the table
+    sample_size : int
+        Documents to sample; None profiles every document
+    list_idx : int
+        Index used for array fields
+    seed : int
+        Seed for the reservoir sample
+    varchar_headroom : float
+        Multiplier applied to the longest string seen when sizing VARCHARs
+    distkey, sortkey : str
+        Column names overriding the suggested keys; pass False to suggest
+        none
+
+    Returns
+    -------
+    :class:`~sqlalchemy.schema.Table`
+    """
+    import sqlalchemy as sa
+
+    if sample_size is not None:
+        docs = reservoir_sample(docs, sample_size, seed)
+    inferred = JsonPathInference(list_idx, ColumnProfile).update_many(docs)
+    jsonpaths = inferred.jsonpaths()
+    profiles = inferred.paths
+
+    names = {}
+    for path in jsonpaths['jsonpaths']:
+        col_name = candidate = column_name(path)
+        suffix = 1
+        while candidate in names.values():
+            suffix += 1
+            candidate = '{}_{}'.format(col_name, suffix)
+        names[path] = candidate
+    for key in (distkey, sortkey):
+        if key and key not in names.values():
+            raise ValueError("{} is not an inferred column".format(key))
+
+    if distkey is None:
+        distkey_path = suggest_distkey(profiles, inferred.documents)
+        distkey = names.get(distkey_path)
+    if sortkey is None:
+        sortkey_path = suggest_sortkey(profiles)
+        sortkey = names.get(sortkey_path)
+
+    columns = []
+    for path in jsonpaths['jsonpaths']:
+        profile = profiles[path]
+        redshift_type = profile.redshift_type(varchar_headroom)
+        encoding = suggest_encoding(profile, redshift_type,
+                                    sortkey=names[path] == sortkey)
+        info = {'encode': encoding, 'jsonpath': path}
+        try:
+            col = sa.Column(names[path], _sqlalchemy_type(redshift_type),
+                            info=info, redshift_encode=encoding)
+        except (TypeError, sa.exc.ArgumentError):
+            # Before SQLAlchemy 1.3 the Redshift dialect reads column.info
+            col = sa.Column(names[path], _sqlalchemy_type(redshift_type),
+                            info=info)
+        columns.append(col)
+
+    table_kwargs = {}
+    if distkey:
+        table_kwargs['redshift_diststyle'] = 'KEY'
+        table_kwargs['redshift_distkey'] = distkey
+    else:
+        table_kwargs['redshift_diststyle'] = 'EVEN'
+    if sortkey:
+        table_kwargs['redshift_sortkey'] = sortkey
+
+    table = sa.Table(name, metadata if metadata is not None else sa.MetaData(),
+                     *columns, schema=schema, **table_kwargs)
+    table.info['jsonpaths'] = jsonpaths
+    table.info['documents'] = inferred.documents
+    return table
@@ -0,0 +1,339 @@
+"""
+Hooks for observing the statements run by `Redshift.execute`.
+
+A hook is any object defining ``before_execute(record)`` and/or
+``after_execute(record)``; register it with `Redshift.add_execute_hook`.
+Each call to `execute` produces one `ExecutionRecord`, passed to every
+hook before the batch runs and again after it finishes (or fails).
+
+`LoadReport` collects per-phase timings for the load and unload pipelines.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import bisect
+from contextlib import contextmanager
+import re
+import sys
+from timeit import default_timer
+
+OPERATIONS = ('COPY', 'UNLOAD', 'DEEP COPY', 'DDL', 'DML', 'QUERY', 'OTHER')
+
+DDL_KEYWORDS = {'CREATE', 'ALTER', 'DROP', 'TRUNCATE', 'GRANT', 'REVOKE',
+                'COMMENT'}
+DML_KEYWORDS = {'INSERT', 'UPDATE', 'DELETE', 'MERGE'}
+QUERY_KEYWORDS = {'SELECT', 'WITH', 'EXPLAIN', 'SHOW'}
+
+# Leading keyword of each statement in a batch, skipping SQL comments
+STATEMENT_KEYWORD_RE = re.compile(r"""
+    (?:^|;)                     # start of batch or end of previous statement
+    (?:\s+|--[^\n]*\n)*         # whitespace and line comments
+    ([A-Za-z]+)                 # the keyword
+""", re.VERBOSE)
+
+# Default histogram bucket upper bounds, in seconds
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+
+def classify_statement(batch):
+    """
+    Return the operation type of a SQL *batch*, one of `OPERATIONS`.
+
+    >>> classify_statement("COPY foo FROM 's3://bar'")
+    'COPY'
+    >>> classify_statement("DELETE FROM foo;\\nCOPY foo FROM 's3://bar'")
+    'COPY'
+    >>> classify_statement("LOCK TABLE foo;\\n"
+    ...                    "ALTER TABLE foo RENAME TO foo$outgoing")
+    'DEEP COPY'
+    >>> classify_statement("-- comment\\ncreate user chad")
+    'DDL'
+    """
+    keywords = [k.upper() for k in STATEMENT_KEYWORD_RE.findall(batch)]
+    if not keywords:
+        return 'OTHER'
+    if keywords[0] == 'LOCK' and '$outgoing' in batch:
+        return 'DEEP COPY'
+    for operation in ('COPY', 'UNLOAD'):
+        if operation in keywords:
+            return operation
+    first = keywords[0]
+    if first in DDL_KEYWORDS:
+        return 'DDL'
+    if first in DML_KEYWORDS:
+        return 'DML'
+    if first in QUERY_KEYWORDS:
+        return 'QUERY'
+    return 'OTHER'
+
+
+def changes_schema(batch):
+    """
+    Whether any statement in a SQL *batch* is DDL, or the batch is a deep
+    copy, so cached catalog lookups may be stale after it runs.
+
+    >>> changes_schema("CREATE SCHEMA s;\\nCREATE TABLE s.t (id INT);\\n"
+    ...                "COPY s.t FROM 's3://bar'")
+    True
+    >>> changes_schema("DELETE FROM foo;\\nCOPY foo FROM 's3://bar'")
+    False
+    """
+    if classify_statement(batch) == 'DEEP COPY':
+        return True
+    return any(k.upper() in DDL_KEYWORDS
+               for k in STATEMENT_KEYWORD_RE.findall(batch))
+
+
+class ExecutionRecord(object):
+    """
+    Details of a single `Redshift.execute` call.
+
+    Attributes
+    ----------
+    batch : str
+        The SQL batch executed
+    parameters : list or dict
+        Parameters bound to the batch
+    operation : str
+        Operation type from `classify_statement`
+    start : float
+        Timer value when execution started
+    duration : float
+        Wall time in seconds, set once execution finishes
+    rowcount : int
+        Rows affected by the last statement, as reported by the cursor
+    query_id : int
+        Redshift query id of the last statement, from ``pg_last_query_id()``
+    error : Exception
+        The exception raised, if execution failed
+    """
+
+    def __init__(self, batch, parameters=None):
+        self.batch = batch
+        self.parameters = parameters
+        self.operation = classify_statement(batch)
+        self.start = None
+        self.duration = None
+        self.rowcount = None
+        self.query_id = None
+        self.error = None
+
+    def __repr__(self):
+        return ("<ExecutionRecord {} duration={} rowcount={} query_id={}>"
+                .format(self.operation, self.duration, self.rowcount,
+                        self.query_id))
+
+
+class SlowStatementLog(object):
+    """
+    Hook writing statements slower than *threshold* seconds to *stream*.
+
+    Parameters
+    ----------
+    threshold : float
+        Minimum duration in seconds for a statement to be logged
+    stream : file-like
+        Where to write entries; defaults to stderr
+    max_statement_length : int
+        Truncate logged SQL to this many characters
+    """
+
+    def __init__(self, threshold=60, stream=None, max_statement_length=500):
+        self.threshold = threshold
+        self.stream = stream
+        self.max_statement_length = max_statement_length
+
+    def after_execute(self, record):
+        if record.duration is None or record.duration < self.threshold:
+            return
+        statement = ' '.join(record.batch.split())
+        if len(statement) > self.max_statement_length:
+            statement = statement[:self.max_statement_length] + '...'
+        status = 'failed' if record.error is not None else 'ok'
+        line = ("Slow {} ({:.3f}s, query_id={}, rows={}, {}): {}\n"
+                .format(record.operation, record.duration, record.query_id,
+                        record.rowcount, status, statement))
+        (self.stream or sys.stderr).write(line)
+
+
+class Histogram(object):
+    """Cumulative histogram of observed values over fixed *buckets*."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            cumulative.append((bound, total))
+        return {'buckets': cumulative, 'count': self.count, 'sum': self.sum}
+
+
+class MetricsCollector(object):
+    """
+    Hook aggregating counters and duration histograms per operation type.
+
+    `snapshot` returns a plain dict suitable for pushing to a metrics
+    system; subclasses may override `export` to do so directly.
+
+    Parameters
+    ----------
+    buckets : tuple of float
+        Histogram bucket upper bounds in seconds
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.reset()
+
+    def reset(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def after_execute(self, record):
+        op = record.operation
+        counters = self.counters.setdefault(
+            op, {'statements': 0, 'errors': 0, 'rows': 0})
+        counters['statements'] += 1
+        if record.error is not None:
+            counters['errors'] += 1
+        if record.rowcount is not None and record.rowcount > 0:
+            counters['rows'] += record.rowcount
+        if record.duration is not None:
+            if op not in self.histograms:
+                self.histograms[op] = Histogram(self.buckets)
+            self.histograms[op].observe(record.duration)
+        self.export(record)
+
+    def export(self, record):
+        """Called after every statement; override to push metrics."""
+
+    def snapshot(self):
+        return {
+            'counters': dict((op, dict(c)) for op, c in self.counters.items()),
+            'histograms': dict((op, h.snapshot())
+                               for op, h in self.histograms.items()),
+        }
+
+
+def run_hooks(hooks, method, record):
+    for hook in hooks:
+        f = getattr(hook, method, None)
+        if f is not None:
+            f(record)
+
+
+class LoadReport(object):
+    """
+    Per-phase timings and volumes for a single load or unload pipeline.
+
+    Phases are timed with the `phase` context manager, or added directly
+    with `add_time` when measured elsewhere (e.g. in worker processes).
+
+    Attributes
+    ----------
+    table : str
+        Target table
+    phases : dict
+        Seconds spent per phase, e.g. serialize, compress, upload,
+        manifest, copy, append, cleanup
+    records : int
+        Records written to staged files
+    raw_bytes : int
+        Bytes before compression, when known
+    compressed_bytes : int
+        Bytes after compression, as uploaded
+    files : int
+        Number of staged data files
+    copy_count : int
+        Rows loaded, from ``pg_last_copy_count()``
+    rejects : int
+        Records that failed client-side validation and weren't staged
+    codec : str
+        Compression codec of staged files
+    watermark : str
+        High watermark loaded up to, for incremental loads
+    """
+
+    def __init__(self, table=None):
+        self.table = table
+        self.phases = {}
+        self.records = 0
+        self.raw_bytes = None
+        self.compressed_bytes = 0
+        self.files = 0
+        self.copy_count = None
+        self.rejects = 0
+        self.codec = None
+        self.watermark = None
+        self._start = default_timer()
+        self.total_seconds = None
+
+    def add_time(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def add_raw_bytes(self, nbytes):
+        self.raw_bytes = (self.raw_bytes or 0) + nbytes
+
+    @contextmanager
+    def phase(self, name):
+        start = default_timer()
+        try:
+            yield
+        finally:
+            self.add_time(name, default_timer() - start)
+
+    def finish(self):
+        """Stop the overall clock; returns the report."""
+        self.total_seconds = default_timer() - self._start
+        return self
+
+    @property
+    def compression_ratio(self):
+        if self.raw_bytes and self.compressed_bytes:
+            return self.raw_bytes / self.compressed_bytes
+
+    @property
+    def records_per_second(self):
+        if self.total_seconds:
+            return self.records / self.total_seconds
+
+    @property
+    def upload_bytes_per_second(self):
+        seconds = self.phases.get('upload')
+        if seconds:
+            return self.compressed_bytes / seconds
+
+    def as_dict(self):
+        return {
+            'table': self.table,
+            'phases': dict(self.phases),
+            'total_seconds': self.total_seconds,
+            'records': self.records,
+            'raw_bytes': self.raw_bytes,
+            'compressed_bytes': self.compressed_bytes,
+            'compression_ratio': self.compression_ratio,
+            'files': self.files,
+            'copy_count': self.copy_count,
+            'rejects': self.rejects,
+            'codec': self.codec,
+            'watermark': self.watermark,
+            'records_per_second': self.records_per_second,
+            'upload_bytes_per_second': self.upload_bytes_per_second,
+        }
+
+    def __repr__(self):
+        phases = ', '.join('{}={:.3f}s'.format(k, v)
+                           for k, v in sorted(self.phases.items()))
+        return "<LoadReport {} records={} files={} {}>".format(
+            self.table, self.records, self.files, phases)
@@ -15,13 +15,16 @@ import os
 import shutil
 import threading
 from threading import Thread
-import time
-
-import psycopg2
-import psycopg2.extras
+from timeit import default_timer
 
+from shiftmanager import util
+from shiftmanager.instrumentation import LoadReport
 from shiftmanager.memoized_property import memoized_property
-from shiftmanager.mixins.s3 import S3Mixin
+from shiftmanager.mixins.s3 import STAGED_COPY_OPTIONS, S3Mixin
+
+
+# Smallest file size used with line_bytes='auto', before compression
+MIN_LINE_BYTES = 1024 * 1024
 
 
 class PostgresMixin(S3Mixin):
@@ -33,15 +36,17 @@ class PostgresMixin(S3Mixin):
 
         Instantiation is delayed until the object is first used.
         """
+        import psycopg2
 
         print("Connecting to %s..." % self.pg_args['host'])
         return psycopg2.connect(**self.pg_args)
 
     def pg_execute_and_commit_single_statement(self, statement):
-        """Execute single Postgres statement"""
+        """Execute single Postgres statement, returning its rowcount"""
         with self.pg_connection as conn:
             with conn.cursor() as cur:
                 cur.execute(statement)
+                return cur.rowcount
 
     def create_pg_connection(self, **kwargs):
         """
@@ -77,7 +82,8 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             return template.format(key_id=key_id,
                                    secret_key_id=secret_key_id)
 
-    def _create_copy_statement(self, table_name, manifest_key_path):
+    def _create_copy_statement(self, table_name, manifest_key_path,
+                               codec='gzip'):
         """Create Redshift copy statement for given table_name and
         the provided manifest_key_path.
         Parameters
@@ -86,21 +92,66 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             Redshift table name to COPY to
         manifest_key_path: str
             Complete S3 path to .manifest file
+        codec: str
+            Compression codec of the staged files
         Returns
         -------
         str
         """
+        from shiftmanager.compression import get_codec
+
         return """\
         COPY {table_name}
         FROM '{manifest_key_path}'
         CREDENTIALS '{aws_credentials}'
         MANIFEST
         TIMEFORMAT 'auto'
-        GZIP
+        {compression}
         JSON 'auto'
         """.format(table_name=table_name,
                    manifest_key_path=manifest_key_path,
-                   aws_credentials=self.aws_credentials)
+                   aws_credentials=self.aws_credentials,
+                   compression=get_codec(codec).copy_option)
+
+    def _pg_json_sample(self, pg_table_or_select):
+        """Fetch `codec_sample_size` rows of *pg_table_or_select* as JSON."""
+        with self.pg_connection as conn:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT row_to_json(x)::text FROM ({}) AS x LIMIT {}"
+                    .format(pg_table_or_select, int(self.codec_sample_size)))
+                rows = cur.fetchall()
+        return "".join(row[0] + "\n" for row in rows).encode("utf-8")
+
+    def _pg_estimated_rows(self, pg_table_or_select):
+        """Postgres' planner estimate of rows in *pg_table_or_select*."""
+        with self.pg_connection as conn:
+            with conn.cursor() as cur:
+                cur.execute("EXPLAIN (FORMAT JSON) SELECT * FROM ({}) AS x"
+                            .format(pg_table_or_select))
+                plan = cur.fetchone()[0]
+        if not isinstance(plan, list):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Plan Rows']
+
+    def _auto_line_bytes(self, pg_table_or_select, sample, codec):
+        """
+        Choose ``split --line-bytes`` so the export yields a multiple of the
+        cluster's slice count of files, each within `target_file_bytes`
+        after compression.
+        """
+        rows = self._pg_estimated_rows(pg_table_or_select)
+        sample_rows = sample.count(b"\n")
+        if not sample_rows:
+            return MIN_LINE_BYTES
+        raw_bytes = len(sample) / sample_rows * rows
+        ratio = len(codec.compress(sample)) / len(sample)
+        files = util.file_count(raw_bytes, ratio, self.get_slice_count(),
+                                self.target_file_bytes)
+        line_bytes = max(MIN_LINE_BYTES, int(raw_bytes / files) + 1)
+        print("Splitting an estimated {:.0f} bytes into files of {} bytes"
+              .format(raw_bytes, line_bytes))
+        return line_bytes
 
     def copy_table_to_s3(self,
                          bucket_name,
@@ -110,7 +161,10 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
                          temp_file_dir=None,
                          cleanup_s3=True,
                          line_bytes=104857600,
-                         canned_acl=None):
+                         canned_acl=None,
+                         report=None,
+                         codec='gzip',
+                         compression_level=None):
         """
         Writes the contents of a Postgres table to S3.
 
@@ -140,17 +194,33 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             Optional Specify location of temporary files
         cleanup_s3: bool
             Optional Clean up S3 location on failure. Defaults to True.
-        line_bytes: int
+        line_bytes: int or 'auto'
             The maximum number of bytes to write to a single file
-            (before compression); defaults to 100 MB
+            (before compression); defaults to 100 MB. With 'auto', the
+            size is chosen from the planner's row estimate and a sample of
+            rows so that files come in multiples of the Redshift cluster's
+            slice count, each within `target_file_bytes` compressed.
         canned_acl: str
             A canned ACL to apply to objects uploaded to S3
+        report: `~shiftmanager.instrumentation.LoadReport`
+            If given, extract, upload and cleanup timings along with
+            record, file and byte counts are added to it, and its
+            *codec* is set
+        codec: str
+            Compression for staged files: gzip, bzip2, zstd, lzop or none,
+            run as a shell command. 'auto' picks one by compressing a
+            sample of rows with each available codec.
+        compression_level: int
+            Codec compression level; defaults to the codec's default
 
         Returns
         -------
         (Final key prefix, List of S3 keys)
         """
-        bucket = self.get_bucket(bucket_name)
+        from shiftmanager.compression import get_codec, shell_codecs
+
+        report = report or LoadReport()
+        storage = self.get_storage(bucket_name)
 
         final_key_prefix = key_prefix
         if not key_prefix.endswith("/"):
@@ -164,11 +234,25 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             ValueError("Exactly one of pg_table_name or pg_select_statement "
                        "must be specified.")
 
+        sample = None
+        if 'auto' in (codec, line_bytes):
+            sample = self._pg_json_sample(pg_table_or_select)
+        if codec == 'auto':
+            # The export compresses with the codec's shell command, so the
+            # Python zstandard module alone isn't enough
+            codec = self._choose_codec(sample, codecs=shell_codecs())
+        codec = get_codec(codec)
+        report.codec = codec.name
+        if line_bytes == 'auto':
+            line_bytes = self._auto_line_bytes(pg_table_or_select, sample,
+                                               codec)
+
         tmpdir = tempfile.mkdtemp(dir=temp_file_dir)
 
         # Here, we build a COPY statement that sends output into a Unix
         # pipeline. We use SQL dollar-quoting ($$) to avoid escaping quotes.
-        # It goes through `split` and `gzip` to output compressed files.
+        # It goes through `split` and a compressor (`gzip` by default) to
+        # output compressed files.
         # The `sed` invocation at the end makes up for a quirk in Postgres
         # JSON output where backslashes are improperly doubled; for every pair
         # of backslashes we substitute a single backslash. Due to multiple
@@ -178,41 +262,52 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             r"COPY (SELECT row_to_json(x) FROM ({pg_table_or_select}) AS x) "
             r"TO PROGRAM $$"
             r"split - {tmpdir}/chunk_ --line-bytes={line_bytes} "
-            r"""--filter='sed "s/\\\\\\\\/\\\\/g" | gzip > $FILE.json.gz'"""
+            r"""--filter='sed "s/\\\\\\\\/\\\\/g" | """
+            r"""{compress} > $FILE.json{ext}'"""
             r"$$"
         ).format(pg_table_or_select=pg_table_or_select,
-                 tmpdir=tmpdir, line_bytes=line_bytes)
+                 tmpdir=tmpdir, line_bytes=line_bytes,
+                 compress=codec.shell_command(compression_level),
+                 ext=codec.extension)
 
         # Kick off a thread to upload files as they're produced
-        s3_thread = S3UploaderThread(tmpdir, bucket, final_key_prefix,
+        s3_thread = S3UploaderThread(tmpdir, storage, final_key_prefix,
                                      canned_acl)
 
         try:
             s3_thread.start()
-            self.pg_execute_and_commit_single_statement(copy_statement)
+            with report.phase('extract'):
+                report.records += (
+                    self.pg_execute_and_commit_single_statement(
+                        copy_statement) or 0)
             print("Finished extracting data from Postgres. "
                   "Waiting on uploads...")
             s3_thread.finish_uploads_and_exit()
-            while s3_thread.is_alive():
-                # We call join() in a loop with a 1 second timeout so that
-                # a user hitting Ctrl-C will allow a KeyboardInterrupt
-                # to be issued and we can exit. If we simply call join(),
-                # it blocks and no exceptions can reach the main program.
-                s3_thread.join(1)
+            with report.phase('upload_wait'):
+                while s3_thread.is_alive():
+                    # We call join() in a loop with a 1 second timeout so
+                    # that a user hitting Ctrl-C will allow a
+                    # KeyboardInterrupt to be issued and we can exit. If we
+                    # simply call join(), it blocks and no exceptions can
+                    # reach the main program.
+                    s3_thread.join(1)
             s3_keys = s3_thread.s3_keys
+            report.add_time('upload', s3_thread.upload_seconds)
+            report.compressed_bytes += s3_thread.bytes_uploaded
+            report.files += len(s3_keys)
         except:
             s3_thread.abort()
             print("Error while pulling data out of PostgreSQL")
             if cleanup_s3:
                 print("Cleaning up S3...")
-                for key in s3_thread.s3_keys:
-                    bucket.delete_key(key)
+                storage.delete(s3_thread.s3_keys)
             else:
                 print("Leaving files in place...")
             raise
 
         print("Uploads all done. Cleaning up temp directory " + tmpdir)
-        shutil.rmtree(tmpdir)
+        with report.phase('cleanup'):
+            shutil.rmtree(tmpdir)
         return final_key_prefix, s3_keys
 
     def copy_table_to_redshift(self,
@@ -226,7 +321,18 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
                                delete_statement=None,
                                manifest_max_keys=None,
                                line_bytes=104857600,
-                               canned_acl=None):
+                               canned_acl=None,
+                               report_callback=None,
+                               codec='gzip',
+                               compression_level=None,
+                               mode='append',
+                               merge_keys=None,
+                               deduplicate=False,
+                               deduplicate_order_by=None,
+                               watermark_column=None,
+                               watermark_store=None,
+                               watermark_key=None,
+                               watermark_lag=None):
         """
         Writes the contents of a Postgres table to Redshift.
 
@@ -262,7 +368,8 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             When not None, this statement will be run in the same transaction
             as the (final) COPY statement.
             This is useful when you want to clean up a previous backfill
-            at the same time as issuing a new backfill.
+            at the same time as issuing a new backfill. In 'staged' mode
+            that transaction commits just before the append.
         manifest_max_keys: int or None
             If None, all S3 keys will be sent to Redshift in a single COPY
             transaction. Otherwise, this parameter sets an upper limit on the
@@ -270,24 +377,101 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             produced, then additional COPY statements will be issued.
             This is useful for particularly large loads that may timeout in
             a single transaction.
-        line_bytes: int
+        line_bytes: int or 'auto'
             The maximum number of bytes to write to a single file
-            (before compression); defaults to 100 MB
+            (before compression); defaults to 100 MB. See
+            `copy_table_to_s3` for 'auto'.
         canned_acl: str
             A canned ACL to apply to objects uploaded to S3
+        report_callback: callable
+            Called with the `~shiftmanager.instrumentation.LoadReport`
+            once the load completes
+        codec: str
+            Compression for staged files, as for `copy_table_to_s3`
+        compression_level: int
+            Codec compression level; defaults to the codec's default
+        mode: str
+            'append' (the default), 'merge' or 'staged', as for
+            `copy_json_to_table`. In merge and staged modes every manifest
+            is COPYed into the same staging table. The merge runs with the
+            final COPY, while the staged rows are counted against those
+            extracted and appended once every COPY has committed.
+        merge_keys: str or list of str
+            Columns identifying a row, required for 'merge'
+        deduplicate: bool
+            In 'merge' mode, keep only the first row for each set of merge
+            key values
+        deduplicate_order_by: str
+            Order choosing which duplicate is kept
+        watermark_column: str
+            For incremental loads, a column that only increases as rows
+            are added or changed, like an ``updated_at`` timestamp or a
+            serial id. Only rows above the watermark recorded in
+            *watermark_store* are extracted, up to the column's maximum
+            when the load starts, less *watermark_lag*, which becomes the
+            new watermark once the final COPY has committed. If there are
+            no new rows, nothing is loaded. Combine with ``mode='merge'``
+            to apply updated rows.
+        watermark_store: `~shiftmanager.watermarks.WatermarkStore`
+            Where watermarks are kept; required with *watermark_column*
+        watermark_key: str
+            Key of the watermark in the store; defaults to *pg_table_name*,
+            or else *redshift_table_name*
+        watermark_lag: int, float or datetime.timedelta
+            How far below the column's maximum to stop, leaving newer rows
+            for the next run. A transaction still open when the load
+            starts can commit later with an ``updated_at`` or serial value
+            below that maximum; without a lag longer than such
+            transactions last, its rows are skipped for good.
+
+        Returns
+        -------
+        `~shiftmanager.instrumentation.LoadReport` with per-phase timings,
+        record, file and compressed byte counts, and the total
+        ``pg_last_copy_count()`` across COPY statements
         """
+        copy_table, setup, finish = self._load_mode_statements(
+            redshift_table_name, mode, merge_keys, deduplicate,
+            deduplicate_order_by)
+        report = LoadReport(redshift_table_name)
         backfill_timestamp = datetime.datetime.utcnow().strftime(
             "%Y-%m-%d_%H%M%S")
         if not self.table_exists(redshift_table_name):
             raise ValueError("This table_name does not exist in Redshift!")
 
-        bucket = self.get_bucket(bucket_name)
+        watermark_statements = []
+        if watermark_column is not None:
+            if watermark_store is None:
+                raise ValueError("watermark_column requires a "
+                                 "watermark_store")
+            watermark_key = (watermark_key or pg_table_name or
+                             redshift_table_name)
+            last = watermark_store.get(watermark_key)
+            source = pg_table_name or '(' + pg_select_statement + ')'
+            pg_select_statement, report.watermark = \
+                self._pg_watermark_range(source, watermark_column, last,
+                                         watermark_lag)
+            pg_table_name = None
+            if report.watermark is None:
+                print("No rows above watermark {}; nothing to load"
+                      .format(last))
+                report.finish()
+                if report_callback is not None:
+                    report_callback(report)
+                return report
+            if mode != 'staged':
+                # The append commits separately, after the final COPY
+                watermark_statements = watermark_store.statements(
+                    self, watermark_key, report.watermark)
+
+        storage = self.get_storage(bucket_name)
         final_key_prefix, s3_keys = self.copy_table_to_s3(
             bucket_name, key_prefix, pg_table_name, pg_select_statement,
-            temp_file_dir, cleanup_s3, line_bytes, canned_acl)
+            temp_file_dir, cleanup_s3, line_bytes, canned_acl, report,
+            codec, compression_level)
 
         manifest_entries = [{
-            'url': 's3://' + bucket.name + s3_path,
+            'url': storage.url(s3_path),
             'mandatory': True
         } for s3_path in s3_keys]
 
@@ -306,31 +490,178 @@ libpq-connect.html#LIBPQ-PARAMKEYWORDS
             s3_keys.append(manifest_key_path)
 
             print('Writing .manifest file to S3...')
-            self.write_string_to_s3(json.dumps(manifest), bucket,
-                                    manifest_key_path, canned_acl=canned_acl)
-            complete_manifest_path = "".join(['s3://', bucket.name,
-                                              manifest_key_path])
+            with report.phase('manifest'):
+                storage.put_string(manifest_key_path, json.dumps(manifest),
+                                   encrypt=True, canned_acl=canned_acl)
+            complete_manifest_path = storage.url(manifest_key_path)
             statements = ""
+            last = end_idx == num_entries
+
+            # Create any staging table with the first COPY; it lasts for
+            # the session, across transactions
+            if start_idx == 0 and setup:
+                statements += ';\n'.join(setup) + ';\n'
 
             # Include the delete statement only on the last transaction.
-            if delete_statement and end_idx == num_entries:
+            if delete_statement and last:
                 statements += delete_statement + ';\n'
 
             statements += self._create_copy_statement(
-                redshift_table_name, complete_manifest_path)
+                copy_table, complete_manifest_path, report.codec)
+            if mode == 'staged':
+                statements = statements.rstrip() + '\n' + STAGED_COPY_OPTIONS
+            if last and (finish or watermark_statements):
+                statements = statements.rstrip() + ';\n' + \
+                    ';\n'.join(finish + watermark_statements)
 
             print('Copying from S3 to Redshift...')
             try:
-                self.execute(statements)
+                with report.phase('copy'):
+                    self.execute(statements)
+                copy_count = self._last_copy_count()
+                if copy_count is not None:
+                    report.copy_count = (report.copy_count or 0) + copy_count
                 start_idx = end_idx
             except:
                 # Clean up S3 bucket in the event of any exception
                 if cleanup_s3:
                     print("Error writing to Redshift! Cleaning up S3...")
-                    for key in s3_keys:
-                        bucket.delete_key(key)
+                    storage.delete(s3_keys)
+                if mode == 'staged' and start_idx > 0:
+                    self.execute("DROP TABLE IF EXISTS {}".format(copy_table))
                 raise
 
+        if mode == 'staged':
+            with report.phase('append'):
+                self._append_from_staging(redshift_table_name, copy_table,
+                                          report.records)
+
+        if report.watermark is not None and not watermark_statements:
+            # Only once every COPY has committed
+            watermark_store.set(watermark_key, report.watermark)
+
+        report.finish()
+        if report_callback is not None:
+            report_callback(report)
+        return report
+
+    def _pg_watermark_range(self, pg_table_or_select, column, last=None,
+                            lag=None):
+        """
+        Return a SELECT of the rows of *pg_table_or_select* with *column*
+        above *last*, bounded by the column's current maximum less *lag*,
+        along with that bound (None if there are no such rows).
+
+        Rows written after the bound is read are left for the next load,
+        but so are any that later commit at or below it: only a *lag*
+        longer than the transactions writing the table keeps them.
+        """
+        bound = 'max("{}")'.format(column)
+        params = ()
+        if lag is not None:
+            bound += ' - %s'
+            params = (lag,)
+        query = 'SELECT {} FROM {} AS x'.format(bound, pg_table_or_select)
+        if last is not None:
+            query += ' WHERE "{}" > %s'.format(column)
+            params += (last,)
+            if lag is not None:
+                # The lag can take the bound back below the last watermark
+                query += ' HAVING {} > %s'.format(bound)
+                params += (lag, last)
+        with self.pg_connection as conn:
+            with conn.cursor() as cur:
+                cur.execute(query, params)
+                row = cur.fetchone()
+                upper = row[0] if row else None
+                if upper is None:
+                    return None, None
+                upper = str(upper)
+                params = () if last is None else (last,)
+                condition = '"{}" <= %s'.format(column)
+                if last is not None:
+                    condition = '"{}" > %s AND '.format(column) + condition
+                select = cur.mogrify(
+                    'SELECT * FROM {} AS x WHERE {}'.format(
+                        pg_table_or_select, condition), params + (upper,))
+        if not isinstance(select, str):
+            select = select.decode('utf-8')
+        return select, upper
+
+    def stream_changes_to_redshift(self, slot_name, bucket_name, key_prefix,
+                                   tables=None, table_map=None,
+                                   merge_keys=None, max_changes=10000,
+                                   max_bytes=64 * 1024 * 1024, max_seconds=60,
+                                   format_version=1, create_slot=False,
+                                   slices=4, codec='gzip',
+                                   report_callback=None, max_batches=None):
+        """
+        Continuously apply changes from a Postgres logical replication slot
+        to Redshift in micro-batches.
+
+        The slot must use the ``wal2json`` output plugin. Changes are
+        buffered in memory, collapsed to the latest state of each row, and
+        applied per table whenever a limit is reached. Upserted rows are
+        staged in S3, COPYed into a temporary table and merged, and deleted
+        rows are removed, all in one transaction per table. The slot is only
+        advanced once every table's transaction has committed. If the stream
+        is interrupted, unconfirmed changes are replayed on restart, and
+        replaying them leaves the tables unchanged.
+
+        Parameters
+        ----------
+        slot_name: str
+            Logical replication slot to read
+        bucket_name: str
+            The name of the S3 bucket for staged rows
+        key_prefix: str
+            The key path within the bucket to write to
+        tables: collection of str or None
+            Schema-qualified Postgres tables to replicate; defaults to all
+            tables in the stream
+        table_map: dict or None
+            Maps Postgres table names to Redshift ones where they differ
+        merge_keys: dict or None
+            Maps Postgres table names to key columns; defaults to each
+            table's primary key. Deletes need these columns in the table's
+            ``REPLICA IDENTITY``.
+        max_changes: int
+            Apply buffered changes once this many have arrived
+        max_bytes: int
+            Apply buffered changes once this many bytes of wal2json output
+            have arrived
+        max_seconds: float
+            Apply buffered changes once the oldest is this many seconds old;
+            None for no age limit
+        format_version: int
+            wal2json format version, 1 or 2
+        create_slot: bool
+            Create *slot_name* if it does not exist
+        slices: int
+            Files to split each table's upserted rows into
+        codec: str
+            Compression for staged files
+        report_callback: callable
+            Called with a `~shiftmanager.instrumentation.LoadReport` for
+            each table in each micro-batch
+        max_batches: int or None
+            Stop after applying this many micro-batches; by default, stream
+            until interrupted
+
+        Returns
+        -------
+        Number of micro-batches applied
+        """
+        from shiftmanager.cdc import stream_changes
+
+        return stream_changes(
+            self, slot_name, bucket_name, key_prefix, tables=tables,
+            table_map=table_map, merge_keys=merge_keys,
+            max_changes=max_changes, max_bytes=max_bytes,
+            max_seconds=max_seconds, format_version=format_version,
+            create_slot=create_slot, slices=slices, codec=codec,
+            report_callback=report_callback, max_batches=max_batches)
+
 
 class S3UploaderThread(Thread):
     """
@@ -338,9 +669,10 @@ class S3UploaderThread(Thread):
     uploads them to S3, and deletes them.
 
     When the thread finishes, a list of the keys uploaded is
-    available through the *s3_keys* field.
+    available through the *s3_keys* field, with totals in
+    *bytes_uploaded* and *upload_seconds*.
     """
-    def __init__(self, dirpath, bucket, key_prefix, canned_acl):
+    def __init__(self, dirpath, storage, key_prefix, canned_acl):
         """
         Create a thread.
 
@@ -348,20 +680,25 @@ class S3UploaderThread(Thread):
         ----------
         dirpath: str
             Path to the directory to search for files to upload
-        bucket: S3.Bucket
-            Bucket for uploading files
+        storage: `~shiftmanager.storage.Storage` or boto.s3.bucket.Bucket
+            Destination for uploaded files; each batch of completed files
+            is uploaded in parallel
         key_prefix: str
             Prefix for keys uploaded to S3
         canned_acl: str
             A canned ACL to set on keys uploaded to S3
         """
+        from shiftmanager.storage import as_storage
+
         Thread.__init__(self)
         self.daemon = True  # If main program aborts, thread will terminate
         self.dirpath = dirpath
         self.key_prefix = key_prefix
         self.canned_acl = canned_acl
-        self.bucket = bucket
+        self.storage = as_storage(storage)
         self.s3_keys = []
+        self.bytes_uploaded = 0
+        self.upload_seconds = 0.0
         self._abort = threading.Event()
         self._file_creation_complete = threading.Event()
 
@@ -386,19 +723,25 @@ class S3UploaderThread(Thread):
                 # The last listed file is the one being written to,
                 # so let's skip it for now.
                 files = files[:-1]
-            for basename in files:
-                if self._abort.is_set():
-                    return
-                filepath = os.path.join(self.dirpath, basename)
-                complete_key_path = "".join([self.key_prefix, basename])
-                print("Writing to S3: " + complete_key_path)
-                boto_key = self.bucket.new_key(complete_key_path)
-                boto_key.set_contents_from_filename(filepath, encrypt_key=True)
-                if self.canned_acl is not None:
-                    boto_key.set_canned_acl(self.canned_acl)
-                self.s3_keys.append(complete_key_path)
-                os.remove(filepath)
-            time.sleep(1)
+            if self._abort.is_set():
+                return
+            if files:
+                uploads = [("".join([self.key_prefix, basename]),
+                            os.path.join(self.dirpath, basename))
+                           for basename in files]
+                for complete_key_path, _ in uploads:
+                    print("Writing to S3: " + complete_key_path)
+                start = default_timer()
+                self.storage.put_filenames(uploads, encrypt=True,
+                                           canned_acl=self.canned_acl)
+                self.upload_seconds += default_timer() - start
+                for complete_key_path, filepath in uploads:
+                    self.bytes_uploaded += os.path.getsize(filepath)
+                    self.s3_keys.append(complete_key_path)
+                    os.remove(filepath)
+            else:
+                # Wake early once the producer signals completion
+                self._file_creation_complete.wait(1)
 
 
 def serializer(obj):
@@ -1,9 +1,5 @@
 import re
 
-import sqlalchemy
-from sqlalchemy.schema import CreateTable
-from sqlalchemy_views import CreateView
-
 from shiftmanager import queries
 from shiftmanager.memoized_property import memoized_property
 from shiftmanager.privileges import grants_from_privileges
@@ -31,6 +27,19 @@ def _get_relation_key(name, schema):
         return schema + "." + name
 
 
+def _deduplicated_source(source, partition_by, order_by=None):
+    """
+    Return a FROM clause body selecting only the first row of *source*
+    for each value of the *partition_by* columns, ordered by *order_by*.
+    """
+    inner = "\tSELECT *, ROW_NUMBER() \n"
+    inner += "\tOVER (PARTITION BY " + partition_by
+    if order_by:
+        inner += " ORDER BY " + order_by
+    inner += ")\n\tFROM " + source + "\n"
+    return "(\n" + inner + ") WHERE row_number = 1"
+
+
 def _get_schema_and_relation(key):
     if '.' not in key:
         return (None, key)
@@ -49,6 +58,8 @@ class ReflectionMixin(object):
     def engine(self):
         """A sqlalchemy.engine which wraps `connection`.
         """
+        import sqlalchemy
+
         return sqlalchemy.create_engine("redshift+psycopg2://",
                                         poolclass=sqlalchemy.pool.StaticPool,
                                         creator=lambda: self.connection)
@@ -58,6 +69,8 @@ class ReflectionMixin(object):
         """A :class:`~sqlalchemy.schema.MetaData` instance used for
         reflection calls.
         """
+        import sqlalchemy
+
         meta = sqlalchemy.MetaData()
         meta.bind = self.engine
         return meta
@@ -98,6 +111,8 @@ class ReflectionMixin(object):
         and ``sqlalchemy-redshift``'s `DDLCompiler docs
         <http://redshift-sqlalchemy.readthedocs.org/en/latest/ddl-compiler.html>`_
         """
+        import sqlalchemy
+
         kw = kwargs.copy()
         analyze_compression = kwargs.pop('analyze_compression', None)
         kw['autoload'] = True
@@ -115,6 +130,24 @@ class ReflectionMixin(object):
                 col.info['encode'] = 'raw'
         return table
 
+    def inferred_table(self, name, docs, schema=None, **kwargs):
+        """
+        Return a :class:`~sqlalchemy.schema.Table` sized to fit *docs*.
+
+        A sample of the documents is profiled to choose the narrowest
+        column types, compression encodings, and a distkey and sortkey.
+        Columns follow the order of ``table.info['jsonpaths']``, so the
+        table can be created with `table_definition` (passing
+        ``copy_privileges=False``) and loaded with `copy_json_to_table`
+        using those jsonpaths.
+
+        Keyword arguments are passed to
+        `~shiftmanager.inference.infer_table`.
+        """
+        from shiftmanager.inference import infer_table
+
+        return infer_table(name, docs, schema=schema, **kwargs)
+
     def reflected_privileges(self, relation, schema=None, use_cache=True):
         """Return a SQL str which recreates all privileges for *relation*.
 
@@ -150,6 +183,8 @@ class ReflectionMixin(object):
         use_cache : `bool`
             Use cached results for the privilege query, if available
         """
+        from sqlalchemy.schema import CreateTable
+
         table = self._pass_or_reflect(table, schema=schema)
         table_name = self.preparer.format_table(table)
         if analyze_compression:
@@ -190,6 +225,8 @@ class ReflectionMixin(object):
             Additional keyword arguments will be passed unchanged to
             :meth:`~sqlalchemy_redshift.dialect.RedshiftDialect.get_view_definition`
         """
+        from sqlalchemy_views import CreateView
+
         view = self._pass_or_reflect(view, schema)
         definition = self.engine.dialect.get_view_definition(
             self.engine, view.name, view.schema, **kwargs)
@@ -267,20 +304,18 @@ class ReflectionMixin(object):
         table_definition = '\n' + self.table_definition(
             table, None, copy_privileges, use_cache, analyze_compression)
         insert_statement = "\nINSERT INTO {table_name} \nSELECT "
-        identity_cols = self._get_identity_columns(table.name) or {}
+        identity_cols = self._get_identity_columns(table.name,
+                                                   table.schema) or {}
         col_str = ',\n\t'.join('"%s"' % col.name
                                for col in table.columns
                                if col.name not in identity_cols)
         if distinct:
             insert_statement += "DISTINCT "
         if deduplicate_partition_by:
-            inner = "\tSELECT *, ROW_NUMBER() \n"
-            inner += "\tOVER (PARTITION BY {deduplicate_partition_by}"
-            if deduplicate_order_by:
-                inner += " ORDER BY {deduplicate_order_by}"
-            inner += ")\n\tFROM {outgoing_name}\n"
-            insert_statement += ("\n\t" + col_str + "\nFROM (\n" +
-                                 inner + ") WHERE row_number = 1")
+            insert_statement += "\n\t" + col_str + "\nFROM " + \
+                _deduplicated_source(
+                    "{outgoing_name}", "{deduplicate_partition_by}",
+                    deduplicate_order_by and "{deduplicate_order_by}")
         else:
             insert_statement += "\n\t" + col_str + "\nFROM {outgoing_name}"
         drop_statement = "\nDROP TABLE {outgoing_name}"
@@ -303,6 +338,120 @@ class ReflectionMixin(object):
         ) + ';'
         return self.mogrify(batch, None, execute)
 
+    def merge_statement(self, table, staging_table, merge_keys, schema=None,
+                        deduplicate=False, deduplicate_order_by=None,
+                        drop_staging=True, execute=False):
+        """Return a SQL str merging the rows of *staging_table* into *table*.
+
+        Rows of *table* whose *merge_keys* match a staged row are deleted
+        and every staged row is inserted, so staged rows replace existing
+        ones and new keys are appended. Run the result in one transaction
+        (as `execute` does) so readers never see the deleted rows missing.
+
+        Parameters
+        ----------
+        table : `str` or :class:`~sqlalchemy.schema.Table`
+            The table to merge into
+        staging_table : `str`
+            A table with the same columns as *table* holding the new rows
+        merge_keys : `str` or `list` of `str`
+            Columns identifying a row, like ``'id'`` or ``['id', 'day']``
+        schema : `str`
+            The database schema in which to look for *table*
+            (only used if *table* is str)
+        deduplicate : `bool`
+            Insert only the first staged row for each set of merge key
+            values, using the same ``ROW_NUMBER()`` window as `deep_copy`;
+            without it, duplicate staged keys produce duplicate rows
+        deduplicate_order_by : `str` or `None`
+            A string like 'updated_at DESC NULLS LAST' choosing which of the
+            duplicate rows is kept
+        drop_staging : `bool`
+            Drop *staging_table* after merging
+        execute : `bool`
+            Execute the command in addition to returning it.
+        """
+        table = self._pass_or_reflect(table, schema=schema)
+        table_name = self.preparer.format_table(table)
+        if isinstance(merge_keys, (list, tuple)):
+            keys = list(merge_keys)
+        else:
+            keys = [key.strip() for key in merge_keys.split(',')]
+        missing = [key for key in keys if key not in table.columns]
+        if missing:
+            raise ValueError("Merge keys {} are not columns of {}".format(
+                ', '.join(missing), table_name))
+
+        key_conditions = '\n  AND '.join(
+            '{table}."{key}" = {staging}."{key}"'.format(
+                table=table_name, staging=staging_table, key=key)
+            for key in keys)
+        identity_cols = self._get_identity_columns(table.name,
+                                                   table.schema) or {}
+        col_str = ',\n\t'.join('"%s"' % col.name
+                               for col in table.columns
+                               if col.name not in identity_cols)
+        if deduplicate:
+            source = _deduplicated_source(
+                staging_table, ', '.join('"%s"' % key for key in keys),
+                deduplicate_order_by)
+        else:
+            source = staging_table
+        statements = [
+            "DELETE FROM {table}\nUSING {staging}\nWHERE {conditions}"
+            .format(table=table_name, staging=staging_table,
+                    conditions=key_conditions),
+            "INSERT INTO {table} (\n\t{cols})\nSELECT\n\t{cols}\n"
+            "FROM {source}".format(table=table_name, cols=col_str,
+                                   source=source),
+        ]
+        if drop_staging:
+            statements.append("DROP TABLE {}".format(staging_table))
+        batch = ';\n'.join(statements) + ';'
+        return self.mogrify(batch, None, execute)
+
+    def _merge_statements(self, table, merge_keys, deduplicate=False,
+                          deduplicate_order_by=None):
+        """
+        Return (staging table, statement creating it, merge statement) for
+        loading *table*, a possibly schema-qualified name, in merge mode.
+
+        The staging table is a temporary table created ``LIKE`` *table*,
+        so it shares its distribution key and the DELETE join stays local
+        to each slice. Its name is unique, so a failed load can be retried
+        in the same session.
+        """
+        import uuid
+
+        if not merge_keys:
+            raise ValueError("Merge mode requires merge_keys")
+        schema, name = _get_schema_and_relation(table)
+        staging = '{}$staging_{}'.format(name.strip('"'),
+                                         uuid.uuid4().hex[:8])
+        create = "CREATE TEMP TABLE {} (LIKE {})".format(staging, table)
+        merge = self.merge_statement(name, staging, merge_keys,
+                                     schema=schema, deduplicate=deduplicate,
+                                     deduplicate_order_by=deduplicate_order_by)
+        return staging, create, merge
+
+    def _append_staging_statements(self, table):
+        """
+        Return (staging table, statement creating it) for loading *table*,
+        a possibly schema-qualified name, in staged mode.
+
+        ``ALTER TABLE APPEND`` can't read from a temporary table, so the
+        staging table is a permanent table created ``LIKE`` *table* in the
+        same schema. Its name is unique, so loads can run concurrently.
+        """
+        import uuid
+
+        schema, name = _get_schema_and_relation(table)
+        staging = '{}$append_{}'.format(name.strip('"'), uuid.uuid4().hex[:8])
+        if schema is not None:
+            staging = '{}.{}'.format(schema, staging)
+        create = "CREATE TABLE {} (LIKE {})".format(staging, table)
+        return staging, create
+
     def _cache_privileges(self):
         result = self.engine.execute(queries.all_privileges)
         self._all_privileges = {}
@@ -324,6 +473,8 @@ class ReflectionMixin(object):
         return statements
 
     def _pass_or_reflect(self, table, schema, **kwargs):
+        from sqlalchemy.schema import CreateTable
+
         try:
             # This is already a sqlalchemy.Table object; return it unchanged.
             CreateTable(table)
@@ -331,16 +482,24 @@ class ReflectionMixin(object):
             table = self.reflected_table(table, schema=schema, **kwargs)
         return table
 
-    def _get_identity_columns(self, table_name):
+    def _get_identity_columns(self, table_name, schema=None):
+        import sqlalchemy
+
+        # Without a schema, the table the search path resolves to
+        schema_condition = ('n.nspname = :schema' if schema is not None
+                            else 'pg_table_is_visible(c.oid)')
         query = sqlalchemy.sql.text("""
             SELECT a.attname AS identity_col
-            FROM pg_class c, pg_attribute a, pg_attrdef d
+            FROM pg_class c, pg_namespace n, pg_attribute a, pg_attrdef d
             WHERE c.oid = a.attrelid
+                AND c.relnamespace = n.oid
                 AND c.relkind = 'r'
                 AND a.attrelid = d.adrelid
                 AND a.attnum = d.adnum
                 AND d.adsrc LIKE '%%identity%%'
-                AND c.relname = :tbl;
-        """)
-        results = self.engine.execute(query, {'tbl': table_name})
+                AND c.relname = :tbl
+                AND {};
+        """.format(schema_condition))
+        results = self.engine.execute(query, {'tbl': table_name,
+                                              'schema': schema})
         return {id_col[0] for id_col in results}
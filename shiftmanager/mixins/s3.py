@@ -8,13 +8,52 @@ import datetime
 from io import StringIO
 import json
 import os
-import gzip
 from functools import wraps
-
-from boto.s3.connection import S3Connection
-from boto.s3.connection import OrdinaryCallingFormat
+from timeit import default_timer
 
 from shiftmanager import util, queries
+from shiftmanager.cache import cached
+from shiftmanager.instrumentation import LoadReport
+from shiftmanager.mixins.reflection import _get_schema_and_relation
+
+# COPY options for loads into a fresh staging table; its rows are appended
+# to a table whose encodings and statistics are already set
+STAGED_COPY_OPTIONS = 'COMPUPDATE OFF STATUPDATE OFF'
+
+# Rows per INSERT statement on the small-load fast path
+INSERT_PAGE_SIZE = 250
+
+
+def _insert_value(value):
+    # Nested values load as JSON text, as COPY does
+    if isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return value
+
+
+def _needs_timeformat(table, projection, docs):
+    """
+    Whether any of *docs* has a string other than an ISO 8601 timestamp in
+    a timestamp column of *table*. COPY reads those with TIMEFORMAT 'auto',
+    but INSERT casts them with the session's DateStyle.
+    """
+    import sqlalchemy as sa
+
+    from shiftmanager.inference import TIMESTAMP_RE
+    from shiftmanager.util import text_type
+
+    # jsonpaths map to the table's columns by position
+    positions = [i for i, col in enumerate(table.columns)
+                 if isinstance(col.type, sa.DateTime) and
+                 i < len(projection.jsonpaths)]
+    for doc in docs:
+        values = projection.values(doc)
+        for i in positions:
+            value = values[i]
+            if isinstance(value, (str, text_type)) and \
+                    not TIMESTAMP_RE.match(value):
+                return True
+    return False
 
 
 def check_s3_connection(f):
@@ -33,13 +72,121 @@ def check_s3_connection(f):
     return wrapper
 
 
+def _write_json_chunk(docs, write_path, codec='gzip', level=None,
+                      serialized=False, projection=None, validator=None):
+    """
+    Write *docs* as newline-delimited JSON to *write_path*, compressed
+    with *codec* at *level*. If *serialized*, *docs* are already JSON
+    lines; otherwise a `~shiftmanager.projection.Projection`, if given,
+    writes only their projected values, and documents failing a
+    `~shiftmanager.validation.Validator` are left out.
+
+    Returns
+    -------
+    dict of records, raw_bytes, compressed_bytes, serialize_seconds,
+    compress_seconds and rejects, a list of (document, errors)
+    """
+    from shiftmanager.compression import get_codec
+
+    start = default_timer()
+    rejects = []
+    if validator is not None:
+        docs, rejects = validator.split(docs)
+    if serialized:
+        newlined = "".join(docs)
+    elif projection is not None:
+        newlined = projection.serialize(docs)
+    else:
+        newlined = "".join(["{}\n".format(json.dumps(doc)) for doc in docs])
+    encoded = newlined.encode("utf-8")
+    serialized = default_timer()
+    get_codec(codec).write(write_path, encoded, level)
+    compressed = default_timer()
+    return {
+        'records': len(docs),
+        'raw_bytes': len(encoded),
+        'compressed_bytes': os.path.getsize(write_path),
+        'serialize_seconds': serialized - start,
+        'compress_seconds': compressed - serialized,
+        'rejects': rejects,
+    }
+
+
+# Data being chunked by forked worker processes, keyed by a per-call token.
+# Children inherit it at fork, so only index ranges cross the process
+# boundary instead of pickled documents.
+_SHARED_DATA = {}
+
+
+def _write_json_chunk_job(job):
+    """Pool worker for `_write_json_chunk`; *job* holds docs or a range."""
+    (docs, token, inclusive, exclusive, write_path, codec, level, lines,
+     projection, validator) = job
+    if docs is None:
+        docs = _SHARED_DATA[token][inclusive:exclusive]
+    return _write_json_chunk(docs, write_path, codec, level, lines,
+                             projection, validator)
+
+
+def _compression_ratio(lines, codec, sample_bytes=1024 * 1024):
+    """Compressed over raw size of up to *sample_bytes* of JSON *lines*."""
+    sample = []
+    size = 0
+    step = max(1, len(lines) // 1000)
+    for line in lines[::step]:
+        sample.append(line)
+        size += len(line)
+        if size >= sample_bytes:
+            break
+    encoded = "".join(sample).encode("utf-8")
+    if not encoded:
+        return 1.0
+    return len(codec.compress(encoded)) / len(encoded)
+
+
+def _forks():
+    """Whether new worker processes are forked from this one."""
+    import multiprocessing
+
+    get_start_method = getattr(multiprocessing, 'get_start_method', None)
+    if get_start_method is None:
+        return os.name == 'posix'
+    return get_start_method() == 'fork'
+
+
 class S3Mixin(object):
     """The S3 interaction base class for `Redshift`."""
 
+    #: Documents sampled when `copy_json_to_table` generates jsonpaths
+    jsonpaths_sample_size = 10000
+
+    #: Documents compressed when choosing a codec with ``codec='auto'``
+    codec_sample_size = 1000
+
+    #: Upload bandwidth in bytes per second assumed by ``codec='auto'``;
+    #: if None, the rate measured by the previous load is used
+    upload_bandwidth = None
+
+    #: Compressed bytes per file aimed for with ``slices='auto'``; Redshift
+    #: recommends files of 1 MB to 1 GB after compression
+    target_file_bytes = 128 * 1024 * 1024
+
+    #: `copy_json_to_table` loads fewer documents than this with multi-row
+    #: INSERTs, skipping the fixed latency of staging files for COPY
+    insert_threshold = 1000
+
+    #: `query_to_frame` UNLOADs results estimated at more bytes than this,
+    #: rather than fetching them through the leader node
+    unload_threshold = 64 * 1024 * 1024
+
     def __init__(self, *args, **kwargs):
         self.s3_conn = None
         self.aws_account_id = None
         self.aws_role_name = None
+        self.storage_factory = None
+        self.storage_options = {}
+        self._storages = {}
+        self._measured_upload_bandwidth = None
 
     def set_aws_credentials(self, aws_access_key_id, aws_secret_access_key,
                             security_token=None):
@@ -81,6 +228,8 @@ class S3Mixin(object):
         ordinary_calling_fmt : bool
             Initialize connection with OrdinaryCallingFormat
         """
+        from boto.s3.connection import S3Connection
+        from boto.s3.connection import OrdinaryCallingFormat
 
         args = []
         kwargs = {}
@@ -184,6 +333,55 @@ class S3Mixin(object):
         boto_key = bucket.new_key(s3_key_path)
         boto_key.set_contents_from_filename(filename, encrypt_key=True)
 
+    def set_storage_backend(self, factory, **kwargs):
+        """
+        Set the storage backend used to stage files for loads and unloads.
+
+        Parameters
+        ----------
+        factory : callable
+            Called with a bucket name, returning a
+            `~shiftmanager.storage.Storage`; for example
+            ``LocalStorage.factory('/tmp/staging')``. If None, buckets
+            are accessed through `~shiftmanager.storage.S3Storage`.
+        kwargs :
+            Options for `~shiftmanager.storage.S3Storage`, like
+            *max_workers* or *multipart_threshold*, when *factory* is None
+        """
+        self.storage_factory = factory
+        self.storage_options = kwargs
+        self._storages = {}
+
+    def get_storage(self, bucket_name):
+        """
+        Return the `~shiftmanager.storage.Storage` for *bucket_name*.
+
+        Backends are created on first use and reused afterwards, so the
+        bucket lookup and S3 connection are shared across loads.
+        """
+        storage = self._storages.get(bucket_name)
+        if storage is None:
+            if self.storage_factory is not None:
+                storage = self.storage_factory(bucket_name)
+            else:
+                from shiftmanager.storage import S3Storage
+
+                storage = S3Storage(self.get_bucket(bucket_name),
+                                    **self.storage_options)
+            self._storages[bucket_name] = storage
+        return storage
+
+    @cached(maxsize=1)
+    def get_slice_count(self):
+        """
+        Return the number of slices in the cluster, from ``stv_slices``.
+
+        The count is cached alongside other catalog lookups.
+        """
+        with self.connection as conn, conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM stv_slices")
+            return cur.fetchone()[0]
+
     @check_s3_connection
     def get_bucket(self, bucket_name):
         """
@@ -216,11 +414,27 @@ class S3Mixin(object):
 
     @staticmethod
     @contextmanager
-    def chunked_json_slices(data, slices, directory=None, clean_on_exit=True):
+    def chunked_json_slices(data, slices, directory=None, clean_on_exit=True,
+                            report=None, processes=1, codec='gzip',
+                            compression_level=None, balance='records',
+                            target_file_bytes=None, projection=None,
+                            validator=None):
         """
         Given an iterator of dicts, chunk them into *slices* and write to
         temp files on disk. Clean up when leaving scope.
 
+        By default each chunk holds the same number of records. With
+        ``balance='bytes'``, documents are serialized up front and split so
+        each chunk holds the same number of bytes, keeping files even when
+        record sizes vary. Adding *target_file_bytes* then writes the
+        smallest multiple of *slices* files whose estimated compressed size
+        fits the target.
+
+        With more than one process, each worker serializes and compresses
+        whole slices in parallel. Where workers are forked, they read their
+        ranges of *data* from memory inherited from this process; otherwise
+        slices are pickled to them.
+
         Parameters
         ----------
         data : iter of dicts
@@ -231,6 +445,26 @@ class S3Mixin(object):
             Dir to write chunks to. Will default to $HOME/.shiftmanager/tmp/
         clean_on_exit : bool, default True
             Clean up chunks on disk when context exits
+        report : `~shiftmanager.instrumentation.LoadReport`
+            If given, serialize and compress timings, byte counts
+            and file counts are added to it. With several processes,
+            timings are summed across workers.
+        processes : int
+            Number of worker processes; None uses one per CPU
+        codec : str
+            Compression codec: gzip, bzip2, zstd, lzop or none
+        compression_level : int
+            Codec compression level; defaults to the codec's default
+        balance : str
+            'records' or 'bytes'
+        target_file_bytes : int
+            Maximum compressed size per file, with ``balance='bytes'``
+        projection : `~shiftmanager.projection.Projection`
+            Write only the values it selects from each document
+        validator : `~shiftmanager.validation.Validator`
+            Leave out documents failing its checks, which are handed to
+            its `~shiftmanager.validation.Validator.handle_rejects` before
+            the chunks are yielded
 
         Returns
         -------
@@ -239,13 +473,45 @@ class S3Mixin(object):
         chunk_files : list
             List of filenames
         """
+        import multiprocessing
+        import uuid
+
+        from shiftmanager.compression import get_codec
 
+        chunk_files = []
+        codec = get_codec(codec)
         # Ensure that files get cleaned up even on raised exception
         try:
             num_data = len(data)
-            chunk_range_start = util.linspace(0, num_data, slices)
-            chunk_range_end = chunk_range_start[1:]
-            chunk_range_end.append(None)
+            lines = balance == 'bytes'
+            rejects = []
+            if lines:
+                serialize_start = default_timer()
+                if validator is not None:
+                    data, rejects = validator.split(data)
+                if projection is not None:
+                    data = projection.lines(data)
+                else:
+                    data = ["{}\n".format(json.dumps(doc)) for doc in data]
+                if projection is not None and projection.output == 'csv':
+                    # CSV keeps non-ASCII text, so measure encoded bytes
+                    sizes = [len(line.encode('utf-8')) for line in data]
+                else:
+                    # json.dumps escapes non-ASCII, so lengths are byte counts
+                    sizes = [len(line) for line in data]
+                if report is not None:
+                    report.add_time('serialize',
+                                    default_timer() - serialize_start)
+                if target_file_bytes:
+                    slices = util.file_count(
+                        sum(sizes), _compression_ratio(data, codec), slices,
+                        target_file_bytes)
+                range_zipper = util.balanced_ranges(sizes, slices)
+            else:
+                chunk_range_start = util.linspace(0, num_data, slices)
+                chunk_range_end = chunk_range_start[1:]
+                chunk_range_end.append(None)
+                range_zipper = list(zip(chunk_range_start, chunk_range_end))
             stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f")
 
             if not directory:
@@ -255,34 +521,160 @@ class S3Mixin(object):
             if not os.path.exists(directory):
                 os.makedirs(directory)
 
-            chunk_files = []
-            range_zipper = list(zip(chunk_range_start, chunk_range_end))
-            for i, (inclusive, exclusive) in enumerate(range_zipper):
+            write_paths = [
+                os.path.join(directory,
+                             "-".join([stamp, str(i)]) + codec.extension)
+                for i in range(len(range_zipper))]
+            chunk_files.extend(write_paths)
+
+            if processes is None:
+                processes = multiprocessing.cpu_count()
+            processes = min(processes, len(range_zipper))
+
+            if processes > 1:
+                token = uuid.uuid4().hex
+                shared = _forks()
+                # Slices run to the end of the data when exclusive is None
+                jobs = [(None if shared else data[inclusive:exclusive],
+                         token, inclusive, exclusive, write_path,
+                         codec.name, compression_level, lines, projection,
+                         None if lines else validator)
+                        for (inclusive, exclusive), write_path
+                        in zip(range_zipper, write_paths)]
+                if shared:
+                    _SHARED_DATA[token] = data
+                pool = multiprocessing.Pool(processes)
+                try:
+                    all_stats = pool.map(_write_json_chunk_job, jobs)
+                    pool.close()
+                except BaseException:
+                    pool.terminate()
+                    raise
+                finally:
+                    pool.join()
+                    _SHARED_DATA.pop(token, None)
+            else:
+                all_stats = (
+                    _write_json_chunk(data[inclusive:exclusive], write_path,
+                                      codec.name, compression_level, lines,
+                                      projection,
+                                      None if lines else validator)
+                    for (inclusive, exclusive), write_path
+                    in zip(range_zipper, write_paths))
+
+            for stats in all_stats:
+                rejects.extend(stats['rejects'])
+                if report is not None:
+                    report.add_time('serialize', stats['serialize_seconds'])
+                    report.add_time('compress', stats['compress_seconds'])
+                    report.add_raw_bytes(stats['raw_bytes'])
+                    report.records += stats['records']
+                    report.files += 1
+            if rejects:
+                if report is not None:
+                    report.rejects += len(rejects)
+                validator.handle_rejects(rejects)
 
-                # Get either a inc/excl slice,
-                # or the slice to the end of the range
-                if exclusive is not None:
-                    sliced = data[inclusive:exclusive]
-                else:
-                    sliced = data[inclusive:]
+            yield stamp, chunk_files
+
+        finally:
+            if clean_on_exit:
+                for filepath in chunk_files:
+                    # Chunks may be missing if writing failed part way
+                    if os.path.exists(filepath):
+                        os.remove(filepath)
+
+    @staticmethod
+    @contextmanager
+    def chunked_frame_slices(frame, slices, file_format='csv',
+                             directory=None, clean_on_exit=True, report=None,
+                             codec='gzip', compression_level=None,
+                             integer_columns=()):
+        """
+        Split a DataFrame or Arrow table into *slices* row ranges and write
+        each to a CSV or Parquet file on disk. Clean up when leaving scope.
+
+        Parameters
+        ----------
+        frame : DataFrame or Arrow table
+        slices : int
+            Number of files to write
+        file_format : str
+            'csv' or 'parquet'
+        directory : str
+            Dir to write files to. Will default to $HOME/.shiftmanager/tmp/
+        clean_on_exit : bool, default True
+            Clean up files on disk when context exits
+        report : `~shiftmanager.instrumentation.LoadReport`
+            If given, serialize and compress timings, byte counts and file
+            counts are added to it
+        codec : str
+            Compression for CSV files; Parquet files are Snappy-compressed
+            internally
+        compression_level : int
+            Codec compression level; defaults to the codec's default
+        integer_columns : list
+            Frame columns loaded into integer columns, which CSV writes
+            without a decimal part even when they hold nulls
 
-                newlined = ""
-                for doc in sliced:
-                    newlined = "{}{}\n".format(newlined, json.dumps(doc))
+        Returns
+        -------
+        stamp : str
+            Timestamp that prepends the filenames of files written to disc
+        chunk_files : list
+            List of filenames
+        """
+        from shiftmanager import frames
+        from shiftmanager.compression import get_codec
+
+        if file_format not in frames.FORMATS:
+            raise ValueError("file_format must be one of {}".format(
+                ', '.join(frames.FORMATS)))
+        chunk_files = []
+        extension = ('.parquet' if file_format == 'parquet'
+                     else get_codec(codec).extension)
+        try:
+            num_rows = len(frame)
+            starts = util.linspace(0, num_rows, slices)
+            ranges = list(zip(starts, starts[1:] + [num_rows]))
+            # Frames with fewer rows than slices would leave files empty
+            ranges = [(a, b) for a, b in ranges if a < b] or ranges[:1]
+            stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S%f")
+
+            if not directory:
+                user_home = os.path.expanduser("~")
+                directory = os.path.join(user_home, ".shiftmanager", "tmp")
+
+            if not os.path.exists(directory):
+                os.makedirs(directory)
 
-                filepath = "{}.gz".format("-".join([stamp, str(i)]))
-                write_path = os.path.join(directory, filepath)
-                current_fp = gzip.open(write_path, 'wb')
-                current_fp.write(newlined.encode("utf-8"))
-                current_fp.close()
+            for i, (start, stop) in enumerate(ranges):
+                write_path = os.path.join(
+                    directory, "-".join([stamp, str(i)]) + extension)
                 chunk_files.append(write_path)
+                chunk = frames.slice_frame(frame, start, stop)
+                if file_format == 'parquet':
+                    stats = frames.write_parquet_chunk(chunk, write_path)
+                else:
+                    stats = frames.write_csv_chunk(chunk, write_path, codec,
+                                                   compression_level,
+                                                   integer_columns)
+                if report is not None:
+                    report.add_time('serialize', stats['serialize_seconds'])
+                    if 'compress_seconds' in stats:
+                        report.add_time('compress', stats['compress_seconds'])
+                    if 'raw_bytes' in stats:
+                        report.add_raw_bytes(stats['raw_bytes'])
+                    report.records += stats['records']
+                    report.files += 1
 
             yield stamp, chunk_files
 
         finally:
             if clean_on_exit:
                 for filepath in chunk_files:
-                    os.remove(filepath)
+                    if os.path.exists(filepath):
+                        os.remove(filepath)
 
     @staticmethod
     def gen_jsonpaths(json_doc, list_idx=None):
@@ -316,10 +708,46 @@ class S3Mixin(object):
         paths_list.sort()
         return {"jsonpaths": paths_list}
 
+    @staticmethod
+    def infer_jsonpaths(docs, sample_size=None, list_idx=None, seed=None):
+        """
+        Infer jsonpaths covering every field of a stream of documents.
+
+        Unlike `gen_jsonpaths`, fields missing from some documents are still
+        included. Documents are read once; with *sample_size*, a uniform
+        reservoir sample of that many is merged, so memory stays bounded
+        for very large feeds.
+
+        Parameters
+        ----------
+        docs : iterable of dicts or JSON strings
+        sample_size : int
+            Number of documents to sample; merges all documents if None
+        list_idx : int
+            Index for array position
+        seed : int
+            Random seed for sampling
+
+        Returns
+        -------
+        `~shiftmanager.inference.JsonPathInference`; call ``jsonpaths()``
+        for the jsonpaths dict and ``stats()`` for per-path types and
+        frequencies
+        """
+        from shiftmanager.inference import infer_jsonpaths
+
+        return infer_jsonpaths(docs, sample_size, list_idx, seed)
+
     @check_s3_connection
     def copy_json_to_table(self, bucket, keypath, data, jsonpaths, table,
                            slices=32, clean_up_s3=True, local_path=None,
-                           clean_up_local=True):
+                           clean_up_local=True, report_callback=None,
+                           processes=1, codec='gzip', compression_level=None,
+                           mode='append', merge_keys=None, deduplicate=False,
+                           deduplicate_order_by=None, presort=False,
+                           presort_run_size=None,
+                           projection=None, validate=False, reject_path=None,
+                           max_rejects=0, insert_threshold=None):
         """
         Given a list of JSON-able dicts, COPY them to the given *table_name*
 
@@ -337,12 +765,16 @@ class S3Mixin(object):
             Iterable of JSON-able dicts
         jsonpaths : dict
             Redshift jsonpaths file. If None, will autogenerate with
-            alphabetical order
+            alphabetical order from a sample of `jsonpaths_sample_size`
+            documents, using `infer_jsonpaths`
         table : str
             Table name for COPY
-        slices : int
+        slices : int or 'auto'
             Number of slices in your cluster. This many files will be generated
-            on S3 for efficient COPY.
+            on S3 for efficient COPY. With 'auto', the slice count is read
+            from the cluster and documents are split into evenly sized files,
+            as many multiples of it as keep each file within
+            `target_file_bytes` after compression.
         clean_up_s3 : bool
             Clean up S3 bucket after COPY completes
         local_path : str
@@ -350,75 +782,571 @@ class S3Mixin(object):
             $HOME/.shiftmanager/tmp/
         clean_up_local : bool
             Clean up local chunked JSON after COPY completes.
+        report_callback : callable
+            Called with the `~shiftmanager.instrumentation.LoadReport`
+            once the load completes
+        processes : int
+            Worker processes serializing and compressing chunks in
+            parallel; None uses one per CPU
+        codec : str
+            Compression for staged files: gzip, bzip2, zstd, lzop or none.
+            'auto' compresses a sample with each available codec and picks
+            the one with the lowest estimated compression plus upload time.
+        compression_level : int
+            Codec compression level; defaults to the codec's default
+        mode : str
+            'append' (the default) COPYs straight into *table*. 'merge'
+            COPYs into a temporary staging table like *table*, then deletes
+            rows of *table* matching staged *merge_keys* and inserts the
+            staged rows, all in one transaction; see `merge_statement`.
+            'staged' COPYs into a new permanent table like *table* with
+            compression and statistics updates off, checks that it holds
+            every document, then moves its rows into *table* with
+            ``ALTER TABLE APPEND``. *table* is only locked for the append,
+            which takes seconds, and a failed COPY never touches it.
+        merge_keys : str or list of str
+            Columns identifying a row, required for 'merge'
+        deduplicate : bool
+            In 'merge' mode, keep only the first document for each set of
+            merge key values
+        deduplicate_order_by : str
+            Order choosing which duplicate is kept, like
+            'updated_at DESC NULLS LAST'
+        presort : bool
+            Sort documents by *table*'s compound sortkey before staging,
+            reading sortkey values through *jsonpaths*. If the batch sorts
+            after the rows already in *table*, the COPY keeps the table
+            sorted and no VACUUM is needed. *data* may then be any
+            iterable, such as a generator, when *jsonpaths* is given.
+        presort_run_size : int
+            Documents sorted in memory at once, 100,000 by default. Larger
+            inputs are sorted in runs written under *local_path* and
+            merged from disk.
+        projection : str
+            Stage only the values selected by *jsonpaths*, in jsonpaths
+            order: 'json' writes each document as a JSON array, and 'csv'
+            as a CSV row. Fields COPY would skip are never serialized,
+            uploaded or parsed.
+        validate : bool
+            Check each document against *table*'s column types, lengths,
+            ranges and NOT NULL constraints as it is serialized, so bad
+            data fails before anything is uploaded
+        reject_path : str
+            With *validate*, a local JSON lines file to which invalid
+            documents are appended along with their errors
+        max_rejects : int or None
+            With *validate*, how many invalid documents to leave out of the
+            load before failing; None for any number
+        insert_threshold : int
+            Load fewer documents than this with batched multi-row INSERTs
+            in one transaction instead of staging them for COPY, mapping
+            jsonpaths to columns the same way; defaults to the
+            `insert_threshold` attribute. Pass 0 to always COPY. Loads
+            with timestamps other than ISO 8601 are always COPYed, since
+            only COPY reads them with TIMEFORMAT 'auto'.
+
+        Returns
+        -------
+        `~shiftmanager.instrumentation.LoadReport` with per-phase timings,
+        byte and file counts, and the ``pg_last_copy_count()`` of the COPY
         """
 
+        copy_table, setup, finish = self._load_mode_statements(
+            table, mode, merge_keys, deduplicate, deduplicate_order_by)
+        report = LoadReport(table)
+        reflected = None
+        if presort or validate:
+            if jsonpaths is None:
+                data = data if hasattr(data, '__len__') else list(data)
+                print("Generating jsonpaths...")
+                jsonpaths = self.infer_jsonpaths(
+                    data, sample_size=self.jsonpaths_sample_size).jsonpaths()
+            reflected = self._reflected_target(table)
+        validator = None
+        if validate:
+            from shiftmanager.validation import Validator
+
+            validator = Validator(reflected, jsonpaths, reject_path,
+                                  max_rejects)
+        if presort:
+            with report.phase('sort'):
+                data = self._presorted(reflected, data, jsonpaths,
+                                       presort_run_size, local_path)
+        if insert_threshold is None:
+            insert_threshold = self.insert_threshold
+        if len(data) < insert_threshold:
+            if jsonpaths is None:
+                print("Generating jsonpaths...")
+                jsonpaths = self.infer_jsonpaths(
+                    data, sample_size=self.jsonpaths_sample_size).jsonpaths()
+            if reflected is None:
+                reflected = self._reflected_target(table)
+            if self._insert_json(table, copy_table, reflected, data,
+                                 jsonpaths, setup, finish, mode, validator,
+                                 report):
+                report.finish()
+                if report_callback is not None:
+                    report_callback(report)
+                return report
+
+        if codec == 'auto':
+            codec = self._choose_codec(self._json_sample(data), processes)
+        report.codec = codec
+        if slices == 'auto':
+            slices, balance = self.get_slice_count(), 'bytes'
+            target_file_bytes = self.target_file_bytes
+        else:
+            balance, target_file_bytes = 'records', None
+
         print("Fetching S3 bucket {}...".format(bucket))
-        bukkit = self.get_bucket(bucket)
+        storage = self.get_storage(bucket)
 
         # Keys to clean up
         s3_sweep = []
 
         # Ensure S3 cleanup on failure
         try:
-            with self.chunked_json_slices(data, slices, local_path,
-                                          clean_up_local) \
-                    as (stamp, file_paths):
+            mfest_complete_path, jpaths_complete_path = self._stage_json(
+                storage, keypath, data, jsonpaths, slices, local_path,
+                clean_up_local, s3_sweep, report, processes, codec,
+                compression_level, balance, target_file_bytes, projection,
+                validator)
+
+            statement = self._json_copy_statement(
+                copy_table, mfest_complete_path, jpaths_complete_path, codec)
+            statement = statement.strip()
+            if mode == 'staged':
+                statement += ' ' + STAGED_COPY_OPTIONS
+            statement = ';\n'.join(setup + [statement] + finish)
 
-                manifest = {"entries": []}
+            print("Performing COPY...")
+            with report.phase('copy'):
+                self.execute(statement)
+            report.copy_count = self._last_copy_count()
+            if mode == 'staged':
+                with report.phase('append'):
+                    self._append_from_staging(table, copy_table,
+                                              report.records)
 
-                print("Writing chunks...")
-                for path in file_paths:
-                    filename = os.path.basename(path)
-                    # Strip leading slash
-                    if keypath[0] == "/":
-                        keypath = keypath[1:]
+        finally:
+            if clean_up_s3:
+                with report.phase('cleanup'):
+                    storage.delete(s3_sweep)
+            if presort and hasattr(data, 'close'):
+                # Sorted on disk; remove the merged runs
+                data.close()
+
+        report.finish()
+        if report.upload_bytes_per_second:
+            self._measured_upload_bandwidth = report.upload_bytes_per_second
+        if report_callback is not None:
+            report_callback(report)
+        return report
+
+    def _insert_json(self, table, insert_table, reflected, data, jsonpaths,
+                     setup, finish, mode, validator, report):
+        """
+        Load *data* into *insert_table* with multi-row INSERTs, running the
+        load mode's *setup* and *finish* statements in the same
+        transaction.
 
-                    data_keypath = os.path.join(keypath, filename)
-                    data_key = bukkit.new_key(data_keypath)
-                    s3_sweep.append(data_keypath)
+        Returns False, having loaded nothing, if a timestamp in *data*
+        needs COPY's TIMEFORMAT 'auto'.
+        """
+        from shiftmanager.projection import Projection
+
+        projection = Projection(jsonpaths)
+        if _needs_timeformat(reflected, projection, data):
+            print("Timestamps need COPY's TIMEFORMAT 'auto'; staging "
+                  "instead of inserting...")
+            return False
+        if validator is not None:
+            data, rejects = validator.split(data)
+            report.rejects += len(rejects)
+            validator.handle_rejects(rejects)
+        report.records = len(data)
+        row = '(' + ', '.join(['%s'] * len(projection.jsonpaths)) + ')'
+        statements = []
+        for start in range(0, len(data), INSERT_PAGE_SIZE):
+            page = data[start:start + INSERT_PAGE_SIZE]
+            values = [_insert_value(value) for doc in page
+                      for value in projection.values(doc)]
+            statements.append(self.mogrify(
+                'INSERT INTO {} VALUES\n'.format(insert_table) +
+                ',\n'.join([row] * len(page)), values))
+
+        print("Inserting {} documents...".format(len(data)))
+        with report.phase('insert'):
+            if statements:
+                self.execute(';\n'.join(setup + statements + finish))
+        if mode == 'staged' and statements:
+            with report.phase('append'):
+                self._append_from_staging(table, insert_table, report.records)
+        return True
 
-                    with open(path, 'rb') as f:
-                        data_key.set_contents_from_file(f)
+    @check_s3_connection
+    def copy_frame_to_table(self, bucket, keypath, frame, table, slices=32,
+                            file_format=None, column_map=None,
+                            clean_up_s3=True, local_path=None,
+                            clean_up_local=True, report_callback=None,
+                            codec='gzip', compression_level=None,
+                            mode='append', merge_keys=None,
+                            deduplicate=False, deduplicate_order_by=None):
+        """
+        COPY a pandas DataFrame or Arrow data to the given *table*.
 
-                    manifest_entry = {
-                        "url": "s3://{}/{}".format(bukkit.name, data_keypath),
-                        "mandatory": True
-                    }
-                    manifest["entries"].append(manifest_entry)
-                    data_key.close()
+        Row ranges of *frame* are written straight from its columns to
+        *slices* CSV or Parquet files, with no per-row Python objects, then
+        staged in the S3 *bucket* and COPYed like `copy_json_to_table`.
 
-                stamped_path = os.path.join(keypath, stamp)
+        Parameters
+        ----------
+        bucket : str
+            S3 bucket for writes
+        keypath : str
+            S3 key path for writes
+        frame : DataFrame, Arrow table or record batch, or list of batches
+            Data to load; CSV needs pandas and Parquet needs pyarrow
+        table : str
+            Table name for COPY
+        slices : int or 'auto'
+            Number of files to write; 'auto' reads the cluster's slice count
+        file_format : str
+            'csv' or 'parquet'; defaults to 'csv' for DataFrames and
+            'parquet' for Arrow data
+        column_map : dict
+            Frame column names mapped to *table* column names, or to None to
+            leave a column out. Other columns load into the *table* column
+            of the same name, ignoring case. CSV loads name their columns,
+            so *table* columns missing from *frame* get their defaults;
+            Parquet is read by position, so *frame* must cover every column.
+        clean_up_s3 : bool
+            Clean up S3 bucket after COPY completes
+        local_path : str
+            Local path to write files. Defaults to $HOME/.shiftmanager/tmp/
+        clean_up_local : bool
+            Clean up local files after COPY completes.
+        report_callback : callable
+            Called with the `~shiftmanager.instrumentation.LoadReport`
+            once the load completes
+        codec : str
+            Compression for CSV files: gzip, bzip2, zstd, lzop or none.
+            Parquet files are always Snappy-compressed.
+        compression_level : int
+            Codec compression level; defaults to the codec's default
+        mode, merge_keys, deduplicate, deduplicate_order_by :
+            Load mode, as for `copy_json_to_table`
 
-                def single_dict_write(ext, single_data):
-                    kpath = "".join([stamped_path, ext])
-                    complete_path = "s3://{}/{}".format(bukkit.name, kpath)
-                    key = bukkit.new_key(kpath)
-                    self.write_dict_to_key(single_data, key, close=True)
-                    s3_sweep.append(kpath)
-                    return complete_path
+        Returns
+        -------
+        `~shiftmanager.instrumentation.LoadReport` with per-phase timings,
+        byte and file counts, and the ``pg_last_copy_count()`` of the COPY
+        """
+        from shiftmanager import frames
+
+        frame = frames.as_frame(frame)
+        file_format = file_format or frames.default_format(frame)
+        if file_format not in frames.FORMATS:
+            raise ValueError("file_format must be one of {}".format(
+                ', '.join(frames.FORMATS)))
+        reflected = self._reflected_target(table)
+        table_columns = [col.name for col in reflected.columns]
+        pairs = frames.map_columns(frames.frame_columns(frame),
+                                   table_columns, column_map)
+        if file_format == 'parquet':
+            missing = set(table_columns) - set(col for _, col in pairs)
+            if missing:
+                raise ValueError(
+                    "Parquet is COPYed by position, so the frame needs every "
+                    "column of {}; missing {}".format(
+                        table, ', '.join(sorted(missing))))
+            by_column = dict((col, name) for name, col in pairs)
+            frame = frames.select_columns(
+                frame, [by_column[col] for col in table_columns])
+            columns = None
+        else:
+            frame = frames.select_columns(frame, [name for name, _ in pairs])
+            columns = [col for _, col in pairs]
+        integer_columns = (frames.integer_columns(pairs, reflected)
+                           if file_format == 'csv' else [])
+
+        copy_table, setup, finish = self._load_mode_statements(
+            table, mode, merge_keys, deduplicate, deduplicate_order_by)
+        report = LoadReport(table)
+        report.codec = 'parquet' if file_format == 'parquet' else codec
+        if slices == 'auto':
+            slices = self.get_slice_count()
 
-                print("Writing .manifest file...")
-                mfest_complete_path = single_dict_write(".manifest", manifest)
+        print("Fetching S3 bucket {}...".format(bucket))
+        storage = self.get_storage(bucket)
+        keypath = keypath.lstrip("/")
 
-                print("Writing jsonpaths file...")
-                jpaths_complete_path = single_dict_write(".jsonpaths",
-                                                         jsonpaths)
+        # Keys to clean up
+        s3_sweep = []
 
-            creds = "aws_access_key_id={};aws_secret_access_key={}".format(
-                self.aws_access_key_id, self.aws_secret_access_key)
-            if self.security_token:
-                creds += ';token={}'.format(self.security_token)
+        # Ensure S3 cleanup on failure
+        try:
+            with self.chunked_frame_slices(frame, slices, file_format,
+                                           local_path, clean_up_local, report,
+                                           codec, compression_level,
+                                           integer_columns) \
+                    as (stamp, file_paths):
+                mfest_complete_path = self._upload_chunks(
+                    storage, keypath, stamp, file_paths, s3_sweep, report,
+                    content_length=file_format == 'parquet')
 
-            statement = queries.copy_from_s3.format(
-                table=table, manifest_key=mfest_complete_path,
-                creds=creds, jpaths_key=jpaths_complete_path)
+            statement = self._frame_copy_statement(
+                copy_table, columns, mfest_complete_path, file_format, codec)
+            if mode == 'staged':
+                statement += ' ' + STAGED_COPY_OPTIONS
+            statement = ';\n'.join(setup + [statement] + finish)
 
             print("Performing COPY...")
-            self.execute(statement)
+            with report.phase('copy'):
+                self.execute(statement)
+            report.copy_count = self._last_copy_count()
+            if mode == 'staged':
+                with report.phase('append'):
+                    self._append_from_staging(table, copy_table,
+                                              report.records)
 
         finally:
             if clean_up_s3:
-                bukkit.delete_keys(s3_sweep)
+                with report.phase('cleanup'):
+                    storage.delete(s3_sweep)
+
+        report.finish()
+        if report.upload_bytes_per_second:
+            self._measured_upload_bandwidth = report.upload_bytes_per_second
+        if report_callback is not None:
+            report_callback(report)
+        return report
+
+    def _frame_copy_statement(self, table, columns, manifest_path,
+                              file_format, codec='gzip'):
+        """
+        Return the COPY statement loading staged frame files into *table*,
+        naming *columns* if given.
+        """
+        from shiftmanager.compression import get_codec
+        from shiftmanager.projection import CSV_NULL
+
+        if columns is not None:
+            table = '{} ({})'.format(
+                table, ', '.join('"{}"'.format(col) for col in columns))
+        if file_format == 'parquet':
+            options = 'FORMAT AS PARQUET'
+        else:
+            compression = get_codec(codec).copy_option
+            options = "FORMAT AS CSV NULL AS '{}' {}TIMEFORMAT 'auto'".format(
+                CSV_NULL, compression + ' ' if compression else '')
+        return queries.copy_from_manifest.format(
+            table=table, manifest_key=manifest_path,
+            creds=self.aws_credentials, options=options).strip()
+
+    def _reflected_target(self, table):
+        """Reflect *table*, a possibly schema-qualified name."""
+        schema, name = _get_schema_and_relation(table)
+        return self.reflected_table(name, schema=schema)
+
+    def _presorted(self, table, data, jsonpaths, run_size, directory):
+        """
+        Return *data* sorted by the sortkey of the reflected *table*, as a
+        list or as a `~shiftmanager.sorting.SpooledDocuments` when sorted
+        on disk.
+        """
+        from shiftmanager.sorting import (DEFAULT_RUN_SIZE, sort_documents,
+                                          sortkey_function)
+
+        key = sortkey_function(table, jsonpaths)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        print("Sorting documents by the sortkey of {}...".format(
+            table.name))
+        return sort_documents(data, key, run_size or DEFAULT_RUN_SIZE,
+                              directory)
+
+    def _load_mode_statements(self, table, mode, merge_keys=None,
+                              deduplicate=False, deduplicate_order_by=None):
+        """
+        Return the table to COPY into for load *mode*, with lists of
+        statements to run before and after the COPY in its transaction.
+        """
+        if mode == 'append':
+            return table, [], []
+        if mode == 'merge':
+            staging, create, merge = self._merge_statements(
+                table, merge_keys, deduplicate, deduplicate_order_by)
+            return staging, [create], [merge.rstrip(';')]
+        if mode == 'staged':
+            staging, create = self._append_staging_statements(table)
+            return staging, [create], []
+        raise ValueError("mode must be 'append', 'merge' or 'staged'")
+
+    def _append_from_staging(self, table, staging, expected_rows):
+        """
+        Check that *staging* holds *expected_rows* rows, then move them
+        into *table* with ``ALTER TABLE APPEND``. *staging* is dropped
+        afterwards, whether or not that succeeds.
+
+        The append only moves blocks between tables, so *table* is
+        locked for seconds rather than for the whole COPY. It can't run
+        inside a transaction block, so it commits on its own.
+        """
+        try:
+            with self.connection as conn, conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM {}".format(staging))
+                row = cur.fetchone()
+            loaded = row[0] if row else None
+            if loaded != expected_rows:
+                raise ValueError(
+                    "Staging table {} holds {} rows, but {} were staged; "
+                    "leaving {} unchanged".format(staging, loaded,
+                                                  expected_rows, table))
+            print("Appending {} rows to {}...".format(loaded, table))
+            self.execute("ALTER TABLE {} APPEND FROM {}".format(
+                table, staging), autocommit=True)
+        finally:
+            self.execute("DROP TABLE IF EXISTS {}".format(staging))
+
+    def _json_sample(self, data):
+        """Serialize `codec_sample_size` documents spread across *data*."""
+        step = max(1, len(data) // self.codec_sample_size)
+        sample = data[::step][:self.codec_sample_size]
+        return "".join(["{}\n".format(json.dumps(doc))
+                        for doc in sample]).encode("utf-8")
+
+    def _choose_codec(self, sample, processes=1, codecs=None):
+        """
+        Choose a codec by compressing *sample* bytes with each available
+        codec, or each of *codecs*, weighing compression time against
+        upload bandwidth.
+        """
+        import multiprocessing
+
+        from shiftmanager.compression import choose_codec
+
+        bandwidth = self.upload_bandwidth or self._measured_upload_bandwidth
+        codec, _ = choose_codec(sample, bandwidth,
+                                processes or multiprocessing.cpu_count(),
+                                codecs)
+        print("Chose {} compression".format(codec))
+        return codec
+
+    def _stage_json(self, storage, keypath, data, jsonpaths, slices,
+                    local_path, clean_up_local, s3_sweep, report=None,
+                    processes=1, codec='gzip', compression_level=None,
+                    balance='records', target_file_bytes=None,
+                    projection=None, validator=None):
+        """
+        Write chunked JSON, a manifest and a jsonpaths file to *storage*,
+        appending every key written to *s3_sweep*. With a *projection*
+        output format, only the values selected by the jsonpaths are
+        written. Documents failing a *validator* are left out.
+
+        Returns
+        -------
+        (manifest S3 path, jsonpaths S3 path, or None for CSV)
+        """
+        report = report or LoadReport()
+        # Strip leading slash
+        keypath = keypath.lstrip("/")
+        if jsonpaths is None:
+            print("Generating jsonpaths...")
+            jsonpaths = self.infer_jsonpaths(
+                data, sample_size=self.jsonpaths_sample_size).jsonpaths()
+        if projection is not None:
+            from shiftmanager.projection import Projection
+
+            projection = Projection(jsonpaths, projection)
+            jsonpaths = projection.copy_jsonpaths()
+        with self.chunked_json_slices(data, slices, local_path,
+                                      clean_up_local, report, processes,
+                                      codec, compression_level, balance,
+                                      target_file_bytes, projection,
+                                      validator) \
+                as (stamp, file_paths):
+
+            mfest_complete_path = self._upload_chunks(
+                storage, keypath, stamp, file_paths, s3_sweep, report)
+
+            jpaths_complete_path = None
+            if jsonpaths is not None:
+                with report.phase('manifest'):
+                    print("Writing jsonpaths file...")
+                    jpaths_complete_path = self._put_json(
+                        storage, os.path.join(keypath, stamp) + ".jsonpaths",
+                        jsonpaths, s3_sweep)
+            local_cleanup_start = default_timer()
+
+        report.add_time('cleanup', default_timer() - local_cleanup_start)
+        return mfest_complete_path, jpaths_complete_path
+
+    def _upload_chunks(self, storage, keypath, stamp, file_paths, s3_sweep,
+                       report, content_length=False):
+        """
+        Upload chunk files to *storage* under *keypath*, then write a
+        manifest listing them, appending every key written to *s3_sweep*.
+        Manifests for columnar formats need each file's *content_length*.
+
+        Returns
+        -------
+        The manifest's S3 path
+        """
+        uploads = [(os.path.join(keypath, os.path.basename(path)), path)
+                   for path in file_paths]
+        s3_sweep.extend(data_keypath for data_keypath, _ in uploads)
+
+        print("Writing chunks...")
+        with report.phase('upload'):
+            storage.put_filenames(uploads)
+        sizes = [os.path.getsize(path) for path in file_paths]
+        report.compressed_bytes += sum(sizes)
+
+        entries = []
+        for (data_keypath, _), size in zip(uploads, sizes):
+            entry = {"url": storage.url(data_keypath), "mandatory": True}
+            if content_length:
+                entry["meta"] = {"content_length": size}
+            entries.append(entry)
+
+        with report.phase('manifest'):
+            print("Writing .manifest file...")
+            return self._put_json(
+                storage, os.path.join(keypath, stamp) + ".manifest",
+                {"entries": entries}, s3_sweep)
+
+    @staticmethod
+    def _put_json(storage, kpath, data, s3_sweep):
+        """Write *data* as JSON to *kpath* and return its S3 path."""
+        storage.put_string(kpath, json.dumps(data, ensure_ascii=False))
+        s3_sweep.append(kpath)
+        return storage.url(kpath)
+
+    def _json_copy_statement(self, table, manifest_path, jsonpaths_path,
+                             codec='gzip'):
+        """
+        Return the COPY statement loading staged JSON into *table*, or
+        staged CSV if there is no *jsonpaths_path*.
+        """
+        from shiftmanager.compression import get_codec
+        from shiftmanager.projection import CSV_NULL
+
+        creds = "aws_access_key_id={};aws_secret_access_key={}".format(
+            self.aws_access_key_id, self.aws_secret_access_key)
+        if self.security_token:
+            creds += ';token={}'.format(self.security_token)
+
+        compression = get_codec(codec).copy_option
+        if jsonpaths_path is None:
+            return queries.copy_csv_from_s3.format(
+                table=table, manifest_key=manifest_path, creds=creds,
+                null=CSV_NULL,
+                compression=compression + ' ' if compression else '')
+        return queries.copy_from_s3.format(
+            table=table, manifest_key=manifest_path,
+            creds=creds, jpaths_key=jsonpaths_path,
+            compression=compression + ' ' if compression else '')
 
     @check_s3_connection
     def unload_table_to_s3(self, bucket, keypath, table,
@@ -454,6 +1382,26 @@ class S3Mixin(object):
             - ALLOWOVERWRITE
         """
 
+        if not options:
+            options = "MANIFEST GZIP ALLOWOVERWRITE"
+        if self._diststyle(table, schema) == 'ALL':
+            options += ' PARALLEL OFF'
+
+        if to_json:
+            columns_and_types = self._get_columns_and_types(table, col_str)
+            cols = self._json_col_str(columns_and_types)
+        else:
+            cols = col_str
+
+        statement = self._unload_statement(bucket, keypath, table, schema,
+                                           cols, where, options)
+
+        print("Performing UNLOAD...")
+        self.execute(statement)
+
+    def _unload_statement(self, bucket, keypath, table, schema, cols, where,
+                          options):
+        """Return the UNLOAD statement for *table* given resolved columns."""
         # leaving this without schema name to not break backwards compatibility
         s3_table_path = 's3://' + os.path.join(bucket, keypath, table + '/')
 
@@ -466,17 +1414,6 @@ class S3Mixin(object):
             if self.security_token:
                 creds += ';token={}'.format(self.security_token)
 
-        if not options:
-            options = "MANIFEST GZIP ALLOWOVERWRITE"
-        if self._diststyle(table, schema) == 'ALL':
-            options += ' PARALLEL OFF'
-
-        if to_json:
-            columns_and_types = self._get_columns_and_types(table, col_str)
-            cols = self._json_col_str(columns_and_types)
-        else:
-            cols = col_str
-
         if schema:
             table = "{schema}.{table}".format(schema=schema, table=table)
         select = "SELECT {col_str} FROM {table} ".format(
@@ -484,27 +1421,147 @@ class S3Mixin(object):
         if where is not None:
             select += where
 
-        statement = """
-        UNLOAD ($${select}$$)
-        TO '{s3_path}'
-        CREDENTIALS '{creds}'
-        {options};
-        """.format(select=select.strip(), s3_path=s3_table_path, creds=creds,
-                   options=options)
+        return queries.unload_to_s3.format(
+            select=select.strip(), s3_path=s3_table_path, creds=creds,
+            options=options)
 
-        print("Performing UNLOAD...")
-        self.execute(statement)
+    def query_to_frame(self, sql, bucket=None, keypath='shiftmanager/reads/',
+                       output='pandas', parameters=None, batch_size=10000,
+                       unload_threshold=None, local_path=None,
+                       max_workers=None, clean_up_s3=True):
+        """
+        Run the query *sql* and return its result as a DataFrame or Arrow
+        table.
+
+        The result size is estimated from ``EXPLAIN``. Small results are
+        fetched through a server-side cursor in batches of *batch_size*
+        rows and assembled column by column. Larger ones are UNLOADed in
+        parallel to Parquet files in *bucket*, which are downloaded and
+        read concurrently, so they never pass through the leader node.
+
+        Parameters
+        ----------
+        sql : str
+            A SELECT query
+        bucket : str
+            S3 bucket for UNLOADed files; without one, results are always
+            fetched through a cursor
+        keypath : str
+            S3 key path under which each read writes its files
+        output : str
+            'pandas' for a DataFrame or 'arrow' for an Arrow table
+        parameters : list or dict
+            Values to bind to *sql*
+        batch_size : int
+            Rows fetched from the cursor at once
+        unload_threshold : int
+            Estimated result bytes above which *sql* is UNLOADed; defaults
+            to the `unload_threshold` attribute
+        local_path : str
+            Local path to download UNLOADed files to. Defaults to
+            $HOME/.shiftmanager/tmp/
+        max_workers : int
+            Files downloaded and read at once; defaults to the storage's
+            `max_workers`
+        clean_up_s3 : bool
+            Delete the UNLOADed files afterwards
+
+        Returns
+        -------
+        DataFrame or Arrow table. UNLOADed rows arrive in file order, so
+        sort the result if *sql*'s ORDER BY matters.
+        """
+        from shiftmanager import frames
+
+        if output not in frames.OUTPUTS:
+            raise ValueError("output must be one of {}".format(
+                ', '.join(frames.OUTPUTS)))
+        if parameters is not None:
+            sql = self.mogrify(sql, parameters)
+        sql = sql.strip().rstrip(';')
+        if bucket is not None:
+            if unload_threshold is None:
+                unload_threshold = self.unload_threshold
+            estimate = self._estimate_result_bytes(sql)
+            if estimate is not None and estimate > unload_threshold:
+                print("Result estimated at {} bytes; unloading...".format(
+                    estimate))
+                return self._unload_to_frame(sql, bucket, keypath, output,
+                                             local_path, max_workers,
+                                             clean_up_s3)
+        return self._fetch_frame(sql, output, batch_size)
+
+    def _estimate_result_bytes(self, sql):
+        """Result size of *sql* estimated by ``EXPLAIN``, or None."""
+        from shiftmanager import frames
+
+        with self.connection as conn, conn.cursor() as cur:
+            cur.execute('EXPLAIN ' + sql)
+            plan = [row[0] for row in cur.fetchall()]
+        return frames.estimate_result_bytes(plan)
+
+    def _fetch_frame(self, sql, output, batch_size):
+        """Fetch *sql* through a named cursor, *batch_size* rows at once."""
+        import uuid
+
+        from shiftmanager import frames
+
+        names = None
+        columns = None
+        print("Fetching query results...")
+        with self.connection as conn:
+            with conn.cursor('shiftmanager_{}'.format(
+                    uuid.uuid4().hex[:8])) as cur:
+                cur.itersize = batch_size
+                cur.execute(sql)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if columns is None:
+                        # Named cursors describe the result once fetched
+                        names = [col[0] for col in cur.description]
+                        columns = [[] for _ in names]
+                    if not rows:
+                        break
+                    for column, values in zip(columns, zip(*rows)):
+                        column.extend(values)
+        return frames.columns_to_frame(names, columns, output)
+
+    @check_s3_connection
+    def _unload_to_frame(self, sql, bucket, keypath, output, local_path,
+                         max_workers, clean_up_s3):
+        """UNLOAD *sql* to Parquet and read the files back."""
+        import uuid
+
+        from shiftmanager import frames
+
+        storage = self.get_storage(bucket)
+        prefix = '{}{}/'.format(keypath.lstrip('/'), uuid.uuid4().hex)
+        if not local_path:
+            user_home = os.path.expanduser("~")
+            local_path = os.path.join(user_home, ".shiftmanager", "tmp")
+        if not os.path.exists(local_path):
+            os.makedirs(local_path)
+        try:
+            self.execute(queries.unload_to_s3.format(
+                select=sql, s3_path=storage.url(prefix),
+                creds=self.aws_credentials,
+                options='MANIFEST ALLOWOVERWRITE FORMAT AS PARQUET'))
+            keys = [key for key in storage.list(prefix)
+                    if not key.endswith('manifest')]
+            if not keys:
+                # An empty result has no files to take its columns from
+                return self._fetch_frame(sql, output, 1)
+            print("Reading {} unloaded files...".format(len(keys)))
+            table = frames.read_parquet_keys(storage, keys, local_path,
+                                             max_workers)
+        finally:
+            if clean_up_s3:
+                storage.delete(storage.list(prefix))
+        return table if output == 'arrow' else table.to_pandas()
 
+    @cached()
     def _get_columns_and_types(self, table, schema=None, col_str='*'):
-        query = """
-        SELECT "column", "type"
-        FROM pg_table_def
-        WHERE tablename = '{table}'
-        """.format(table=table)
-        if schema:
-            query += """AND schemaname = '{schema}'""".format(schema=schema)
-        if col_str != '*':
-            query += """AND "column" IN ({columns})""".format(columns=col_str)
+        query = self._columns_and_types_query(table, schema, col_str)
         with self.connection as conn:
             with conn.cursor() as cur:
                 cur.execute(query)
@@ -557,7 +1614,35 @@ class S3Mixin(object):
         return any(no_quote_type in col_type
                    for no_quote_type in no_quote_types)
 
+    @cached()
     def _diststyle(self, table, schema=None):
+        query = self._diststyle_query(table, schema)
+        with self.connection as conn, conn.cursor() as cur:
+            cur.execute(query)
+            return cur.fetchone()[0]
+
+    def _last_copy_count(self):
+        """Rows loaded by the most recent COPY in this session."""
+        with self.connection as conn, conn.cursor() as cur:
+            cur.execute("SELECT pg_last_copy_count()")
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    @staticmethod
+    def _columns_and_types_query(table, schema=None, col_str='*'):
+        query = """
+        SELECT "column", "type"
+        FROM pg_table_def
+        WHERE tablename = '{table}'
+        """.format(table=table)
+        if schema:
+            query += """AND schemaname = '{schema}'""".format(schema=schema)
+        if col_str != '*':
+            query += """AND "column" IN ({columns})""".format(columns=col_str)
+        return query
+
+    @staticmethod
+    def _diststyle_query(table, schema=None):
         query = """
         SELECT diststyle
         FROM svv_table_info
@@ -565,6 +1650,4 @@ class S3Mixin(object):
         """
         if schema:
             query += """AND "schema" = '{schema}'"""
-        with self.connection as conn, conn.cursor() as cur:
-            cur.execute(query.format(table=table, schema=schema))
-            return cur.fetchone()[0]
+        return query.format(table=table, schema=schema)
@@ -0,0 +1,183 @@
+"""
+Project documents down to the fields a COPY reads.
+
+COPY only loads the values its jsonpaths select, so staging whole
+documents wastes serialization time, disk, upload bandwidth and COPY
+parsing. A `Projection` compiles jsonpaths into extractors and writes
+only the selected values, in jsonpaths order. Output is either JSON
+arrays, which COPY reads with positional ``$[0]``, ``$[1]``, ...
+jsonpaths, or CSV rows.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import csv
+from io import BytesIO, StringIO
+import json
+import re
+import sys
+
+from shiftmanager.util import text_type
+
+OUTPUTS = ('json', 'csv')
+
+# Marks SQL NULL in CSV output, passed to COPY as NULL AS
+CSV_NULL = r'\N'
+
+# The csv module writes text on Python 3 but UTF-8 bytes on Python 2
+CSV_WRITES_TEXT = sys.version_info[0] >= 3
+
+JSONPATH_STEP_RE = re.compile(r"""
+    \.([^.\[\]]+)             # .key
+    | \[\s*'([^']*)'\s*\]     # ['key']
+    | \[\s*"([^"]*)"\s*\]     # ["key"]
+    | \[\s*(\d+)\s*\]         # [0]
+""", re.VERBOSE)
+
+
+def parse_jsonpath(path):
+    """
+    Return the keys and list indexes making up a Redshift jsonpath.
+
+    >>> parse_jsonpath("$['user']['tags'][0]")
+    ['user', 'tags', 0]
+    >>> parse_jsonpath('$.user.id')
+    ['user', 'id']
+    """
+    if not path.startswith('$'):
+        raise ValueError("{} is not a jsonpath".format(path))
+    steps = []
+    position = 1
+    for match in JSONPATH_STEP_RE.finditer(path, 1):
+        if match.start() != position:
+            break
+        dotted, single, double, index = match.groups()
+        steps.append(int(index) if index is not None
+                     else next(s for s in (dotted, single, double)
+                               if s is not None))
+        position = match.end()
+    if position != len(path):
+        raise ValueError("Can't parse jsonpath {}".format(path))
+    return steps
+
+
+def compile_steps(steps):
+    """
+    Return a function reading the value at *steps* from a document, or
+    None where any step is missing.
+    """
+    if len(steps) == 1 and not isinstance(steps[0], int):
+        key = steps[0]
+
+        def get(doc):
+            try:
+                return doc.get(key)
+            except AttributeError:
+                return None
+        return get
+
+    def get(doc):
+        value = doc
+        for step in steps:
+            try:
+                value = value[step]
+            except (KeyError, IndexError, TypeError):
+                return None
+        return value
+
+    return get
+
+
+def _csv_value(value):
+    if value is None:
+        return CSV_NULL
+    if value is True or value is False:
+        return 'true' if value else 'false'
+    if isinstance(value, (dict, list)):
+        # Loaded as JSON text, as COPY does with JSON input
+        return json.dumps(value)
+    return value
+
+
+class Projection(object):
+    """
+    Extract the values selected by *jsonpaths* from documents.
+
+    Projections pickle as their jsonpaths and recompile their extractors
+    when unpickled, so they can be sent to worker processes.
+
+    Parameters
+    ----------
+    jsonpaths : dict or list of str
+        Redshift jsonpaths, as a ``{"jsonpaths": [...]}`` dict or a list
+    output : str
+        'json' for JSON arrays or 'csv' for CSV rows
+
+    >>> projection = Projection(["$['b']", "$['a']['c']"])
+    >>> print(projection.serialize([{'a': {'c': 1}, 'b': 'x', 'd': 0}]))
+    ["x", 1]
+    <BLANKLINE>
+    >>> projection.copy_jsonpaths()
+    {'jsonpaths': ['$[0]', '$[1]']}
+    """
+
+    def __init__(self, jsonpaths, output='json'):
+        if output not in OUTPUTS:
+            raise ValueError("output must be one of {}".format(
+                ', '.join(OUTPUTS)))
+        if isinstance(jsonpaths, dict):
+            jsonpaths = jsonpaths['jsonpaths']
+        self.jsonpaths = list(jsonpaths)
+        self.output = output
+        self._compile()
+
+    def _compile(self):
+        self._getters = [compile_steps(parse_jsonpath(path))
+                         for path in self.jsonpaths]
+
+    def __getstate__(self):
+        return {'jsonpaths': self.jsonpaths, 'output': self.output}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile()
+
+    def values(self, doc):
+        """Return the values of *doc* selected by the jsonpaths."""
+        return [get(doc) for get in self._getters]
+
+    def lines(self, docs):
+        """Return a list with one newline-terminated str per document."""
+        if self.output == 'json':
+            return ["{}\n".format(json.dumps(self.values(doc)))
+                    for doc in docs]
+        buf = StringIO() if CSV_WRITES_TEXT else BytesIO()
+        writer = csv.writer(buf, lineterminator='\n')
+        lines = []
+        for doc in docs:
+            row = [_csv_value(v) for v in self.values(doc)]
+            if CSV_WRITES_TEXT:
+                writer.writerow(row)
+                lines.append(buf.getvalue())
+            else:
+                writer.writerow([v.encode('utf-8')
+                                 if isinstance(v, text_type) else v
+                                 for v in row])
+                lines.append(buf.getvalue().decode('utf-8'))
+            buf.seek(0)
+            buf.truncate()
+        return lines
+
+    def serialize(self, docs):
+        """Return *docs* projected to newline-delimited output."""
+        return "".join(self.lines(docs))
+
+    def copy_jsonpaths(self):
+        """
+        Return the jsonpaths with which COPY reads JSON output, or None
+        for CSV.
+        """
+        if self.output != 'json':
+            return None
+        return {'jsonpaths': ['$[{}]'.format(i)
+                              for i in range(len(self.jsonpaths))]}
@@ -7,9 +7,24 @@ COPY {table}
 FROM '{manifest_key}'
 CREDENTIALS '{creds}'
 JSON '{jpaths_key}'
-MANIFEST GZIP TIMEFORMAT 'auto'
+MANIFEST {compression}TIMEFORMAT 'auto'
 """
 
+copy_csv_from_s3 = """\
+COPY {table}
+FROM '{manifest_key}'
+CREDENTIALS '{creds}'
+CSV NULL AS '{null}'
+MANIFEST {compression}TIMEFORMAT 'auto'
+"""
+
+unload_to_s3 = """
+        UNLOAD ($${select}$$)
+        TO '{s3_path}'
+        CREDENTIALS '{creds}'
+        {options};
+        """
+
 all_privileges = """\
 SELECT
   c.relkind,
@@ -28,3 +43,10 @@ WHERE c.relkind IN ('r', 'v', 'm', 'S', 'f')
   AND n.nspname !~ '^pg_' AND pg_catalog.pg_table_is_visible(c.oid)
 ORDER BY c.relkind, n.oid, n.nspname;
 """
+
+copy_from_manifest = """\
+COPY {table}
+FROM '{manifest_key}'
+CREDENTIALS '{creds}'
+MANIFEST {options}
+"""
@@ -6,10 +6,14 @@ and utility functions for managing that database.
 from __future__ import (absolute_import, division, print_function,
                         unicode_literals)
 
+from contextlib import contextmanager
 import os
+from timeit import default_timer
 
-import psycopg2
-
+from shiftmanager.cache import CacheGroup, cached, cluster_caches
+from shiftmanager.catalog import CatalogSnapshot
+from shiftmanager.instrumentation import (ExecutionRecord, changes_schema,
+                                          run_hooks)
 from shiftmanager.mixins import (AdminMixin, ReflectionMixin, PostgresMixin,
                                  S3Mixin)
 from shiftmanager.memoized_property import memoized_property
@@ -44,14 +48,33 @@ class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
         envvar equivalent: AWS_SECURITY_TOKEN or AWS_SESSION_TOKEN
     kwargs : dict
         Additional keyword arguments sent to psycopg2.connect
+
+    Attributes
+    ----------
+    cache_scope : str
+        ``'instance'`` (the default) keeps catalog lookups cached per
+        instance; ``'cluster'`` shares them among instances connected to
+        the same host, port and database as the same user, since lookups
+        depend on the user's search_path and privileges. Set before the
+        first lookup.
+    cache_maxsize : int
+        Maximum entries per cached lookup
+    cache_ttl : float
+        Seconds a cached lookup stays valid; None never expires them
     """
 
+    cache_scope = 'instance'
+    cache_maxsize = 256
+    cache_ttl = 300
+
     @memoized_property
     def connection(self):
         """A `psycopg2.connect` connection to Redshift.
 
         Instantiation is delayed until the object is first used.
         """
+        import psycopg2
+
         print("Connecting to %s..." % self.host)
         return psycopg2.connect(user=self.user,
                                 host=self.host,
@@ -60,6 +83,31 @@ class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
                                 password=self.password,
                                 **self.pgkwargs)
 
+    @memoized_property
+    def caches(self):
+        """The `~shiftmanager.cache.CacheGroup` holding catalog lookups."""
+        if self.cache_scope == 'cluster':
+            return cluster_caches(
+                (self.host, self.port, self.database, self.user),
+                self.cache_maxsize, self.cache_ttl)
+        return CacheGroup(self.cache_maxsize, self.cache_ttl)
+
+    def cache_stats(self):
+        """Return hit, miss and size counters for each cached lookup."""
+        return self.caches.stats()
+
+    def invalidate_caches(self, name=None):
+        """
+        Forget cached catalog lookups.
+
+        Parameters
+        ----------
+        name : str
+            Method whose results to forget, e.g. ``'table_exists'``;
+            defaults to all of them
+        """
+        self.caches.invalidate(name)
+
     def __init__(self, database=None, user=None, password=None, host=None,
                  port=5439,
                  aws_access_key_id=None,
@@ -78,10 +126,58 @@ class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
         self.pgkwargs = kwargs
 
         self._all_privileges = None
+        self.execute_hooks = []
 
         S3Mixin.__init__(self)
 
-    def execute(self, batch, parameters=None):
+    def clone(self):
+        """
+        Return a new `Redshift` for the same cluster and credentials.
+
+        The clone opens its own connections, so it can run statements in
+        another thread, but shares this instance's storage backend and
+        catalog caches. Call `close` on it when done.
+        """
+        clone = type(self)(self.database, self.user, self.password,
+                           self.host, self.port, self.aws_access_key_id,
+                           self.aws_secret_access_key, self.security_token,
+                           **self.pgkwargs)
+        clone.set_aws_role(self.aws_account_id, self.aws_role_name)
+        if self.storage_factory is not None:
+            clone.set_storage_backend(self.storage_factory,
+                                      **self.storage_options)
+        clone._caches = self.caches
+        return clone
+
+    def close(self):
+        """Close any connections this instance has opened."""
+        for attr in ('_connection', '_pg_connection'):
+            conn = self.__dict__.pop(attr, None)
+            if conn is not None:
+                conn.close()
+
+    def add_execute_hook(self, hook):
+        """
+        Register *hook* to observe every batch run through `execute`.
+
+        The hook may define ``before_execute(record)`` and
+        ``after_execute(record)`` methods, each receiving a
+        `~shiftmanager.instrumentation.ExecutionRecord`. While any hooks
+        are registered, the Redshift query id of each batch is fetched
+        with ``pg_last_query_id()``.
+
+        Returns
+        -------
+        The hook, so it can be kept for later inspection
+        """
+        self.execute_hooks.append(hook)
+        return hook
+
+    def remove_execute_hook(self, hook):
+        """Unregister a hook added with `add_execute_hook`."""
+        self.execute_hooks.remove(hook)
+
+    def execute(self, batch, parameters=None, autocommit=False):
         """
         Execute a batch of SQL statements using this instance's connection.
 
@@ -93,10 +189,57 @@ class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
             The batch of SQL statements to execute.
         parameters : list or dict
             Values to bind to the batch, passed to `cursor.execute`
+        autocommit : bool
+            Run *batch* outside a transaction block, as commands like
+            ``ALTER TABLE APPEND`` and ``VACUUM`` require; it should then
+            hold a single statement.
         """
-        with self.connection as conn:
-            with conn.cursor() as cur:
-                cur.execute(batch, parameters)
+        if not self.execute_hooks:
+            with self._session(autocommit) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(batch, parameters)
+            self._invalidate_after(batch)
+            return
+
+        record = ExecutionRecord(batch, parameters)
+        run_hooks(self.execute_hooks, 'before_execute', record)
+        record.start = default_timer()
+        try:
+            with self._session(autocommit) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(batch, parameters)
+                    record.rowcount = getattr(cur, 'rowcount', None)
+                    cur.execute("SELECT pg_last_query_id()")
+                    row = cur.fetchone()
+                    if row is not None:
+                        record.query_id = row[0]
+        except Exception as e:
+            record.error = e
+            raise
+        finally:
+            record.duration = default_timer() - record.start
+            run_hooks(self.execute_hooks, 'after_execute', record)
+        self._invalidate_after(batch)
+
+    @contextmanager
+    def _session(self, autocommit=False):
+        """Yield the connection, in a transaction unless *autocommit*."""
+        conn = self.connection
+        if not autocommit:
+            with conn:
+                yield conn
+            return
+        conn.autocommit = True
+        try:
+            yield conn
+        finally:
+            conn.autocommit = False
+
+    def _invalidate_after(self, batch):
+        # Schema changes can make any cached catalog lookup stale, wherever
+        # they appear in the batch
+        if changes_schema(batch):
+            self.invalidate_caches()
 
     def mogrify(self, batch, parameters=None, execute=False):
         if execute:
@@ -106,25 +249,36 @@ class Redshift(AdminMixin, ReflectionMixin, PostgresMixin, S3Mixin):
                 mogrified = cur.mogrify(batch, parameters)
         return mogrified.decode('utf-8')
 
-    def table_exists(self, table_name):
+    @cached(maxsize=1)
+    def catalog(self):
+        """
+        Return a `~shiftmanager.catalog.CatalogSnapshot` of every relation
+        in the cluster.
+
+        The snapshot is reloaded once it is older than ``cache_ttl``
+        seconds, after DDL runs through `execute`, or after
+        ``invalidate_caches('catalog')``.
+        """
+        return CatalogSnapshot.load(self.connection)
+
+    def table_exists(self, table_name, schema=None):
         """
         Check Redshift for whether a table exists.
 
+        Answered from the `catalog` snapshot, so repeated checks do not
+        query the cluster.
+
         Parameters
         ----------
         table_name : str
-            The name of the table for whose existence we're checking
+            The name of the table for whose existence we're checking,
+            optionally schema-qualified. Unqualified names are resolved
+            against the search path.
+        schema : str
+            Schema to look in, if *table_name* is unqualified
 
         Returns
         -------
         boolean
         """
-        with self.connection as conn:
-            with conn.cursor() as cur:
-                cur.execute("""select count (distinct tablename)
-                               from pg_table_def
-                               where tablename = '{}';""".format(table_name))
-
-                table_count = cur.fetchone()[0]
-
-        return table_count == 1
+        return self.catalog().exists(table_name, schema, kinds='r')
@@ -0,0 +1,251 @@
+"""
+Sort documents by a table's sortkey before staging them for COPY.
+
+Redshift appends COPYed rows to a table's unsorted region, and only
+VACUUM merges them back into sort order. If every staged row already
+sorts after the table's existing rows, and the rows arrive in sortkey
+order, the region stays sorted and no VACUUM is needed.
+
+`sort_documents` orders documents by the values their jsonpaths feed into
+the sortkey columns. Inputs larger than *run_size* are sorted with an
+external merge sort. Sorted runs are written to disk and merged into a
+`SpooledDocuments` file, so only one run is held in memory at a time.
+Runs are merged at most `MERGE_FAN_IN` at a time, in several passes if
+need be, so open files stay bounded too.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+from array import array
+import heapq
+import io
+import json
+import numbers
+import os
+import tempfile
+
+from shiftmanager.projection import compile_steps, parse_jsonpath
+from shiftmanager.util import text_type
+
+# Documents sorted in memory at once
+DEFAULT_RUN_SIZE = 100000
+
+# Run files merged at once, well below common open file limits
+MERGE_FAN_IN = 64
+
+
+def jsonpath_getter(path):
+    """
+    Return a function reading the value at a Redshift jsonpath from a
+    document, or None where the path is missing.
+
+    >>> get = jsonpath_getter("$['user']['tags'][1]")
+    >>> get({'user': {'tags': ['a', 'b']}})
+    'b'
+    >>> get({'user': {}}) is None
+    True
+    >>> jsonpath_getter('$.user.id')({'user': {'id': 7}})
+    7
+    """
+    return compile_steps(parse_jsonpath(path))
+
+
+def _sort_value(value):
+    # Rank types so mixed values compare; nulls sort last, as in Redshift
+    if value is None:
+        return (3, 0)
+    if isinstance(value, numbers.Number):
+        return (0, value)
+    if isinstance(value, (str, text_type)):
+        return (1, value)
+    return (2, json.dumps(value, sort_keys=True))
+
+
+def sortkey_columns(table):
+    """
+    Return the compound sortkey columns of a reflected
+    :class:`~sqlalchemy.schema.Table`.
+    """
+    options = table.dialect_options['redshift']
+    if options.get('interleaved_sortkey'):
+        raise ValueError("{} has an interleaved sortkey; loads can't keep "
+                         "it sorted".format(table.name))
+    sortkey = options.get('sortkey')
+    if sortkey is None:
+        sortkey = [col.name for col in table.columns
+                   if col.info.get('sortkey')]
+    elif not isinstance(sortkey, (list, tuple)):
+        sortkey = [sortkey]
+    sortkey = [getattr(col, 'name', col) for col in sortkey]
+    if not sortkey:
+        raise ValueError("{} has no sortkey to presort by".format(
+            table.name))
+    return sortkey
+
+
+def sortkey_function(table, jsonpaths):
+    """
+    Return a function giving the sort order of a document loaded into
+    *table* with *jsonpaths*, which COPY maps to columns by position.
+    """
+    paths = jsonpaths['jsonpaths']
+    columns = [col.name for col in table.columns]
+    if len(paths) != len(columns):
+        raise ValueError("{} jsonpaths given for the {} columns of {}"
+                         .format(len(paths), len(columns), table.name))
+    getters = [jsonpath_getter(paths[columns.index(column)])
+               for column in sortkey_columns(table)]
+
+    def key(doc):
+        return tuple(_sort_value(get(doc)) for get in getters)
+
+    return key
+
+
+class SpooledDocuments(object):
+    """
+    A read-only sequence of documents stored as JSON lines in a file.
+
+    Line offsets are kept in memory, so slices read only their own lines.
+    The file is removed by `close`.
+    """
+
+    def __init__(self, path, offsets):
+        self.path = path
+        # Each line starts at offsets[i] and ends at offsets[i + 1]
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _read(self, f, i):
+        f.seek(self.offsets[i])
+        return json.loads(
+            f.read(self.offsets[i + 1] - self.offsets[i]).decode('utf-8'))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            with open(self.path, 'rb') as f:
+                if step == 1:
+                    if start >= stop:
+                        return []
+                    f.seek(self.offsets[start])
+                    data = f.read(self.offsets[stop] - self.offsets[start])
+                    return [json.loads(line.decode('utf-8'))
+                            for line in data.split(b'\n')[:-1]]
+                return [self._read(f, i) for i in range(start, stop, step)]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        with open(self.path, 'rb') as f:
+            return self._read(f, index)
+
+    def __iter__(self):
+        with io.open(self.path, encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def close(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _write_lines(lines, directory):
+    fd, path = tempfile.mkstemp(suffix='.run', dir=directory)
+    with io.open(fd, 'w', encoding='utf-8') as f:
+        for line in lines:
+            f.write(line)
+    return path
+
+
+def _write_run(docs, directory):
+    return _write_lines((u'{}\n'.format(json.dumps(doc)) for doc in docs),
+                        directory)
+
+
+def _read_run(path, key, run):
+    with io.open(path, encoding='utf-8') as f:
+        for position, line in enumerate(f):
+            # Ties keep their input order, as in an in-memory sort
+            yield key(json.loads(line)), run, position, line
+
+
+def _merge_runs(paths, key):
+    """Yield the lines of the sorted run files *paths* in merged order."""
+    merged = heapq.merge(*[_read_run(path, key, i)
+                           for i, path in enumerate(paths)])
+    for _, _, _, line in merged:
+        yield line
+
+
+def sort_documents(docs, key, run_size=DEFAULT_RUN_SIZE, directory=None,
+                   fan_in=MERGE_FAN_IN):
+    """
+    Return *docs* sorted by *key*, holding at most *run_size* documents
+    in memory.
+
+    Parameters
+    ----------
+    docs : iterable of dicts
+        Documents to sort; read once
+    key : callable
+        Sort key of a document
+    run_size : int
+        Documents sorted in memory at once
+    directory : str
+        Where sorted runs and the merged output are written; defaults to
+        the system temporary directory
+    fan_in : int
+        Runs merged at once; more runs are merged in several passes
+
+    Returns
+    -------
+    A list when *docs* fit in a single run, otherwise a
+    `SpooledDocuments`, which the caller should close
+    """
+    runs = []
+    iterator = iter(docs)
+    try:
+        while True:
+            run = []
+            for doc in iterator:
+                run.append(doc)
+                if len(run) >= run_size:
+                    break
+            run.sort(key=key)
+            if not runs and len(run) < run_size:
+                return run
+            if run:
+                runs.append(_write_run(run, directory))
+            if len(run) < run_size:
+                break
+        while len(runs) > fan_in:
+            print("Merging {} sorted runs {} at a time...".format(
+                len(runs), fan_in))
+            groups = [runs[i:i + fan_in] for i in range(0, len(runs), fan_in)]
+            for group in groups:
+                # Consecutive groups keep ties in input order
+                runs.append(_write_lines(_merge_runs(group, key), directory))
+                for run_path in group:
+                    os.remove(run_path)
+                    runs.remove(run_path)
+        print("Merging {} sorted runs...".format(len(runs)))
+        fd, path = tempfile.mkstemp(suffix='.json', dir=directory)
+        offsets = array('q', [0])
+        with io.open(fd, 'wb') as out:
+            for line in _merge_runs(runs, key):
+                encoded = line.encode('utf-8')
+                out.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+        return SpooledDocuments(path, offsets)
+    finally:
+        for run_path in runs:
+            os.remove(run_path)
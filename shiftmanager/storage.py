@@ -0,0 +1,272 @@
+"""
+Object storage backends used to stage files for COPY and read UNLOAD output.
+
+`S3Storage` wraps a boto2 bucket, uploading large files with parallel
+multipart transfers. `LocalStorage` keeps objects as files under a local
+directory, mirroring the S3 key layout, for offline tests and benchmarks.
+"""
+
+from __future__ import (absolute_import, division, print_function,
+                        unicode_literals)
+
+from io import BytesIO
+import os
+import shutil
+
+MB = 1024 * 1024
+
+
+class Storage(object):
+    """
+    Interface for a single bucket of objects.
+
+    Keys are strings like ``path/to/file.gz``; a leading slash is
+    ignored when building URLs. Subclasses implement `put_file`,
+    `put_filename`, `get_file`, `list` and `delete`.
+    """
+
+    name = None
+
+    #: Default number of concurrent transfers
+    max_workers = 8
+
+    def url(self, key):
+        """The ``s3://`` URL of *key*, as used in manifests and COPY."""
+        return "s3://{}/{}".format(self.name, key.lstrip('/'))
+
+    def put_file(self, key, fp, encrypt=False, canned_acl=None):
+        """Write the contents of file object *fp* to *key*."""
+        raise NotImplementedError
+
+    def put_filename(self, key, filename, encrypt=False, canned_acl=None):
+        """Upload the local file *filename* to *key*."""
+        raise NotImplementedError
+
+    def put_string(self, key, data, encrypt=False, canned_acl=None):
+        """Write str or bytes *data* to *key*."""
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        self.put_file(key, BytesIO(data), encrypt, canned_acl)
+
+    def put_filenames(self, items, encrypt=False, canned_acl=None,
+                      max_workers=None):
+        """
+        Upload many files concurrently.
+
+        Parameters
+        ----------
+        items : list of (key, filename) tuples
+        max_workers : int
+            Concurrent transfers; defaults to `max_workers`
+        """
+        items = list(items)
+        workers = min(max_workers or self.max_workers, len(items))
+        if workers <= 1:
+            for key, filename in items:
+                self.put_filename(key, filename, encrypt, canned_acl)
+            return
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(workers)
+        try:
+            pool.map(lambda item: self.put_filename(item[0], item[1],
+                                                    encrypt, canned_acl),
+                     items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def get_file(self, key, fp):
+        """Write the contents of *key* into file object *fp*."""
+        raise NotImplementedError
+
+    def get_string(self, key):
+        """Return the contents of *key* as bytes."""
+        fp = BytesIO()
+        self.get_file(key, fp)
+        return fp.getvalue()
+
+    def get_filename(self, key, filename):
+        """Download *key* to the local file *filename*."""
+        with open(filename, 'wb') as fp:
+            self.get_file(key, fp)
+
+    def get_filenames(self, items, max_workers=None):
+        """Download many (key, filename) pairs concurrently."""
+        from multiprocessing.pool import ThreadPool
+
+        items = list(items)
+        workers = min(max_workers or self.max_workers, len(items)) or 1
+        pool = ThreadPool(workers)
+        try:
+            pool.map(lambda item: self.get_filename(*item), items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def list(self, prefix=''):
+        """Return the keys beginning with *prefix*."""
+        raise NotImplementedError
+
+    def delete(self, keys):
+        """Delete every key in *keys*."""
+        raise NotImplementedError
+
+
+class S3Storage(Storage):
+    """
+    Storage backed by a boto2 S3 bucket.
+
+    Files larger than *multipart_threshold* bytes are sent as multipart
+    uploads with parts transferred in parallel over the bucket's
+    connection pool.
+
+    Parameters
+    ----------
+    bucket : boto.s3.bucket.Bucket
+    max_workers : int
+        Concurrent transfers for multi-file and multipart uploads
+    multipart_threshold : int
+        Size in bytes above which uploads use multipart transfers
+    part_size : int
+        Size in bytes of each multipart part (S3's minimum is 5 MB)
+    """
+
+    def __init__(self, bucket, max_workers=8, multipart_threshold=64 * MB,
+                 part_size=16 * MB):
+        self.bucket = bucket
+        self.name = bucket.name
+        self.max_workers = max_workers
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+
+    def put_file(self, key, fp, encrypt=False, canned_acl=None):
+        boto_key = self.bucket.new_key(key)
+        if encrypt:
+            boto_key.set_contents_from_file(fp, encrypt_key=True)
+        else:
+            boto_key.set_contents_from_file(fp)
+        if canned_acl is not None:
+            boto_key.set_canned_acl(canned_acl)
+        boto_key.close()
+
+    def put_filename(self, key, filename, encrypt=False, canned_acl=None):
+        if os.path.getsize(filename) > self.multipart_threshold:
+            self._put_multipart(key, filename, encrypt, canned_acl)
+        else:
+            with open(filename, 'rb') as fp:
+                self.put_file(key, fp, encrypt, canned_acl)
+
+    def _put_multipart(self, key, filename, encrypt, canned_acl):
+        size = os.path.getsize(filename)
+        offsets = list(range(0, size, self.part_size))
+        upload = self.bucket.initiate_multipart_upload(key,
+                                                       encrypt_key=encrypt)
+
+        def send_part(numbered_offset):
+            part_num, offset = numbered_offset
+            with open(filename, 'rb') as fp:
+                fp.seek(offset)
+                upload.upload_part_from_file(
+                    fp, part_num, size=min(self.part_size, size - offset))
+
+        from multiprocessing.pool import ThreadPool
+
+        pool = ThreadPool(min(self.max_workers, len(offsets)))
+        try:
+            pool.map(send_part, list(enumerate(offsets, 1)))
+            upload.complete_upload()
+        except Exception:
+            upload.cancel_upload()
+            raise
+        finally:
+            pool.close()
+            pool.join()
+        if canned_acl is not None:
+            self.bucket.set_canned_acl(canned_acl, key)
+
+    def get_file(self, key, fp):
+        self.bucket.get_key(key).get_contents_to_file(fp)
+
+    def list(self, prefix=''):
+        return [k.name for k in self.bucket.list(prefix=prefix)]
+
+    def delete(self, keys):
+        self.bucket.delete_keys(list(keys))
+
+
+class LocalStorage(Storage):
+    """
+    Storage keeping objects as files under ``root/name``.
+
+    URLs still use the ``s3://name/key`` form, so manifests and COPY
+    statements built against this backend look exactly as they would for
+    S3; they just can't be loaded by a real cluster.
+
+    Parameters
+    ----------
+    root : str
+        Local directory holding one subdirectory per bucket
+    name : str
+        Bucket name
+    """
+
+    def __init__(self, root, name, max_workers=8):
+        self.root = root
+        self.name = name
+        self.max_workers = max_workers
+
+    @classmethod
+    def factory(cls, root, **kwargs):
+        """Return a callable creating a `LocalStorage` per bucket name."""
+        return lambda bucket_name: cls(root, bucket_name, **kwargs)
+
+    def path(self, key):
+        return os.path.join(self.root, self.name, key.lstrip('/'))
+
+    def _prepare(self, key):
+        path = self.path(key)
+        dirname = os.path.dirname(path)
+        if not os.path.exists(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # Another upload thread may have created it
+                if not os.path.isdir(dirname):
+                    raise
+        return path
+
+    def put_file(self, key, fp, encrypt=False, canned_acl=None):
+        with open(self._prepare(key), 'wb') as out:
+            shutil.copyfileobj(fp, out)
+
+    def put_filename(self, key, filename, encrypt=False, canned_acl=None):
+        shutil.copyfile(filename, self._prepare(key))
+
+    def get_file(self, key, fp):
+        with open(self.path(key), 'rb') as f:
+            shutil.copyfileobj(f, fp)
+
+    def list(self, prefix=''):
+        base = os.path.join(self.root, self.name)
+        keys = []
+        for dirpath, _, filenames in os.walk(base):
+            for filename in filenames:
+                key = os.path.relpath(os.path.join(dirpath, filename), base)
+                key = key.replace(os.sep, '/')
+                if key.startswith(prefix.lstrip('/')):
+                    keys.append(key)
+        return sorted(keys)
+
+    def delete(self, keys):
+        for key in keys:
+            path = self.path(key)
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def as_storage(bucket_or_storage):
+    """Wrap a boto bucket in `S3Storage`; pass `Storage` objects through."""
+    if isinstance(bucket_or_storage, Storage):
+        return bucket_or_storage
+    return S3Storage(bucket_or_storage)
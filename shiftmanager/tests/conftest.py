@@ -37,6 +37,17 @@ def mock_connection():
                 self.cursor_position += 1
                 return next_row
 
+        def fetchall(self, *args, **kwargs):
+            rows = self.return_rows[self.cursor_position:]
+            self.cursor_position = len(self.return_rows)
+            return rows
+
+        def fetchmany(self, size=1, *args, **kwargs):
+            rows = self.return_rows[
+                self.cursor_position:self.cursor_position + size]
+            self.cursor_position += len(rows)
+            return rows
+
         def __enter__(self, *args, **kwargs):
             return self
 
@@ -98,15 +109,15 @@ def mogrify(self, batch, parameters=None, execute=False):
             (key, psycopg2.extensions.adapt(val).getquoted().decode('utf-8'))
             for key, val in parameters.items()])
     elif isinstance(parameters, collections.Sequence):
-        parameters = [
-            psycopg2.extensions.adapt(val).getquoted()
-            for val in parameters]
+        parameters = tuple(
+            psycopg2.extensions.adapt(val).getquoted().decode('utf-8')
+            for val in parameters)
     if parameters:
         return batch % parameters
     return batch
 
 
-def id_cols(self, table_name):
+def id_cols(self, table_name, schema=None):
     if table_name == 'my_identity_table':
         return {'id_col'}
 
@@ -137,9 +148,45 @@ def shift(monkeypatch, mock_connection, mock_s3):
                         aws_secret_access_key="secret_key",
                         security_token="security_token")
     shift.s3_conn = mock_s3
+    # Exercise the COPY path unless a test asks for the INSERT fast path
+    shift.insert_threshold = 0
     return shift
 
 
+@pytest.fixture
+def redshift(monkeypatch, mock_connection):
+    """Redshift on a mock connection, with its queries left unpatched"""
+    import shiftmanager.redshift as rs
+
+    monkeypatch.setattr('shiftmanager.Redshift.connection', mock_connection)
+    return rs.Redshift("", "", "", "")
+
+
+@pytest.fixture
+def reflected(shift, monkeypatch):
+    """
+    Factory making ``shift.reflected_table`` return a table built from a
+    name, columns and `sqlalchemy.Table` keyword arguments. The
+    (schema, name) of each lookup is appended to its ``lookups``.
+    """
+    import sqlalchemy as sa
+
+    lookups = []
+
+    def reflect(name, *columns, **kwargs):
+        table = sa.Table(name, sa.MetaData(), *columns, **kwargs)
+
+        def reflected_table(name, schema=None):
+            lookups.append((schema, name))
+            return table
+
+        monkeypatch.setattr(shift, 'reflected_table', reflected_table)
+        return table
+
+    reflect.lookups = lookups
+    return reflect
+
+
 @pytest.fixture
 def postgres(monkeypatch, mock_connection, request, mock_s3):
     """
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for AsyncRedshift.
+
+Test Runner: PyTest
+"""
+
+import asyncio
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+from shiftmanager.aio import AsyncConnectionPool, AsyncRedshift
+
+
+class FakeAsyncCursor(object):
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, statement, parameters=None):
+        if self.conn.fail_on and self.conn.fail_on in statement:
+            raise psycopg2.ProgrammingError("boom")
+        self.conn.statements.append(statement)
+
+    def mogrify(self, statement, parameters=None):
+        if parameters:
+            statement = statement % dict(
+                (key, psycopg2.extensions.adapt(val).getquoted()
+                 .decode('utf-8'))
+                for key, val in parameters.items())
+        return statement.encode('utf-8')
+
+    def fetchall(self):
+        return self.conn.rows
+
+    def close(self):
+        pass
+
+
+class FakeAsyncConnection(object):
+
+    def __init__(self):
+        self.statements = []
+        self.rows = []
+        self.closed = False
+        self.fail_on = None
+
+    def poll(self):
+        return psycopg2.extensions.POLL_OK
+
+    def isexecuting(self):
+        return False
+
+    def cursor(self):
+        return FakeAsyncCursor(self)
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def ashift(monkeypatch):
+    connections = []
+
+    def connect(self):
+        conn = FakeAsyncConnection()
+        connections.append(conn)
+        return conn
+
+    monkeypatch.setattr(AsyncConnectionPool, '_connect', connect)
+    ashift = AsyncRedshift("", "", "", "", pool_size=2)
+    ashift.connections = connections
+    return ashift
+
+
+def run(coro):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+def test_execute_in_transaction(ashift):
+    run(ashift.execute("SELECT 1"))
+    conn, = ashift.connections
+    assert conn.statements == ["BEGIN", "SELECT 1", "COMMIT"]
+
+
+def test_execute_rolls_back(ashift):
+    run(ashift.execute("SELECT 1"))
+    conn, = ashift.connections
+    conn.fail_on = "DROP"
+    with pytest.raises(psycopg2.ProgrammingError):
+        run(ashift.execute("DROP TABLE foo"))
+    assert conn.statements[-2:] == ["BEGIN", "ROLLBACK"]
+
+
+def test_pool_bounds_concurrency(ashift):
+    async def many():
+        await asyncio.gather(*[ashift.execute("SELECT %d" % i)
+                               for i in range(10)])
+    run(many())
+    assert len(ashift.connections) <= 2
+    executed = sum(len(c.statements) for c in ashift.connections)
+    assert executed == 30
+
+
+def test_create_user(ashift):
+    batch = run(ashift.create_user("swiper", "swiperpass",
+                                   groups=['analyticsusers'],
+                                   execute=True))
+    assert batch == ("CREATE USER swiper IN GROUP analyticsusers "
+                     "PASSWORD 'swiperpass'")
+    conn, = ashift.connections
+    assert conn.statements == ["BEGIN", batch, "COMMIT"]
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for the catalog lookup caches.
+
+Test Runner: PyTest
+"""
+
+from shiftmanager.cache import CacheGroup, LRUCache, cached, cluster_caches
+
+
+class FakeTimer(object):
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction_and_counters():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    # 'b' was least recently used
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get('c') == 3
+    stats = cache.stats()
+    assert stats['size'] == 2
+    assert stats['hits'] == 3
+    assert stats['misses'] == 1
+    assert stats['evictions'] == 1
+
+
+def test_ttl_expiry():
+    timer = FakeTimer()
+    cache = LRUCache(ttl=10, timer=timer)
+    cache.set('a', 1)
+    timer.now = 9
+    assert cache.get('a') == 1
+    timer.now = 10
+    assert cache.get('a') is None
+    assert cache.stats()['expirations'] == 1
+    assert len(cache) == 0
+
+
+def test_invalidate():
+    group = CacheGroup()
+    group.get('x').set('a', 1)
+    group.get('y').set('a', 1)
+    group.invalidate('x')
+    assert len(group.get('x')) == 0
+    assert len(group.get('y')) == 1
+    group.invalidate()
+    assert len(group.get('y')) == 0
+
+
+class Lookups(object):
+
+    def __init__(self):
+        self.caches = CacheGroup(maxsize=8)
+        self.calls = 0
+
+    @cached()
+    def exists(self, name, schema=None):
+        self.calls += 1
+        return False
+
+    @cached(maxsize=1)
+    def single(self, value):
+        self.calls += 1
+        return value
+
+
+def test_cached_keeps_falsy_results():
+    lookups = Lookups()
+    assert lookups.exists('foo') is False
+    assert lookups.exists('foo') is False
+    assert lookups.calls == 1
+    lookups.exists('foo', schema='bar')
+    assert lookups.calls == 2
+
+
+def test_cached_per_instance_and_limits():
+    first, second = Lookups(), Lookups()
+    first.exists('foo')
+    second.exists('foo')
+    assert first.calls == second.calls == 1
+
+    first.single(1)
+    first.single(2)
+    first.single(1)
+    assert first.caches.stats()['single']['maxsize'] == 1
+    assert first.calls == 4
+
+    # Unhashable arguments bypass the cache
+    first.single([1])
+    first.single([1])
+    assert first.calls == 6
+
+
+def test_cluster_caches_are_shared():
+    assert cluster_caches(('host', 5439, 'db')) is \
+        cluster_caches(('host', 5439, 'db'))
+    assert cluster_caches(('host', 5439, 'db')) is not \
+        cluster_caches(('other', 5439, 'db'))
+
+
+def test_lookups_cached_until_ddl(redshift, mock_connection):
+    cur = mock_connection.cursor()
+    cur.return_rows = [('EVEN',), ('ALL',)]
+    assert redshift._diststyle('foo') == 'EVEN'
+    assert redshift._diststyle('foo') == 'EVEN'
+    assert len(cur.statements) == 1
+    assert redshift.cache_stats()['_diststyle']['hits'] == 1
+
+    redshift.execute("SELECT 1")
+    assert redshift._diststyle('foo') == 'EVEN'
+
+    redshift.execute("ALTER TABLE foo ALTER DISTSTYLE ALL")
+    assert redshift._diststyle('foo') == 'ALL'
+
+
+def test_cache_scope(monkeypatch, mock_connection):
+    import shiftmanager.redshift as rs
+
+    monkeypatch.setattr('shiftmanager.Redshift.connection', mock_connection)
+    first = rs.Redshift("db", "", "", "host")
+    second = rs.Redshift("db", "", "", "host")
+    assert first.caches is not second.caches
+
+    monkeypatch.setattr('shiftmanager.Redshift.cache_scope', 'cluster')
+    first = rs.Redshift("db", "", "", "host")
+    second = rs.Redshift("db", "", "", "host")
+    assert first.caches is second.caches
+
+    # Search paths and privileges differ between users
+    ann = rs.Redshift("db", "ann", "", "host")
+    bo = rs.Redshift("db", "bo", "", "host")
+    assert ann.caches is not bo.caches
+    assert ann.caches is not first.caches
+    assert ann.caches is rs.Redshift("db", "ann", "", "host").caches
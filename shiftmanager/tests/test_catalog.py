@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for catalog snapshots.
+
+Test Runner: PyTest
+"""
+
+import pytest
+
+from shiftmanager.catalog import CatalogSnapshot, split_name
+
+ROWS = [(1, 'public', 'events', 'r'),
+        (2, 'public', 'events_view', 'v'),
+        (3, 'staging', 'events', 'r'),
+        (4, 'staging', 'loads', 'r'),
+        (5, 'My Schema', 'Mixed', 'r')]
+
+
+def test_split_name():
+    assert split_name('events') == (None, 'events')
+    assert split_name('"My Schema".events') == ('My Schema', 'events')
+    assert split_name('"say ""hi"""') == (None, 'say "hi"')
+    for invalid in ('', 'a.', 'a.b.c', '"a"b'):
+        with pytest.raises(ValueError):
+            split_name(invalid)
+
+
+def test_snapshot_lookup():
+    snapshot = CatalogSnapshot(ROWS, '{public,staging}')
+    assert len(snapshot) == 5
+    assert snapshot.lookup('events').oid == 1
+    assert snapshot.lookup('staging.events').oid == 3
+    assert snapshot.lookup('events', schema='staging').oid == 3
+    # Found through the second schema on the search path
+    assert snapshot.lookup('loads').schema == 'staging'
+    assert snapshot.lookup('"My Schema"."Mixed"').oid == 5
+    assert snapshot.lookup('"My Schema".mixed') is None
+
+    assert snapshot.exists('events_view')
+    assert not snapshot.exists('events_view', kinds='r')
+    assert not snapshot.exists('other.events')
+    assert [r.oid for r in snapshot.relations('staging')] == [3, 4]
+
+
+@pytest.fixture
+def catalog(redshift, mock_connection):
+    cur = mock_connection.cursor()
+    cur.return_rows = [(['public'],)] + ROWS
+    return redshift
+
+
+def test_table_exists_uses_snapshot(catalog, mock_connection):
+    cur = mock_connection.cursor()
+    assert catalog.table_exists('events')
+    assert catalog.table_exists('staging.loads')
+    assert catalog.table_exists('loads', schema='staging')
+    assert not catalog.table_exists('loads')
+    assert not catalog.table_exists('events_view')
+    # One snapshot answers every check
+    assert len(cur.statements) == 2
+    assert 'pg_class' in cur.statements[1]
+
+    catalog.execute("DROP TABLE staging.loads")
+    cur.return_rows = [(['public'],)] + ROWS[:3]
+    cur.cursor_position = 0
+    assert not catalog.table_exists('staging.loads')
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for logical replication change streams.
+
+Test Runner: PyTest
+"""
+
+from collections import namedtuple
+import json
+
+import pytest
+import sqlalchemy as sa
+
+from shiftmanager.cdc import (Change, ChangeBuffer, apply_changes,
+                              parse_wal2json, stream_changes)
+from shiftmanager.storage import LocalStorage
+
+
+def v1_message(*changes):
+    return json.dumps({'change': list(changes)})
+
+
+def v1_insert(table, id, name):
+    return {'kind': 'insert', 'schema': 'public', 'table': table,
+            'columnnames': ['id', 'name'], 'columntypes': ['int', 'text'],
+            'columnvalues': [id, name]}
+
+
+def v1_delete(table, id):
+    return {'kind': 'delete', 'schema': 'public', 'table': table,
+            'oldkeys': {'keynames': ['id'], 'keytypes': ['int'],
+                        'keyvalues': [id]}}
+
+
+def test_parse_wal2json_v1():
+    changes, complete = parse_wal2json(v1_message(
+        v1_insert('users', 1, 'ann'), v1_delete('users', 2)))
+    assert complete
+    assert changes == [
+        Change('public.users', 'insert', {'id': 1, 'name': 'ann'}, None),
+        Change('public.users', 'delete', None, {'id': 2}),
+    ]
+
+
+def test_parse_wal2json_v2():
+    def parse(doc):
+        return parse_wal2json(json.dumps(doc), format_version=2)
+
+    assert parse({'action': 'B'}) == ([], False)
+    changes, complete = parse({
+        'action': 'U', 'schema': 'public', 'table': 'users',
+        'columns': [{'name': 'id', 'type': 'int', 'value': 3},
+                    {'name': 'name', 'type': 'text', 'value': 'bo'}],
+        'identity': [{'name': 'id', 'type': 'int', 'value': 2}]})
+    assert changes == [Change('public.users', 'update',
+                              {'id': 3, 'name': 'bo'}, {'id': 2})]
+    assert not complete
+    assert parse({'action': 'T', 'schema': 'public', 'table': 'users'}) == \
+        ([], False)
+    assert parse({'action': 'C'}) == ([], True)
+
+
+def test_change_buffer_collapses_keys():
+    now = [100]
+    buffer = ChangeBuffer(lambda table: ['id'], timer=lambda: now[0])
+    assert not buffer.ready(max_changes=1)
+    buffer.add(Change('t', 'insert', {'id': 1, 'v': 'a'}, None), 10)
+    buffer.add(Change('t', 'insert', {'id': 2, 'v': 'b'}, None), 10)
+    buffer.add(Change('t', 'update', {'id': 1, 'v': 'c'}, None), 10)
+    # An update moving a row to a new key deletes the old one
+    buffer.add(Change('t', 'update', {'id': 3, 'v': 'b'}, {'id': 2}), 10)
+    buffer.add(Change('t', 'delete', None, {'id': 4}), 10)
+    assert buffer.changes == 5
+    assert buffer.bytes == 50
+    assert buffer.ready(max_bytes=50)
+    assert not buffer.ready(max_changes=6, max_seconds=5)
+    now[0] = 105
+    assert buffer.ready(max_seconds=5)
+
+    batches = buffer.drain()
+    assert batches == {'t': ([{'id': 1, 'v': 'c'}, {'id': 3, 'v': 'b'}],
+                             [(2,), (4,)])}
+    assert buffer.changes == 0
+    assert buffer.age == 0
+
+    with pytest.raises(ValueError):
+        buffer.add(Change('t', 'delete', None, None))
+
+
+@pytest.fixture
+def users(shift, tmpdir, reflected):
+    shift.set_storage_backend(LocalStorage.factory(str(tmpdir)))
+    reflected('users', sa.schema.Column('id', sa.INTEGER),
+              sa.schema.Column('name', sa.VARCHAR(32)), schema='public')
+    return shift, reflected.lookups
+
+
+def test_apply_changes(users):
+    shift, reflected = users
+    report = apply_changes(
+        shift, 'public.users', [{'id': 1, 'name': 'ann'}], [(2,), (4,)],
+        ['id'], 'com.simple.mock', 'cdc/')
+    assert reflected == [('public', 'users')]
+    shift.execute.assert_called_once()
+    create, copy, delete, merge_delete, insert, drop = \
+        shift.execute.call_args[0][0].split(';\n')
+    staging = create.split()[3]
+    assert create == 'CREATE TEMP TABLE {} (LIKE public.users)'.format(
+        staging)
+    assert copy.startswith('COPY {}\n'.format(staging))
+    assert delete == 'DELETE FROM public.users\nWHERE "id" IN (2, 4)'
+    assert merge_delete.startswith('DELETE FROM public.users\nUSING ')
+    assert drop == 'DROP TABLE {}'.format(staging)
+    assert report.records == 3
+    # Staged files are removed
+    assert shift.get_storage('com.simple.mock').list() == []
+
+
+def test_apply_deletes_only(users):
+    shift, reflected = users
+    apply_changes(shift, 'public.users', [], [(1, 'a'), (2, 'b')],
+                  ['id', 'region'], 'com.simple.mock', 'cdc/')
+    assert reflected == []
+    assert shift.execute.call_args[0][0] == (
+        'DELETE FROM public.users\n'
+        'WHERE ("id" = 1 AND "region" = \'a\')\n'
+        '   OR ("id" = 2 AND "region" = \'b\')')
+
+
+Message = namedtuple('Message', ['payload', 'data_start'])
+
+
+class FakeReplicationCursor(object):
+
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.feedback = []
+
+    def start_replication(self, slot_name, decode, options):
+        self.started = (slot_name, options)
+
+    def read_message(self):
+        return self.messages.pop(0) if self.messages else None
+
+    def send_feedback(self, flush_lsn=0):
+        self.feedback.append(flush_lsn)
+
+
+class FakeReplicationConnection(object):
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self._cursor
+
+
+def test_stream_changes(users):
+    shift, reflected = users
+    cur = FakeReplicationCursor([
+        Message(v1_message(v1_insert('users', 1, 'ann')), 10),
+        # Tables that aren't replicated only advance the slot
+        Message(v1_message(v1_insert('other', 1, 'x')), 20),
+        Message(v1_message(v1_insert('users', 2, 'bo'),
+                           v1_delete('users', 1)), 30),
+        Message(v1_message(v1_insert('users', 3, 'cy')), 40),
+    ])
+    reports = []
+    batches = stream_changes(
+        shift, 'my_slot', 'com.simple.mock', 'cdc/',
+        tables={'public.users'}, table_map={'public.users': 'public.people'},
+        merge_keys={'public.users': 'id'}, max_changes=3,
+        report_callback=reports.append, max_batches=1,
+        connection=FakeReplicationConnection(cur))
+    assert batches == 1
+    assert cur.started == ('my_slot', {'format-version': '1'})
+    # The slot is confirmed only after the batch is applied
+    assert cur.feedback == [30]
+    assert [r.table for r in reports] == ['public.people']
+    assert reports[0].records == 2
+    assert reflected == [('public', 'people')]
+    batch = shift.execute.call_args[0][0]
+    assert 'DELETE FROM public.people\nWHERE "id" IN (1)' in batch
+    # The unapplied change is left for the next batch
+    assert len(cur.messages) == 1
+
+
+def test_stream_changes_unqualified_target(users):
+    shift, reflected = users
+    cur = FakeReplicationCursor([
+        Message(v1_message(v1_insert('users', 1, 'ann')), 10)])
+    stream_changes(
+        shift, 'my_slot', 'com.simple.mock', 'cdc/',
+        table_map={'public.users': 'People'},
+        merge_keys={'public.users': 'id'}, max_changes=1, max_batches=1,
+        connection=FakeReplicationConnection(cur))
+    assert reflected == [(None, 'people')]
+    assert cur.feedback == [10]
+
+
+def test_stream_changes_without_age_limit(users, monkeypatch):
+    shift, reflected = users
+    cur = FakeReplicationCursor([
+        Message(v1_message(v1_insert('users', 1, 'ann')), 10)])
+    timeouts = []
+
+    def select(readers, writers, errors, timeout):
+        timeouts.append(timeout)
+        cur.messages.append(Message(v1_message(v1_insert('users', 2, 'bo')),
+                                    20))
+        return [], [], []
+
+    monkeypatch.setattr('shiftmanager.cdc.select.select', select)
+    batches = stream_changes(
+        shift, 'my_slot', 'com.simple.mock', 'cdc/',
+        merge_keys={'public.users': 'id'}, max_changes=2, max_seconds=None,
+        max_batches=1, connection=FakeReplicationConnection(cur))
+    assert batches == 1
+    # Idle polls fall back to the keepalive interval
+    assert timeouts == [10]
+    assert cur.feedback == [0, 20]
+
+
+def test_stream_changes_waits_for_commit(users):
+    shift, reflected = users
+
+    def v2(action, id=None):
+        doc = {'action': action}
+        if id is not None:
+            doc.update(schema='public', table='users', columns=[
+                {'name': 'id', 'type': 'int', 'value': id}])
+        return json.dumps(doc)
+
+    cur = FakeReplicationCursor([
+        Message(v2('B'), 10), Message(v2('I', 1), 11),
+        Message(v2('I', 2), 12), Message(v2('I', 3), 13),
+        Message(v2('C'), 14),
+    ])
+    stream_changes(shift, 'my_slot', 'com.simple.mock', 'cdc/',
+                   merge_keys={'public.users': ['id']}, max_changes=1,
+                   format_version=2, max_batches=1,
+                   connection=FakeReplicationConnection(cur))
+    # A transaction is never split across batches
+    assert cur.feedback == [14]
+    assert shift.execute.call_count == 1
@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for compression codecs.
+
+Test Runner: PyTest
+"""
+
+import json
+
+import pytest
+
+from shiftmanager import compression
+
+SAMPLE = "".join(json.dumps({"id": i, "text": "row {}".format(i % 7)}) + "\n"
+                 for i in range(2000)).encode("utf-8")
+
+
+@pytest.mark.parametrize('name', sorted(compression.CODECS))
+def test_round_trip(name, tmpdir):
+    codec = compression.get_codec(name)
+    if not codec.available():
+        pytest.skip("{} is not installed".format(name))
+    compressed = codec.compress(SAMPLE, level=1)
+    assert codec.decompress(compressed) == SAMPLE
+    path = str(tmpdir.join('chunk' + codec.extension))
+    codec.write(path, SAMPLE)
+    with open(path, 'rb') as f:
+        assert codec.decompress(f.read()) == SAMPLE
+
+
+def test_get_codec():
+    assert compression.get_codec(None).name == 'none'
+    assert compression.get_codec('GZIP').copy_option == 'GZIP'
+    codec = compression.get_codec('lzop')
+    assert compression.get_codec(codec) is codec
+    assert codec.shell_command(1) == 'lzop -q -c -1'
+    assert compression.get_codec('none').shell_command(5) == 'cat'
+    with pytest.raises(ValueError):
+        compression.get_codec('snappy')
+
+
+def test_choose_codec():
+    codecs = ['gzip', 'none']
+    # A fast network isn't worth spending CPU on
+    name, results = compression.choose_codec(SAMPLE, 1e15, codecs=codecs)
+    assert name == 'none'
+    assert sorted(r['codec'] for r in results) == codecs
+    # A slow one is
+    name, results = compression.choose_codec(SAMPLE, 1000, codecs=codecs)
+    assert name == 'gzip'
+    gzip_result = [r for r in results if r['codec'] == 'gzip'][0]
+    assert 0 < gzip_result['ratio'] < 0.5
+
+
+def test_shell_codecs(monkeypatch):
+    zstd = compression.get_codec('zstd')
+    monkeypatch.setattr(zstd, '_module', lambda: object())
+    monkeypatch.setattr(compression, 'which',
+                        lambda command: None if command == 'zstd' else
+                        '/usr/bin/' + command)
+    # The zstandard module compresses in Python, but not in a pipeline
+    assert zstd.available()
+    assert not zstd.shell_available()
+    assert 'zstd' not in compression.shell_codecs()
+    assert 'gzip' in compression.shell_codecs()
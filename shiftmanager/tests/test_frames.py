@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for loading DataFrames and Arrow tables.
+
+Test Runner: PyTest
+"""
+
+import gzip
+import json
+import re
+
+import pytest
+import sqlalchemy as sa
+
+from shiftmanager.frames import map_columns
+from shiftmanager.storage import LocalStorage
+
+
+@pytest.fixture
+def scores(shift, tmpdir, reflected):
+    shift.set_storage_backend(LocalStorage.factory(str(tmpdir)))
+    reflected('scores', sa.schema.Column('id', sa.INTEGER),
+              sa.schema.Column('name', sa.VARCHAR(32)),
+              sa.schema.Column('score', sa.FLOAT))
+    return shift
+
+
+def staged_files(shift, keypath):
+    storage = shift.get_storage('com.simple.local')
+    manifest_key = [k for k in storage.list(keypath)
+                    if k.endswith('.manifest')][0]
+    manifest = json.loads(storage.get_string(manifest_key).decode('utf-8'))
+    return [(entry, storage.path(entry['url'].split('/', 3)[3]))
+            for entry in manifest['entries']]
+
+
+def test_map_columns():
+    assert map_columns(['Name', 'id'], ['id', 'name']) == [
+        ('Name', 'name'), ('id', 'id')]
+    with pytest.raises(ValueError):
+        map_columns(['id', 'junk'], ['id', 'name'])
+    with pytest.raises(ValueError):
+        map_columns(['id', 'ID'], ['id', 'name'])
+    with pytest.raises(ValueError):
+        map_columns(['id', 'key'], ['id', 'name'], {'key': 'id'})
+
+
+def test_copy_frame_csv(scores):
+    pd = pytest.importorskip('pandas')
+    frame = pd.DataFrame({'ID': [1, 2, 3], 'name': ['a', None, 'c,d'],
+                          'points': [1.5, float('nan'), 3.0],
+                          'tmp': ['x', 'y', 'z']},
+                         columns=['ID', 'name', 'points', 'tmp'])
+    report = scores.copy_frame_to_table(
+        'com.simple.local', 'tmp/frames/', frame, 'scores', slices=2,
+        column_map={'points': 'score', 'tmp': None}, clean_up_s3=False)
+
+    lines = []
+    for entry, path in staged_files(scores, 'tmp/frames/'):
+        assert 'meta' not in entry
+        with gzip.open(path, 'rb') as f:
+            lines.extend(f.read().decode('utf-8').splitlines())
+    assert lines == ['1,a,1.5', r'2,\N,\N', '3,"c,d",3.0']
+
+    statement = scores.execute.call_args[0][0]
+    assert statement.startswith('COPY scores ("id", "name", "score")\n')
+    assert "FORMAT AS CSV NULL AS '\\N' GZIP" in statement
+    assert report.records == 3
+    assert report.files == 2
+    assert report.codec == 'gzip'
+
+
+def test_copy_frame_csv_nullable_integers(scores):
+    pd = pytest.importorskip('pandas')
+    pa = pytest.importorskip('pyarrow')
+    # pandas stores integers with nulls as floats
+    frame = pd.DataFrame({'id': [1, None, 3], 'score': [1.0, 2.5, None]},
+                         columns=['id', 'score'])
+    assert frame['id'].dtype.kind == 'f'
+    for data in [frame, pa.table({'id': pa.array([1, None, 3]),
+                                  'score': pa.array([1.0, 2.5, None])})]:
+        scores.copy_frame_to_table(
+            'com.simple.local', 'tmp/frames/', data, 'scores', slices=1,
+            file_format='csv', clean_up_s3=False)
+        (_, path), = staged_files(scores, 'tmp/frames/')
+        with gzip.open(path, 'rb') as f:
+            lines = f.read().decode('utf-8').splitlines()
+        # Float columns keep their decimal part
+        assert lines == ['1,1.0', r'\N,2.5', r'3,\N']
+        scores.get_storage('com.simple.local').delete(
+            scores.get_storage('com.simple.local').list('tmp/frames/'))
+
+
+def test_copy_frame_parquet(scores):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+    batches = [
+        pa.RecordBatch.from_arrays(
+            [pa.array([1.5, None]), pa.array([1, 2]), pa.array(['a', 'b'])],
+            ['score', 'id', 'name']),
+        pa.RecordBatch.from_arrays(
+            [pa.array([3.0]), pa.array([3]), pa.array(['c'])],
+            ['score', 'id', 'name']),
+    ]
+    report = scores.copy_frame_to_table(
+        'com.simple.local', 'tmp/frames/', batches, 'scores', slices=2,
+        mode='merge', merge_keys='id', clean_up_s3=False)
+
+    tables = []
+    for entry, path in staged_files(scores, 'tmp/frames/'):
+        assert entry['meta']['content_length'] > 0
+        tables.append(pq.read_table(path))
+    loaded = pa.concat_tables(tables)
+    # Parquet is COPYed by position, so columns follow the table
+    assert loaded.schema.names == ['id', 'name', 'score']
+    assert loaded.column('id').to_pylist() == [1, 2, 3]
+    assert loaded.column('score').to_pylist() == [1.5, None, 3.0]
+
+    create, copy = scores.execute.call_args[0][0].split(';\n')[:2]
+    staging = create.split()[3]
+    assert copy.startswith('COPY {}\n'.format(staging))
+    assert copy.endswith('FORMAT AS PARQUET')
+    assert report.codec == 'parquet'
+
+    with pytest.raises(ValueError):
+        scores.copy_frame_to_table('com.simple.local', 'tmp/frames/',
+                                   batches, 'scores',
+                                   column_map={'score': None})
+
+
+def test_estimate_result_bytes(shift, mock_connection):
+    cursor = mock_connection.cursor()
+    cursor.return_rows = [
+        ('XN Hash Join DS_DIST_NONE  (cost=0.00..8.00 rows=100 width=12)',),
+        ('  ->  XN Seq Scan on t  (cost=0.00..2.00 rows=200 width=8)',)]
+    assert shift._estimate_result_bytes('SELECT 1') == 1200
+    assert cursor.statements[-1] == 'EXPLAIN SELECT 1'
+
+
+def test_query_to_frame_cursor(shift, mock_connection):
+    pd = pytest.importorskip('pandas')
+    cursor = mock_connection.cursor()
+    cursor.description = [('id',), ('name',)]
+    cursor.return_rows = [(1, 'a'), (2, None), (3, 'c')]
+    frame = shift.query_to_frame('SELECT id, name FROM t WHERE id > %s;',
+                                 parameters=[0], batch_size=2)
+    assert isinstance(frame, pd.DataFrame)
+    assert list(frame.columns) == ['id', 'name']
+    assert frame['id'].tolist() == [1, 2, 3]
+    assert frame['name'].isna().tolist() == [False, True, False]
+    assert frame['name'][2] == 'c'
+    assert cursor.statements == ['SELECT id, name FROM t WHERE id > 0']
+    # Without a bucket nothing is estimated or unloaded
+    assert not shift.execute.called
+
+    with pytest.raises(ValueError):
+        shift.query_to_frame('SELECT 1', output='csv')
+
+
+def test_query_to_frame_unload(shift, mock_connection, tmpdir, monkeypatch):
+    pa = pytest.importorskip('pyarrow')
+    pq = pytest.importorskip('pyarrow.parquet')
+    shift.set_storage_backend(LocalStorage.factory(str(tmpdir.join('s3'))))
+    estimates = [10 ** 9]
+    monkeypatch.setattr(shift, '_estimate_result_bytes',
+                        lambda sql: estimates[0])
+
+    def unload(statement):
+        match = re.search(r"TO 's3://([^/]+)/([^']+)'", statement)
+        storage = LocalStorage(str(tmpdir.join('s3')), match.group(1))
+        for i, ids in enumerate([[1, 2], [3]]):
+            path = str(tmpdir.join('part'))
+            pq.write_table(pa.table({'id': ids}), path)
+            storage.put_filename(
+                '{}000{}_part_00.parquet'.format(match.group(2), i), path)
+        storage.put_string(match.group(2) + 'manifest', '{}')
+
+    shift.execute.side_effect = unload
+    local = tmpdir.join('local')
+    table = shift.query_to_frame('SELECT id FROM t', 'com.simple.local',
+                                 output='arrow', local_path=str(local))
+    assert table.column('id').to_pylist() == [1, 2, 3]
+    statement = shift.execute.call_args[0][0]
+    assert 'UNLOAD ($$SELECT id FROM t$$)' in statement
+    assert 'FORMAT AS PARQUET' in statement
+    # UNLOADed and downloaded files are removed
+    assert shift.get_storage('com.simple.local').list() == []
+    assert local.listdir() == []
+
+    # Small results are fetched through a cursor
+    estimates[0] = 100
+    shift.execute.reset_mock()
+    cursor = mock_connection.cursor()
+    cursor.description = [('id',)]
+    cursor.return_rows = [(1,)]
+    table = shift.query_to_frame('SELECT id FROM t', 'com.simple.local',
+                                 output='arrow')
+    assert table.column('id').to_pylist() == [1]
+    assert not shift.execute.called
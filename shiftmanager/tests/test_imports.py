@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests that importing shiftmanager stays lightweight.
+
+Test Runner: PyTest
+"""
+
+import subprocess
+import sys
+
+# Median milliseconds 'import shiftmanager' may take in a fresh interpreter
+IMPORT_BUDGET_MS = 100
+
+
+def test_heavy_dependencies_load_lazily():
+    code = ("import sys\n"
+            "import shiftmanager\n"
+            "from shiftmanager import Redshift\n"
+            "from shiftmanager.privileges import grants_from_privileges\n"
+            "Redshift.random_password()\n"
+            "heavy = ('boto', 'sqlalchemy', 'psycopg2', 'multiprocessing',\n"
+            "         'shiftmanager.frames', 'shiftmanager.compression')\n"
+            "print(','.join(m for m in heavy if m in sys.modules))\n")
+    output = subprocess.check_output([sys.executable, '-c', code])
+    assert output.decode('utf-8').strip() == ''
+
+
+def test_import_time_budget():
+    code = ("from timeit import default_timer\n"
+            "start = default_timer()\n"
+            "import shiftmanager\n"
+            "print(default_timer() - start)\n")
+    timings = sorted(
+        float(subprocess.check_output([sys.executable, '-c', code]))
+        for _ in range(5))
+    assert timings[2] * 1000 < IMPORT_BUDGET_MS
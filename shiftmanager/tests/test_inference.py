@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for jsonpaths inference.
+
+Test Runner: PyTest
+"""
+
+import json
+
+import pytest
+
+from shiftmanager import inference
+from shiftmanager import util
+
+
+def cleaned(statement):
+    text = str(statement)
+    stripped_lines = [line.strip() for line in text.split('\n')]
+    joined = '\n'.join([line for line in stripped_lines if line])
+    return joined
+
+
+def test_union_of_fields():
+    docs = [{"one": 1}, {"two": {"three": "x"}}, {"one": None, "four": [1]}]
+    inferred = inference.infer_jsonpaths(docs)
+    assert inferred.documents == 3
+    assert inferred.jsonpaths() == {"jsonpaths": [
+        "$['four'][0]", "$['one']", "$['two']['three']"]}
+
+    stats = inferred.stats()
+    assert stats["$['one']"]['count'] == 2
+    assert stats["$['one']"]['nulls'] == 1
+    assert stats["$['one']"]['types'] == {'integer': 1, 'null': 1}
+    assert stats["$['one']"]['type'] == 'integer'
+    assert stats["$['two']['three']"]['frequency'] == 1 / 3.0
+    assert inferred.jsonpaths(min_frequency=0.5) == {"jsonpaths": ["$['one']"]}
+
+
+def test_matches_recur_dict():
+    doc = {"one": 1, "two": {"three": {"four": 4}, "five": [1, 2, 3]}}
+    for list_idx in (None, 0, 2):
+        inferred = inference.infer_jsonpaths([json.dumps(doc)],
+                                             list_idx=list_idx)
+        expected = util.recur_dict(set(), doc, list_idx=list_idx)
+        assert set(inferred.jsonpaths()["jsonpaths"]) == expected
+
+
+def test_list_index_element_types():
+    docs = [{"a": [1, "x"]}, {"a": [2]}, {"a": [3, None]}]
+    stats = inference.infer_jsonpaths(docs, list_idx=1).stats()
+    assert stats["$['a'][1]"]['types'] == {'string': 1, 'null': 2}
+    assert stats["$['a'][1]"]['type'] == 'string'
+
+
+def test_reservoir_sample_bounded():
+    def stream():
+        for i in range(10000):
+            yield {"id": i, "rare" if i % 10 == 0 else "common": True}
+
+    sample = inference.reservoir_sample(stream(), 100, seed=1)
+    assert len(sample) == 100
+    ids = [doc["id"] for doc in sample]
+    assert len(set(ids)) == 100
+    # A uniform sample reaches well past the head of the stream
+    assert max(ids) > 5000
+
+    inferred = inference.infer_jsonpaths(stream(), sample_size=100, seed=1)
+    assert inferred.documents == 100
+    assert set(inferred.jsonpaths()["jsonpaths"]) == {
+        "$['common']", "$['id']", "$['rare']"}
+
+
+@pytest.fixture
+def events():
+    return [{"id": i,
+             "user": {"name": "user{}".format(i % 5), "age": i % 90},
+             "created_at": "2018-01-01T00:00:{:02d}".format(i % 60),
+             "day": "2018-02-03",
+             "amount": i * 1.5,
+             "flag": i % 2 == 0,
+             "big": 2 ** 40 + i,
+             "note": None}
+            for i in range(500)]
+
+
+def test_column_profile_types():
+    def redshift_type(*values):
+        profile = inference.ColumnProfile()
+        for value in values:
+            profile.add(value)
+        return profile.redshift_type()
+
+    assert redshift_type(1, -32767) == 'smallint'
+    assert redshift_type(1, 32768) == 'integer'
+    assert redshift_type(2 ** 40, None) == 'bigint'
+    assert redshift_type(2 ** 64) == 'decimal(38,0)'
+    assert redshift_type(1, 2.5) == 'double precision'
+    assert redshift_type(True, None) == 'boolean'
+    assert redshift_type("2018-01-01") == 'date'
+    assert redshift_type("2018-01-01", "2018-01-01 10:00:00") == 'timestamp'
+    assert redshift_type("2018-01-01T10:00:00.123+02:00") == 'timestamptz'
+    # Lengths are UTF-8 bytes with headroom, rounded to a power of two
+    assert redshift_type("abc", u"été") == 'varchar(8)'
+    assert redshift_type("a" * 50000) == 'varchar(65535)'
+    assert redshift_type(1, "abc") == 'varchar(8)'
+    assert redshift_type(None) == 'varchar(256)'
+
+
+def test_infer_table(shift, events):
+    table = shift.inferred_table("events", events, schema="public")
+    assert table.info['jsonpaths'] == inference.infer_jsonpaths(
+        events).jsonpaths()
+    assert [c.name for c in table.columns] == [
+        'amount', 'big', 'created_at', 'day', 'flag', 'id', 'note',
+        'user_age', 'user_name']
+    assert table.columns['user_name'].info['jsonpath'] == \
+        "$['user']['name']"
+
+    ddl = cleaned(shift.table_definition(table, copy_privileges=False))
+    assert ddl == cleaned("""
+    CREATE TABLE public.events (
+    amount DOUBLE PRECISION ENCODE zstd,
+    big BIGINT ENCODE az64,
+    created_at TIMESTAMP WITHOUT TIME ZONE ENCODE raw,
+    day DATE ENCODE az64,
+    flag BOOLEAN ENCODE raw,
+    id SMALLINT ENCODE az64,
+    note VARCHAR(256) ENCODE zstd,
+    user_age SMALLINT ENCODE az64,
+    user_name VARCHAR(8) ENCODE bytedict
+    ) DISTSTYLE KEY DISTKEY (id) SORTKEY (created_at)
+    """)
+
+
+def test_infer_table_overrides(events):
+    table = inference.infer_table("events", events, distkey=False,
+                                  sortkey='day', sample_size=50, seed=0)
+    options = table.dialect_options['redshift']
+    assert options['diststyle'] == 'EVEN'
+    assert options['distkey'] is None
+    assert options['sortkey'] == 'day'
+    assert table.columns['day'].info['encode'] == 'raw'
+    assert table.info['documents'] == 50
+
+    with pytest.raises(ValueError):
+        inference.infer_table("events", events, distkey='missing')
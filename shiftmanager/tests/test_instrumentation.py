@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for execute hooks and instrumentation.
+
+Test Runner: PyTest
+"""
+
+from io import StringIO
+
+from mock import MagicMock
+import pytest
+
+from shiftmanager import instrumentation
+
+
+@pytest.fixture
+def hooked(redshift, mock_connection):
+    cur = mock_connection.cursor()
+    cur.return_rows = [(4242,)]
+    return redshift
+
+
+class RecordingHook(object):
+
+    def __init__(self):
+        self.before = []
+        self.after = []
+
+    def before_execute(self, record):
+        self.before.append(record)
+
+    def after_execute(self, record):
+        self.after.append(record)
+
+
+def test_hooks_receive_records(hooked):
+    hook = hooked.add_execute_hook(RecordingHook())
+    hooked.execute("COPY foo FROM 's3://bar'")
+    assert len(hook.before) == 1
+    record, = hook.after
+    assert record.operation == 'COPY'
+    assert record.query_id == 4242
+    assert record.duration >= 0
+    assert record.error is None
+
+    hooked.remove_execute_hook(hook)
+    hooked.execute("SELECT 1")
+    assert len(hook.after) == 1
+
+
+def test_hooks_see_errors(hooked, mock_connection):
+    hook = hooked.add_execute_hook(RecordingHook())
+    # Let exceptions propagate out of the connection context
+    mock_connection.__exit__ = MagicMock(return_value=False)
+    cur = mock_connection.cursor()
+
+    def fail(*args, **kwargs):
+        raise ValueError("bad statement")
+    cur.execute = fail
+    with pytest.raises(ValueError):
+        hooked.execute("DROP TABLE foo")
+    record, = hook.after
+    assert isinstance(record.error, ValueError)
+    assert record.operation == 'DDL'
+
+
+def test_metrics_collector():
+    metrics = instrumentation.MetricsCollector(buckets=(1, 10))
+    for duration in (0.5, 2, 20):
+        record = instrumentation.ExecutionRecord("UNLOAD ('select 1')")
+        record.duration = duration
+        record.rowcount = 3
+        metrics.after_execute(record)
+    snapshot = metrics.snapshot()
+    assert snapshot['counters']['UNLOAD'] == {
+        'statements': 3, 'errors': 0, 'rows': 9}
+    assert snapshot['histograms']['UNLOAD']['buckets'] == [
+        (1, 1), (10, 2), (float('inf'), 3)]
+
+
+def test_slow_statement_log():
+    stream = StringIO()
+    log = instrumentation.SlowStatementLog(threshold=1, stream=stream)
+    record = instrumentation.ExecutionRecord("CREATE TABLE foo (a int)")
+    record.duration = 0.5
+    log.after_execute(record)
+    assert stream.getvalue() == ''
+    record.duration = 5
+    record.query_id = 12
+    log.after_execute(record)
+    assert stream.getvalue().startswith("Slow DDL (5.000s, query_id=12")
+
+
+def test_execute_autocommit(hooked, mock_connection):
+    states = []
+    cur = mock_connection.cursor()
+    cur.execute = lambda *args: states.append(mock_connection.autocommit)
+    hooked.execute("VACUUM foo", autocommit=True)
+    assert states == [True]
+    assert mock_connection.autocommit is False
+
+
+def test_execute_invalidates_after_any_ddl(hooked, monkeypatch):
+    calls = []
+    monkeypatch.setattr(hooked, 'invalidate_caches',
+                        lambda name=None: calls.append(name))
+    hooked.execute("CREATE SCHEMA IF NOT EXISTS s;\n"
+                   "CREATE TABLE s.t (id INT);\n"
+                   "COPY s.t FROM 's3://bar' MANIFEST")
+    assert calls == [None]
+    hooked.execute("DELETE FROM s.t;\nCOPY s.t FROM 's3://bar'")
+    assert calls == [None]
+
+    hooked.add_execute_hook(RecordingHook())
+    hooked.execute("SELECT 1;\nDROP TABLE s.t")
+    assert calls == [None, None]
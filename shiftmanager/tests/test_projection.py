@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for projecting documents to jsonpaths.
+
+Test Runner: PyTest
+"""
+
+import json
+import pickle
+
+import pytest
+
+from shiftmanager.projection import Projection, parse_jsonpath
+
+DOCS = [
+    {'id': 1, 'user': {'name': 'ann, "a"', 'tags': ['x', 'y']},
+     'active': True, 'extra': 'skipped'},
+    {'id': 2, 'user': {'tags': []}, 'active': False, 'meta': {'k': 1}},
+]
+JSONPATHS = {'jsonpaths': ["$['id']", "$['user']['name']",
+                           "$['user']['tags'][1]", "$['active']",
+                           "$['meta']"]}
+
+
+def test_parse_jsonpath():
+    assert parse_jsonpath("$['a b'][2]") == ['a b', 2]
+    assert parse_jsonpath('$["a"].b') == ['a', 'b']
+    for path in ("a", "$['a'] x", "$[a]"):
+        with pytest.raises(ValueError):
+            parse_jsonpath(path)
+
+
+def test_json_projection():
+    projection = Projection(JSONPATHS)
+    lines = projection.lines(DOCS)
+    assert [json.loads(line) for line in lines] == [
+        [1, 'ann, "a"', 'y', True, None],
+        [2, None, None, False, {'k': 1}],
+    ]
+    assert projection.copy_jsonpaths() == {
+        'jsonpaths': ['$[0]', '$[1]', '$[2]', '$[3]', '$[4]']}
+
+
+def test_csv_projection():
+    projection = Projection(JSONPATHS, output='csv')
+    assert projection.serialize(DOCS) == (
+        '1,"ann, ""a""",y,true,\\N\n'
+        '2,\\N,\\N,false,"{""k"": 1}"\n')
+    assert projection.copy_jsonpaths() is None
+    with pytest.raises(ValueError):
+        Projection(JSONPATHS, output='avro')
+
+
+def test_csv_projection_non_ascii():
+    projection = Projection(["$['a']"], output='csv')
+    assert projection.lines([{'a': u'caf\xe9'}, {'a': 1}]) == [
+        u'caf\xe9\n', u'1\n']
+
+
+def test_projection_pickles():
+    projection = pickle.loads(pickle.dumps(Projection(JSONPATHS, 'csv')))
+    assert projection.output == 'csv'
+    assert projection.values(DOCS[0])[:3] == [1, 'ann, "a"', 'y']
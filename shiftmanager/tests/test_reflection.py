@@ -122,6 +122,41 @@ def test_deduplicate(shift, complex_table):
     assert(cleaned(statement) == cleaned(expected))
 
 
+def test_merge_statement(shift, complex_table):
+    statement = shift.merge_statement(complex_table, 'my_staging',
+                                      ['col1', 'col2'], deduplicate=True,
+                                      deduplicate_order_by="col3 DESC")
+    expected = """
+    DELETE FROM my_complex_table
+    USING my_staging
+    WHERE my_complex_table."col1" = my_staging."col1"
+      AND my_complex_table."col2" = my_staging."col2";
+    INSERT INTO my_complex_table (
+        "col1",
+        "col2",
+        "col3")
+    SELECT
+        "col1",
+        "col2",
+        "col3"
+    FROM (
+        SELECT *, ROW_NUMBER()
+        OVER (PARTITION BY "col1", "col2" ORDER BY col3 DESC)
+        FROM my_staging
+    ) WHERE row_number = 1;
+    DROP TABLE my_staging;
+    """
+    assert(cleaned(statement) == cleaned(expected))
+
+    statement = shift.merge_statement(complex_table, 'my_staging', 'col1',
+                                      drop_staging=False)
+    assert cleaned(statement).endswith('FROM my_staging;')
+    assert 'ROW_NUMBER' not in statement
+
+    with pytest.raises(ValueError):
+        shift.merge_statement(complex_table, 'my_staging', 'nope')
+
+
 def test_identity(shift, identity_table):
     statement = shift.deep_copy(identity_table,
                                 copy_privileges=False, analyze=False)
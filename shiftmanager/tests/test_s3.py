@@ -12,6 +12,7 @@ import os
 
 from mock import ANY
 import pytest
+import sqlalchemy as sa
 
 
 def cleaned(statement):
@@ -240,3 +241,359 @@ def test_unload_table_to_s3(shift):
 
     shift.unload_table_to_s3(bucket, keypath, table)
     assert_execute(shift, expected)
+
+
+def test_copy_json_report(shift, json_data, mock_connection):
+    cur = mock_connection.cursor()
+    cur.return_rows = [(16,)]
+    reports = []
+    report = shift.copy_json_to_table("com.simple.mock",
+                                      "tmp/tests/",
+                                      json_data,
+                                      shift.gen_jsonpaths(json_data[0]),
+                                      "foo_table",
+                                      slices=4,
+                                      report_callback=reports.append)
+    assert reports == [report]
+    assert report.copy_count == 16
+    assert report.records == 16
+    assert report.files == 4
+    assert report.raw_bytes == sum(len(json.dumps(d)) + 1 for d in json_data)
+    assert report.compressed_bytes > 0
+    assert set(report.phases) == {'serialize', 'compress', 'upload',
+                                  'manifest', 'copy', 'cleanup'}
+    assert report.total_seconds > 0
+
+
+def test_copy_json_generates_jsonpaths(shift):
+    data = [{"a": 1}, {"a": 2, "b": {"c": "x"}}, {"d": [1, 2]}]
+    bukkit = shift.s3_conn.get_bucket("com.simple.mock")
+    bukkit.reset()
+    shift.copy_json_to_table("com.simple.mock", "tmp/tests/", data, None,
+                             "foo_table", slices=2)
+    jpaths_key = [v for k, v in bukkit.s3keys.items() if "jsonpaths" in k][0]
+    written = jpaths_key.set_contents_from_file.call_args[0][0].getvalue()
+    assert json.loads(written.decode('utf-8')) == {
+        "jsonpaths": ["$['a']", "$['b']['c']", "$['d'][0]"]}
+
+
+@pytest.mark.parametrize('shared', [True, False])
+def test_chunk_json_slices_processes(shift, json_data, tmpdir, monkeypatch,
+                                     shared):
+    import shiftmanager.mixins.s3 as s3
+    monkeypatch.setattr(s3, '_forks', lambda: shared)
+    dpath = str(tmpdir)
+    for slices in (1, 3, 16):
+        with shift.chunked_json_slices(json_data, slices, dpath,
+                                       processes=4) as (stamp, paths):
+            assert len(paths) == slices
+            chunk_checker(paths)
+        assert os.listdir(dpath) == []
+    assert s3._SHARED_DATA == {}
+
+
+@pytest.mark.parametrize('codec,option', [
+    ('bzip2', "MANIFEST BZIP2 TIMEFORMAT 'auto'"),
+    ('none', "MANIFEST TIMEFORMAT 'auto'"),
+])
+def test_copy_json_codec(shift, json_data, tmpdir, codec, option):
+    bukkit = shift.s3_conn.get_bucket("com.simple.mock")
+    bukkit.reset()
+    dpath = str(tmpdir)
+    report = shift.copy_json_to_table(
+        "com.simple.mock", "tmp/tests/", json_data,
+        shift.gen_jsonpaths(json_data[0]), "foo_table", slices=2,
+        local_path=dpath, clean_up_local=False, codec=codec)
+    assert report.codec == codec
+    chunks = sorted(os.listdir(dpath))
+    assert len(chunks) == 2
+    if codec == 'bzip2':
+        assert all(c.endswith('.bz2') for c in chunks)
+    else:
+        with open(os.path.join(dpath, chunks[0])) as f:
+            assert json.loads(f.readline()) == {"a": 1}
+    statement = cleaned(shift.execute.call_args[0][0])
+    assert statement.split('\n')[-1] == option
+
+
+def test_copy_json_merge(shift, json_data, reflected):
+    reflected("foo_table", sa.schema.Column("a", sa.INTEGER),
+              schema='public')
+    shift.copy_json_to_table(
+        "com.simple.mock", "tmp/tests/", json_data,
+        shift.gen_jsonpaths(json_data[0]), "public.foo_table", slices=2,
+        mode='merge', merge_keys='a', deduplicate=True)
+    # One batch, so the merge is a single transaction
+    shift.execute.assert_called_once_with(ANY)
+    statements = shift.execute.call_args[0][0].split(';\n')
+    create, copy, delete, insert, drop = statements
+    staging = create.split()[3]
+    assert staging.startswith('foo_table$staging_')
+    assert create == 'CREATE TEMP TABLE {} (LIKE public.foo_table)'.format(
+        staging)
+    assert copy.startswith('COPY {}\n'.format(staging))
+    assert delete.startswith('DELETE FROM public.foo_table\nUSING ' +
+                             staging)
+    assert 'PARTITION BY "a"' in insert
+    assert drop == 'DROP TABLE {}'.format(staging)
+
+    with pytest.raises(ValueError):
+        shift.copy_json_to_table(
+            "com.simple.mock", "tmp/tests/", json_data, None,
+            "public.foo_table", mode='merge')
+    with pytest.raises(ValueError):
+        shift.copy_json_to_table(
+            "com.simple.mock", "tmp/tests/", json_data, None,
+            "public.foo_table", mode='upsert')
+
+
+def test_copy_json_staged(shift, json_data, mock_connection):
+    cur = mock_connection.cursor()
+    cur.return_rows = [(len(json_data),), (len(json_data),)]
+    report = shift.copy_json_to_table(
+        "com.simple.mock", "tmp/tests/", json_data,
+        shift.gen_jsonpaths(json_data[0]), "public.foo_table", slices=2,
+        mode='staged')
+    (load,), (append,), (drop,) = [
+        c[0] for c in shift.execute.call_args_list]
+    create, copy = load.split(';\n')
+    staging = create.split()[2]
+    assert staging.startswith('public.foo_table$append_')
+    assert create == 'CREATE TABLE {} (LIKE public.foo_table)'.format(
+        staging)
+    assert copy.startswith('COPY {}\n'.format(staging))
+    assert copy.endswith('COMPUPDATE OFF STATUPDATE OFF')
+    assert append == 'ALTER TABLE public.foo_table APPEND FROM ' + staging
+    assert shift.execute.call_args_list[1][1] == {'autocommit': True}
+    assert drop == 'DROP TABLE IF EXISTS ' + staging
+    assert 'append' in report.phases
+
+
+def test_copy_json_staged_count_mismatch(shift, json_data, mock_connection):
+    cur = mock_connection.cursor()
+    cur.return_rows = [(1,), (1,)]
+    with pytest.raises(ValueError):
+        shift.copy_json_to_table(
+            "com.simple.mock", "tmp/tests/", json_data,
+            shift.gen_jsonpaths(json_data[0]), "foo_table", slices=2,
+            mode='staged')
+    # The target is untouched and the staging table dropped
+    load, drop = [c[0][0] for c in shift.execute.call_args_list]
+    assert 'APPEND' not in load
+    assert drop.startswith('DROP TABLE IF EXISTS foo_table$append_')
+
+
+def test_copy_json_presort(shift, reflected, tmpdir):
+    reflected("foo_table", sa.schema.Column("a", sa.INTEGER),
+              sa.schema.Column("b", sa.INTEGER), redshift_sortkey='b')
+    docs = ({"a": i, "b": (i * 7) % 10} for i in range(10))
+    dpath = str(tmpdir)
+    report = shift.copy_json_to_table(
+        "com.simple.mock", "tmp/tests/", docs,
+        {"jsonpaths": ["$['a']", "$['b']"]}, "foo_table", slices=2,
+        local_path=dpath, clean_up_local=False, codec='none',
+        presort=True, presort_run_size=4)
+    assert 'sort' in report.phases
+    assert report.records == 10
+    lines = []
+    for chunk in sorted(os.listdir(dpath)):
+        with open(os.path.join(dpath, chunk)) as f:
+            lines.extend(json.loads(line)["b"] for line in f)
+    assert lines == list(range(10))
+
+
+@pytest.mark.parametrize('projection', ['json', 'csv'])
+def test_copy_json_projection(shift, tmpdir, projection):
+    data = [{"a": i, "b": {"c": str(i)}, "unused": "x" * 100}
+            for i in range(4)]
+    dpath = str(tmpdir)
+    shift.copy_json_to_table(
+        "com.simple.mock", "tmp/tests/", data,
+        {"jsonpaths": ["$['b']['c']", "$['a']"]}, "foo_table", slices=2,
+        local_path=dpath, clean_up_local=False, codec='none',
+        projection=projection)
+    lines = []
+    for chunk in sorted(os.listdir(dpath)):
+        with open(os.path.join(dpath, chunk)) as f:
+            lines.extend(f.read().splitlines())
+    statement = shift.execute.call_args[0][0]
+    if projection == 'json':
+        assert lines[:2] == ['["0", 0]', '["1", 1]']
+        assert "JSON 's3://com.simple.mock/tmp/tests/" in statement
+    else:
+        assert lines[:2] == ['0,0', '1,1']
+        assert "CSV NULL AS '\\N'" in statement
+        assert 'JSON' not in statement
+
+
+def test_copy_json_validate(shift, reflected, tmpdir):
+    reflected("foo_table", sa.schema.Column("a", sa.INTEGER, nullable=False))
+    data = [{"a": 1}, {"a": "x"}, {"a": 3}]
+    jsonpaths = {"jsonpaths": ["$['a']"]}
+    dpath = str(tmpdir.join('chunks'))
+    reject_path = str(tmpdir.join('rejects.json'))
+
+    # Invalid data fails before anything is uploaded
+    with pytest.raises(ValueError):
+        shift.copy_json_to_table("com.simple.mock", "tmp/tests/", data,
+                                 jsonpaths, "foo_table", slices=2,
+                                 validate=True)
+    assert not shift.execute.called
+
+    report = shift.copy_json_to_table(
+        "com.simple.mock", "tmp/tests/", data, jsonpaths, "foo_table",
+        slices=2, local_path=dpath, clean_up_local=False, codec='none',
+        validate=True, reject_path=reject_path, max_rejects=1)
+    assert report.records == 2
+    assert report.rejects == 1
+    lines = []
+    for chunk in sorted(os.listdir(dpath)):
+        with open(os.path.join(dpath, chunk)) as f:
+            lines.extend(json.loads(line)["a"] for line in f)
+    assert lines == [1, 3]
+    with open(reject_path) as f:
+        reject = json.loads(f.read())
+    assert reject == {"record": {"a": "x"},
+                      "errors": ["a: 'x' is not an integer"]}
+
+
+def test_copy_json_insert_fast_path(shift, mock_s3, reflected):
+    reflected("foo_table", sa.schema.Column("a", sa.INTEGER),
+              sa.schema.Column("b", sa.VARCHAR(64)),
+              sa.schema.Column("d", sa.VARCHAR(64)))
+    bukkit = mock_s3.get_bucket("com.simple.mock")
+    bukkit.reset()
+    data = [{"a": i, "b": {"c": [i]}, "d": None} for i in range(300)]
+    report = shift.copy_json_to_table(
+        "com.simple.mock", "tmp/tests/", data,
+        {"jsonpaths": ["$['a']", "$['b']", "$['d']"]}, "foo_table",
+        insert_threshold=1000)
+    # Nothing is staged in S3
+    assert bukkit.s3keys == {}
+    shift.execute.assert_called_once_with(ANY)
+    first, second = shift.execute.call_args[0][0].split(';\n')
+    assert first.startswith(
+        "INSERT INTO foo_table VALUES\n(0, '{\"c\": [0]}', NULL),\n"
+        "(1, '{\"c\": [1]}', NULL),")
+    assert first.count('\n') == 250
+    assert second.endswith("(299, '{\"c\": [299]}', NULL)")
+    assert report.records == 300
+    assert 'insert' in report.phases
+
+    shift.execute.reset_mock()
+    shift.copy_json_to_table(
+        "com.simple.mock", "tmp/tests/", data,
+        {"jsonpaths": ["$['a']", "$['b']", "$['d']"]}, "foo_table",
+        insert_threshold=300)
+    assert 'COPY foo_table' in shift.execute.call_args[0][0]
+
+
+def test_copy_json_insert_non_iso_timestamps(shift, mock_s3, reflected):
+    reflected("events", sa.schema.Column("id", sa.INTEGER),
+              sa.schema.Column("at", sa.TIMESTAMP))
+    jsonpaths = {"jsonpaths": ["$['id']", "$['at']"]}
+    iso = [{"id": 1, "at": "2017-01-05 10:00:00"}, {"id": 2, "at": None}]
+    shift.copy_json_to_table("com.simple.mock", "tmp/tests/", iso,
+                             jsonpaths, "events", insert_threshold=10)
+    assert shift.execute.call_args[0][0].startswith('INSERT INTO events')
+
+    # Only COPY reads these with TIMEFORMAT 'auto', below the threshold too
+    other = iso + [{"id": 3, "at": "Jan 5 2017 10:00:00"}]
+    for threshold in (10, 0):
+        shift.execute.reset_mock()
+        shift.copy_json_to_table("com.simple.mock", "tmp/tests/", other,
+                                 jsonpaths, "events",
+                                 insert_threshold=threshold)
+        statement = shift.execute.call_args[0][0]
+        assert statement.startswith('COPY events')
+        assert "TIMEFORMAT 'auto'" in statement
+
+
+def test_copy_json_insert_merge(shift, reflected):
+    reflected("foo_table", sa.schema.Column("a", sa.INTEGER))
+    shift.insert_threshold = 10
+    shift.copy_json_to_table("com.simple.mock", "tmp/tests/", [{"a": 1}],
+                             None, "foo_table", mode='merge',
+                             merge_keys='a')
+    create, insert, delete, merge_insert, drop = \
+        shift.execute.call_args[0][0].split(';\n')
+    staging = create.split()[3]
+    assert insert == 'INSERT INTO {} VALUES\n(1)'.format(staging)
+    assert delete.startswith('DELETE FROM foo_table\nUSING ' + staging)
+
+
+def test_copy_json_auto_codec(shift, json_data):
+    shift.upload_bandwidth = 1
+    report = shift.copy_json_to_table(
+        "com.simple.mock", "tmp/tests/", json_data,
+        shift.gen_jsonpaths(json_data[0]), "foo_table", slices=2,
+        codec='auto')
+    assert report.codec not in (None, 'none', 'auto')
+    assert report.codec.upper() in shift.execute.call_args[0][0]
+
+
+def test_chunk_json_slices_balanced_bytes(shift, tmpdir):
+    data = [{"a": i, "text": "x" * (5000 if i % 100 == 0 else 10)}
+            for i in range(400)]
+    dpath = str(tmpdir)
+    with shift.chunked_json_slices(data, 4, dpath, balance='bytes',
+                                   codec='none') as (stamp, paths):
+        sizes = [os.path.getsize(path) for path in paths]
+        lines = []
+        for path in paths:
+            with open(path) as f:
+                lines.extend(json.loads(line)["a"] for line in f)
+    assert lines == list(range(400))
+    assert max(sizes) < 1.5 * min(sizes)
+
+    with shift.chunked_json_slices(data, 4, dpath, balance='bytes',
+                                   target_file_bytes=1000, codec='none',
+                                   processes=2) as (stamp, paths):
+        # Files come in multiples of the slice count
+        assert len(paths) > 4
+        assert len(paths) % 4 == 0
+
+
+def test_chunk_csv_projection_balanced_bytes(shift, tmpdir):
+    from shiftmanager.projection import Projection
+
+    # The first row is 91 characters but 181 bytes of UTF-8
+    data = [{"a": u"\xe9" * 90}] + [{"a": "x" * 60}] * 3
+    with shift.chunked_json_slices(data, 2, str(tmpdir), balance='bytes',
+                                   codec='none',
+                                   projection=Projection(["$['a']"], 'csv')) \
+            as (stamp, paths):
+        counts = []
+        for path in paths:
+            with open(path, 'rb') as f:
+                counts.append(len(f.read().splitlines()))
+    assert counts == [1, 3]
+
+
+def test_copy_json_auto_slices(shift, json_data, mock_connection, tmpdir):
+    mock_connection.cursor().return_rows = [(3,)]
+    dpath = str(tmpdir)
+    shift.copy_json_to_table("com.simple.mock", "tmp/tests/", json_data,
+                             shift.gen_jsonpaths(json_data[0]), "foo_table",
+                             slices='auto', local_path=dpath,
+                             clean_up_local=False)
+    assert shift.get_slice_count() == 3
+    assert "SELECT COUNT(*) FROM stv_slices" in \
+        mock_connection.cursor().statements
+    assert len(os.listdir(dpath)) == 3
+
+
+def test_auto_line_bytes(shift, monkeypatch):
+    from shiftmanager.compression import get_codec
+    mb = 1024 * 1024
+    monkeypatch.setattr(shift, 'get_slice_count', lambda: 4)
+    monkeypatch.setattr(shift, '_pg_estimated_rows', lambda table: 1e7)
+    sample = b"".join(b'{"id": 1, "text": "abc"}\n' for _ in range(10))
+    codec = get_codec('none')
+    shift.target_file_bytes = 32 * mb
+    line_bytes = shift._auto_line_bytes('my_table', sample, codec)
+    # 10M rows of 25 bytes is 250 MB, split into 8 files
+    assert line_bytes == int(250e6 / 8) + 1
+
+    monkeypatch.setattr(shift, '_pg_estimated_rows', lambda table: 10)
+    assert shift._auto_line_bytes('my_table', sample, codec) == mb
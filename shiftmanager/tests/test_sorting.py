@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for sorting documents by a table's sortkey.
+
+Test Runner: PyTest
+"""
+
+import pytest
+import sqlalchemy as sa
+
+from shiftmanager.sorting import (SpooledDocuments, jsonpath_getter,
+                                  sort_documents, sortkey_columns,
+                                  sortkey_function)
+
+
+def events_table(**kwargs):
+    return sa.Table('events', sa.MetaData(),
+                    sa.schema.Column('id', sa.INTEGER),
+                    sa.schema.Column('day', sa.DATE),
+                    sa.schema.Column('user_id', sa.INTEGER),
+                    **kwargs)
+
+
+def test_jsonpath_getter():
+    doc = {'a': {'b c': [1, {'d': 2}]}}
+    assert jsonpath_getter("$['a']['b c'][1]['d']")(doc) == 2
+    assert jsonpath_getter('$["a"]["b c"][0]')(doc) == 1
+    assert jsonpath_getter("$['a']['x']")(doc) is None
+    with pytest.raises(ValueError):
+        jsonpath_getter("$['a'] junk")
+    with pytest.raises(ValueError):
+        jsonpath_getter("a.b")
+
+
+def test_sortkey_columns():
+    table = events_table(redshift_sortkey=('day', 'user_id'))
+    assert sortkey_columns(table) == ['day', 'user_id']
+    assert sortkey_columns(events_table(redshift_sortkey='day')) == ['day']
+    with pytest.raises(ValueError):
+        sortkey_columns(events_table())
+    with pytest.raises(ValueError):
+        sortkey_columns(events_table(redshift_interleaved_sortkey='day'))
+
+
+def test_sortkey_function():
+    table = events_table(redshift_sortkey=('day', 'user_id'))
+    jsonpaths = {'jsonpaths': ["$['id']", "$['when']", "$['user']['id']"]}
+    key = sortkey_function(table, jsonpaths)
+    docs = [
+        {'id': 1, 'when': '2017-01-02', 'user': {'id': 5}},
+        {'id': 2, 'when': None, 'user': {'id': 1}},
+        {'id': 3, 'when': '2017-01-01', 'user': {'id': 9}},
+        {'id': 4, 'when': '2017-01-02', 'user': {'id': 'x'}},
+        {'id': 5, 'when': '2017-01-02', 'user': {}},
+    ]
+    # Numbers before strings, nulls last
+    assert [doc['id'] for doc in sorted(docs, key=key)] == [3, 1, 4, 5, 2]
+    with pytest.raises(ValueError):
+        sortkey_function(table, {'jsonpaths': ["$['id']"]})
+
+
+def test_sort_documents_in_memory():
+    docs = [{'k': 3}, {'k': 1}, {'k': 2}]
+    result = sort_documents(docs, lambda doc: doc['k'], run_size=10)
+    assert result == [{'k': 1}, {'k': 2}, {'k': 3}]
+
+
+def test_sort_documents_merge_passes(tmpdir, monkeypatch):
+    import shiftmanager.sorting as sorting
+
+    merges = []
+    merge_runs = sorting._merge_runs
+
+    def counting_merge_runs(paths, key):
+        merges.append(len(paths))
+        return merge_runs(paths, key)
+
+    monkeypatch.setattr(sorting, '_merge_runs', counting_merge_runs)
+    docs = [{'k': k % 5, 'i': i} for i, k in enumerate(range(40, 0, -1))]
+    with sort_documents(iter(docs), lambda doc: doc['k'], run_size=3,
+                        directory=str(tmpdir), fan_in=4) as result:
+        # 14 runs are merged into 4, then into the output
+        assert merges == [4, 4, 4, 2, 4]
+        assert len(tmpdir.listdir()) == 1
+        # Ties keep their input order across passes
+        assert list(result) == sorted(docs, key=lambda doc: doc['k'])
+
+
+def test_sort_documents_external(tmpdir):
+    docs = ({'k': k % 7, 'i': i} for i, k in enumerate(range(20, 0, -1)))
+    with sort_documents(docs, lambda doc: doc['k'], run_size=3,
+                        directory=str(tmpdir)) as result:
+        assert isinstance(result, SpooledDocuments)
+        # Only the merged output is left on disk
+        assert len(tmpdir.listdir()) == 1
+        expected = sorted(({'k': k % 7, 'i': i}
+                           for i, k in enumerate(range(20, 0, -1))),
+                          key=lambda doc: doc['k'])
+        assert len(result) == 20
+        assert list(result) == expected
+        assert result[5:9] == expected[5:9]
+        assert result[::6] == expected[::6]
+        assert result[-1] == expected[-1]
+        assert result[4:2] == []
+        with pytest.raises(IndexError):
+            result[20]
+    assert tmpdir.listdir() == []
@@ -0,0 +1,136 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for storage backends.
+
+Test Runner: PyTest
+"""
+
+import gzip
+import json
+import os
+
+from mock import MagicMock
+import pytest
+
+from shiftmanager.storage import LocalStorage, S3Storage, as_storage
+
+
+@pytest.fixture
+def local(tmpdir):
+    return LocalStorage(str(tmpdir), 'com.simple.local')
+
+
+def test_local_round_trip(local, tmpdir):
+    local.put_string('/tmp/a.txt', u'caf\xe9')
+    assert local.get_string('tmp/a.txt') == u'caf\xe9'.encode('utf-8')
+    assert local.url('/tmp/a.txt') == 's3://com.simple.local/tmp/a.txt'
+    assert os.path.exists(
+        os.path.join(str(tmpdir), 'com.simple.local', 'tmp', 'a.txt'))
+
+
+def test_local_put_filenames_list_delete(local, tmpdir):
+    items = []
+    for i in range(5):
+        path = tmpdir.join('src_{}'.format(i))
+        path.write('data {}'.format(i))
+        items.append(('tmp/part_{}'.format(i), str(path)))
+    local.put_filenames(items, max_workers=3)
+    assert local.list('tmp/') == ['tmp/part_{}'.format(i) for i in range(5)]
+    assert local.list('other/') == []
+
+    local.delete(['tmp/part_0', 'tmp/missing'])
+    assert 'tmp/part_0' not in local.list()
+    assert local.get_string('tmp/part_3') == b'data 3'
+
+
+def test_s3_put_string(mock_s3):
+    bucket = mock_s3.get_bucket('com.simple.mock')
+    bucket.reset()
+    storage = as_storage(bucket)
+    assert isinstance(storage, S3Storage)
+    assert as_storage(storage) is storage
+
+    storage.put_string('tmp/manifest', '{}', encrypt=True,
+                       canned_acl='bucket-owner-full-control')
+    key = bucket.s3keys['tmp/manifest']
+    args, kwargs = key.set_contents_from_file.call_args
+    assert args[0].getvalue() == b'{}'
+    assert kwargs == {'encrypt_key': True}
+    key.set_canned_acl.assert_called_once_with('bucket-owner-full-control')
+    key.close.assert_called_once_with()
+    assert storage.url('tmp/manifest') == 's3://com.simple.mock/tmp/manifest'
+
+    storage.delete(iter(['tmp/manifest']))
+    assert bucket.recently_deleted_keys == ['tmp/manifest']
+
+
+def test_s3_multipart(tmpdir):
+    path = tmpdir.join('big')
+    path.write_binary(b'x' * 2500)
+    bucket = MagicMock()
+    upload = bucket.initiate_multipart_upload.return_value
+    storage = S3Storage(bucket, multipart_threshold=1000, part_size=1000)
+
+    storage.put_filename('tmp/big', str(path), encrypt=True,
+                         canned_acl='private')
+
+    bucket.initiate_multipart_upload.assert_called_once_with(
+        'tmp/big', encrypt_key=True)
+    sizes = sorted((c[0][1], c[1]['size'])
+                   for c in upload.upload_part_from_file.call_args_list)
+    assert sizes == [(1, 1000), (2, 1000), (3, 500)]
+    upload.complete_upload.assert_called_once_with()
+    bucket.set_canned_acl.assert_called_once_with('private', 'tmp/big')
+    assert not bucket.new_key.called
+
+
+def test_s3_multipart_cancels_on_error(tmpdir):
+    path = tmpdir.join('big')
+    path.write_binary(b'x' * 2500)
+    bucket = MagicMock()
+    upload = bucket.initiate_multipart_upload.return_value
+    upload.upload_part_from_file.side_effect = IOError("connection reset")
+    storage = S3Storage(bucket, multipart_threshold=1000, part_size=1000)
+
+    with pytest.raises(IOError):
+        storage.put_filename('tmp/big', str(path))
+    upload.cancel_upload.assert_called_once_with()
+    assert not upload.complete_upload.called
+
+
+def test_copy_json_to_local_storage(shift, json_data, tmpdir):
+    shift.set_storage_backend(LocalStorage.factory(str(tmpdir)))
+    jsonpaths = shift.gen_jsonpaths(json_data[0])
+    shift.copy_json_to_table("com.simple.local", "tmp/tests/", json_data,
+                             jsonpaths, "foo_table", slices=3,
+                             clean_up_s3=False)
+
+    storage = shift.get_storage("com.simple.local")
+    assert storage is shift.get_storage("com.simple.local")
+    keys = storage.list('tmp/tests/')
+    manifest_key = [k for k in keys if k.endswith('.manifest')][0]
+    manifest = json.loads(storage.get_string(manifest_key).decode('utf-8'))
+    numbers = []
+    for entry in manifest['entries']:
+        assert entry['url'].startswith('s3://com.simple.local/tmp/tests/')
+        path = storage.path(entry['url'].split('/', 3)[3])
+        with gzip.open(path, 'rb') as f:
+            numbers.extend(json.loads(line)['a']
+                           for line in f.read().decode('utf-8').splitlines())
+    assert sorted(numbers) == list(range(1, 17))
+
+    statement = shift.execute.call_args[0][0]
+    assert "FROM '{}'".format(storage.url(manifest_key)) in statement
+
+    shift.copy_json_to_table("com.simple.local", "tmp/again/", json_data,
+                             jsonpaths, "foo_table", slices=3)
+    assert storage.list('tmp/again/') == []
+
+
+def test_get_storage_connects_to_s3(shift, mock_s3):
+    shift.s3_conn = None
+    storage = shift.get_storage("com.simple.mock")
+    assert shift.s3_conn is mock_s3
+    assert isinstance(storage, S3Storage)
+    mock_s3.get_bucket.assert_called_with("com.simple.mock")
@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for cross-cluster table copies.
+
+Test Runner: PyTest
+"""
+
+import re
+
+import pytest
+
+from shiftmanager.storage import LocalStorage
+from shiftmanager.transfer import copy_table_between_clusters
+
+
+@pytest.fixture
+def clusters(shift, tmpdir):
+    import shiftmanager.redshift as rs
+
+    storage_root = str(tmpdir)
+    source = shift
+    target = rs.Redshift("", "", "", "",
+                         aws_access_key_id="target_key",
+                         aws_secret_access_key="target_secret")
+    for cluster in (source, target):
+        cluster.set_storage_backend(LocalStorage.factory(storage_root))
+    source.table_definition = \
+        lambda name, schema=None, copy_privileges=True: (
+            'CREATE TABLE {}.{} (id INT)\n\n;\n'.format(schema, name))
+    target.table_exists = lambda name, schema=None: name == 'existing'
+
+    def execute(batch, parameters=None):
+        # Stand in for UNLOAD, writing a slice file and a manifest
+        match = re.search(r"TO 's3://([^/]+)/([^']+)'", batch)
+        if match:
+            storage = LocalStorage(storage_root, match.group(1))
+            storage.put_string(match.group(2) + '0000_part_00', 'data')
+            storage.put_string(match.group(2) + 'manifest', '{}')
+
+    source.execute.side_effect = execute
+    return source, target
+
+
+def test_copy_table_between_clusters(clusters):
+    source, target = clusters
+    report = copy_table_between_clusters(source, target, 'public.events',
+                                         'com.simple.mock')
+    unload, load = [c[0][0] for c in source.execute.call_args_list]
+    assert 'UNLOAD ($$SELECT * FROM public.events$$)' in unload
+    assert 'MANIFEST VERBOSE ALLOWOVERWRITE FORMAT AS PARQUET' in unload
+    assert "aws_access_key_id=access_key" in unload
+
+    statements = load.split(';\n')
+    assert statements[0] == 'CREATE SCHEMA IF NOT EXISTS public'
+    assert statements[1].startswith('CREATE TABLE public.events')
+    assert "COPY public.events\nFROM 's3://com.simple.mock/" \
+        "shiftmanager/transfers/" in statements[2]
+    assert "/public.events/manifest'" in statements[2]
+    assert "aws_access_key_id=target_key" in statements[2]
+    assert statements[2].endswith(
+        'MANIFEST FORMAT AS PARQUET COMPUPDATE OFF;')
+
+    assert report.table == 'public.events'
+    assert report.files == 1
+    assert set(report.phases) == {'unload', 'copy', 'cleanup'}
+    # Unloaded files are cleaned up
+    assert target.get_storage('com.simple.mock').list() == []
+
+
+def test_copy_tables_in_parallel(clusters, monkeypatch):
+    source, target = clusters
+    identity_lookups = []
+
+    def identity_columns(name, schema=None):
+        identity_lookups.append((schema, name))
+        return {'id_col'} if name == 'my_identity_table' else set()
+
+    monkeypatch.setattr(source, '_get_identity_columns', identity_columns)
+    reports = copy_table_between_clusters(
+        source, target, ['events', 'my_identity_table', 'existing'],
+        'com.simple.mock', schema='staging', file_format='csv',
+        codec='gzip', if_exists='replace', max_workers=2)
+    assert [r.table for r in reports] == [
+        'staging.events', 'staging.my_identity_table', 'staging.existing']
+    # Identity columns are looked up in the table's own schema
+    assert sorted(identity_lookups) == [
+        ('staging', 'events'), ('staging', 'existing'),
+        ('staging', 'my_identity_table')]
+
+    loads = dict((re.search(r'COPY (\S+)', c[0][0]).group(1), c[0][0])
+                 for c in source.execute.call_args_list
+                 if 'UNLOAD' not in c[0][0])
+    assert len(loads) == 3
+    assert 'EXPLICIT_IDS' in loads['staging.my_identity_table']
+    assert "FORMAT AS CSV NULL AS '\\N' GZIP" in loads['staging.events']
+    assert 'DROP TABLE staging.existing;\nCREATE TABLE' in \
+        loads['staging.existing']
+    assert 'DROP TABLE' not in loads['staging.events']
+    assert target.get_storage('com.simple.mock').list() == []
+
+
+def test_copy_table_between_clusters_validation(clusters):
+    source, target = clusters
+    with pytest.raises(ValueError):
+        copy_table_between_clusters(source, target, 'existing',
+                                    'com.simple.mock')
+    with pytest.raises(ValueError):
+        copy_table_between_clusters(source, target, 'events',
+                                    'com.simple.mock', file_format='avro')
+    with pytest.raises(ValueError):
+        copy_table_between_clusters(source, target, 'events',
+                                    'com.simple.mock', file_format='csv',
+                                    codec='lzop')
+    assert not source.execute.called
+
+
+def test_copy_table_between_clusters_uncompressed_csv(clusters):
+    source, target = clusters
+    for codec in ('none', None):
+        source.execute.reset_mock()
+        copy_table_between_clusters(source, target, 'public.events',
+                                    'com.simple.mock', file_format='csv',
+                                    codec=codec)
+        load = source.execute.call_args[0][0]
+        assert load.endswith("FORMAT AS CSV NULL AS '\\N' COMPUPDATE OFF;")
@@ -22,3 +22,20 @@ def test_recur_dict():
 
     test_4 = {"one": [1, 2]}
     assert util.recur_dict(set(), test_4, list_idx=1) == set(["$['one'][1]"])
+
+
+def test_balanced_ranges():
+    sizes = [1000] + [10] * 300 + [500] * 4
+    ranges = util.balanced_ranges(sizes, 4)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == len(sizes)
+    assert all(a[1] == b[0] for a, b in zip(ranges, ranges[1:]))
+    totals = [sum(sizes[start:stop]) for start, stop in ranges]
+    assert max(totals) - min(totals) <= 500
+
+
+def test_file_count():
+    mb = 1024 * 1024
+    assert util.file_count(0, 0.3, 8, 128 * mb) == 8
+    assert util.file_count(8 * 128 * mb, 1, 8, 128 * mb) == 8
+    assert util.file_count(8 * 128 * mb + 1, 1, 8, 128 * mb) == 16
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for client-side validation against a table's columns.
+
+Test Runner: PyTest
+"""
+
+import io
+import json
+import pickle
+
+import pytest
+import sqlalchemy as sa
+
+from shiftmanager.validation import ColumnCheck, Validator, write_rejects
+
+
+@pytest.fixture
+def table():
+    return sa.Table('events', sa.MetaData(),
+                    sa.schema.Column('id', sa.SMALLINT, nullable=False),
+                    sa.schema.Column('name', sa.VARCHAR(4)),
+                    sa.schema.Column('amount', sa.DECIMAL(5, 2)),
+                    sa.schema.Column('score', sa.FLOAT),
+                    sa.schema.Column('active', sa.BOOLEAN),
+                    sa.schema.Column('day', sa.DATE),
+                    sa.schema.Column('at', sa.TIMESTAMP))
+
+
+def check(table, column):
+    return ColumnCheck.from_column(table.columns[column])
+
+
+def test_column_checks(table):
+    ids = check(table, 'id')
+    assert ids(1) is None
+    assert ids('12') is None
+    assert ids(3.0) is None
+    assert ids(None) == 'null in NOT NULL column'
+    assert ids(40000) == '40000 is out of range'
+    assert ids(1.5) == '1.5 is not an integer'
+    assert ids(float('inf')) == 'inf is not an integer'
+
+    name = check(table, 'name')
+    assert name('abcd') is None
+    assert name(None) is None
+    # Lengths are in bytes
+    assert name(u'\xe9\xe9\xe9') == '6 bytes exceeds VARCHAR(4)'
+
+    amount = check(table, 'amount')
+    assert amount(999.99) is None
+    assert amount('-12.5') is None
+    assert amount(1000) == '1000 exceeds DECIMAL(5, 2)'
+    assert amount('x') == "'x' is not a number"
+
+    assert check(table, 'score')('1e10') is None
+    assert check(table, 'score')([]) == '[] is not a number'
+    assert check(table, 'active')('Yes') is None
+    assert check(table, 'active')('maybe') == "'maybe' is not a boolean"
+
+    day, at = check(table, 'day'), check(table, 'at')
+    assert day('2017-02-28') is None
+    assert day('2017-02-30') == "'2017-02-30' is not a valid date"
+    assert day('2017-02-28 10:00') == "'2017-02-28 10:00' is not a date"
+    assert at('2017-02-28T10:00:00.5Z') is None
+    assert at('yesterday') == "'yesterday' is not a timestamp"
+    assert at(20170228) == "20170228 is not a timestamp"
+    assert at('2017-02-30 10:00') == "'2017-02-30 10:00' is not a valid date"
+    # Left to TIMEFORMAT 'auto'
+    assert at('July 11 2015 12:34:56') is None
+    assert at('07/11/2015') is None
+    assert day('07/11/2015') == "'07/11/2015' is not a date"
+
+
+def test_validator(table, tmpdir):
+    jsonpaths = {'jsonpaths': ["$['id']", "$['user']['name']",
+                               "$['amount']", "$['score']", "$['active']",
+                               "$['day']", "$['at']"]}
+    reject_path = str(tmpdir.join('rejects.json'))
+    validator = Validator(table, jsonpaths, reject_path=reject_path)
+    good = {'id': 1, 'user': {'name': 'ann'}, 'at': '2017-01-01'}
+    bad = {'user': {'name': 'annabel'}, 'active': 'maybe'}
+    valid, rejects = validator.split([good, bad])
+    assert valid == [good]
+    errors = ['id: null in NOT NULL column',
+              'name: 7 bytes exceeds VARCHAR(4)',
+              "active: 'maybe' is not a boolean"]
+    assert rejects == [(bad, errors)]
+
+    # Validators are sent to worker processes
+    assert pickle.loads(pickle.dumps(validator)).errors(bad) == errors
+
+    with pytest.raises(ValueError):
+        validator.handle_rejects(rejects)
+    with open(reject_path) as f:
+        assert json.loads(f.readline()) == {'record': bad, 'errors': errors}
+
+    validator.max_rejects = None
+    validator.handle_rejects(rejects)
+
+    with pytest.raises(ValueError):
+        Validator(table, {'jsonpaths': ["$['id']"]})
+
+
+def test_write_rejects(tmpdir):
+    reject_path = str(tmpdir.join('rejects.json'))
+    write_rejects(reject_path, [({'name': u'Zo\xeb'}, ['name: too long'])])
+    write_rejects(reject_path, [({'id': None}, ['id: null'])])
+    with io.open(reject_path, encoding='utf-8') as f:
+        rejects = [json.loads(line) for line in f]
+    assert rejects == [
+        {'record': {'name': u'Zo\xeb'}, 'errors': ['name: too long']},
+        {'record': {'id': None}, 'errors': ['id: null']}]
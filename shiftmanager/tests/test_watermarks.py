@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+Tests for high-watermark incremental loads.
+
+Test Runner: PyTest
+"""
+
+from mock import MagicMock
+import pytest
+
+from shiftmanager.storage import LocalStorage
+from shiftmanager.watermarks import (FileWatermarkStore, MemoryWatermarkStore,
+                                     RedshiftWatermarkStore)
+
+
+def test_file_store(tmpdir):
+    path = str(tmpdir.join('watermarks.json'))
+    store = FileWatermarkStore(path)
+    assert store.get('users') is None
+    store.set('users', 42)
+    store.set('events', '2017-01-01 00:00:00')
+    store = FileWatermarkStore(path)
+    assert store.get('users') == '42'
+    assert store.get('events') == '2017-01-01 00:00:00'
+    assert tmpdir.listdir() == [tmpdir.join('watermarks.json')]
+
+
+def test_redshift_store_statements(shift):
+    store = RedshiftWatermarkStore(shift)
+    other = MagicMock()
+    assert store.statements(other, 'users', 42) == []
+    delete, insert = store.statements(shift, 'users', 42)
+    assert delete.startswith('DELETE FROM shiftmanager_watermarks')
+    assert insert.startswith('INSERT INTO shiftmanager_watermarks')
+    assert 'CREATE TABLE IF NOT EXISTS shiftmanager_watermarks' in \
+        shift.execute.call_args[0][0]
+
+
+class FakeCursor(object):
+
+    def __init__(self, upper):
+        self.upper = upper
+        self.statements = []
+
+    def execute(self, statement, parameters=None):
+        self.statements.append((statement, parameters))
+
+    def fetchone(self):
+        return (self.upper,)
+
+    def mogrify(self, statement, parameters):
+        return (statement % tuple("'%s'" % p for p in parameters)).encode()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+
+def test_pg_watermark_range(shift):
+    cur = FakeCursor(1000)
+    conn = MagicMock()
+    conn.__enter__.return_value.cursor.return_value = cur
+    shift._pg_connection = conn
+
+    select, upper = shift._pg_watermark_range('events', 'id', '10')
+    assert upper == '1000'
+    assert cur.statements[0] == (
+        'SELECT max("id") FROM events AS x WHERE "id" > %s', ('10',))
+    assert select == ("SELECT * FROM events AS x "
+                      "WHERE \"id\" > '10' AND \"id\" <= '1000'")
+
+    select, upper = shift._pg_watermark_range('events', 'id')
+    assert select == "SELECT * FROM events AS x WHERE \"id\" <= '1000'"
+
+    cur.upper = None
+    assert shift._pg_watermark_range('events', 'id', '1000') == (None, None)
+
+    cur.upper = 990
+    select, upper = shift._pg_watermark_range('events', 'id', '10', lag=10)
+    assert upper == '990'
+    assert cur.statements[-1] == (
+        'SELECT max("id") - %s FROM events AS x WHERE "id" > %s '
+        'HAVING max("id") - %s > %s', (10, '10', 10, '10'))
+    assert select == ("SELECT * FROM events AS x "
+                      "WHERE \"id\" > '10' AND \"id\" <= '990'")
+
+
+@pytest.fixture
+def incremental(shift, monkeypatch, tmpdir):
+    shift.set_storage_backend(LocalStorage.factory(str(tmpdir)))
+    monkeypatch.setattr(shift, 'table_exists', lambda name: True)
+    ranges = []
+
+    def watermark_range(source, column, last=None, lag=None):
+        ranges.append((source, column, last, lag))
+        return 'SELECT * FROM events WHERE id > 10', '1000'
+
+    monkeypatch.setattr(shift, '_pg_watermark_range', watermark_range)
+    extracts = []
+
+    def copy_table_to_s3(bucket_name, key_prefix, pg_table_name,
+                         pg_select_statement, *args):
+        extracts.append((pg_table_name, pg_select_statement))
+        return key_prefix, [key_prefix + 'chunk_aa.json.gz']
+
+    monkeypatch.setattr(shift, 'copy_table_to_s3', copy_table_to_s3)
+    return shift, ranges, extracts
+
+
+def test_incremental_load(incremental):
+    shift, ranges, extracts = incremental
+    store = MemoryWatermarkStore({'events': '10'})
+    report = shift.copy_table_to_redshift(
+        'events', 'com.simple.mock', 'tmp/', pg_table_name='events',
+        watermark_column='id', watermark_store=store, watermark_lag=5)
+    assert ranges == [('events', 'id', '10', 5)]
+    assert extracts == [(None, 'SELECT * FROM events WHERE id > 10')]
+    assert report.watermark == '1000'
+    assert store.get('events') == '1000'
+
+
+def test_incremental_load_failure_keeps_watermark(incremental):
+    shift, ranges, extracts = incremental
+    store = MemoryWatermarkStore({'events': '10'})
+    shift.execute.side_effect = RuntimeError('COPY failed')
+    with pytest.raises(RuntimeError):
+        shift.copy_table_to_redshift(
+            'events', 'com.simple.mock', 'tmp/', pg_table_name='events',
+            watermark_column='id', watermark_store=store)
+    assert store.get('events') == '10'
+
+
+def test_incremental_load_nothing_new(incremental, monkeypatch):
+    shift, ranges, extracts = incremental
+    monkeypatch.setattr(shift, '_pg_watermark_range',
+                        lambda *args: (None, None))
+    store = MemoryWatermarkStore({'events': '1000'})
+    report = shift.copy_table_to_redshift(
+        'events', 'com.simple.mock', 'tmp/', pg_table_name='events',
+        watermark_column='id', watermark_store=store)
+    assert report.watermark is None
+    assert extracts == []
+    assert not shift.execute.called
+
+
+def test_incremental_load_same_transaction(incremental, monkeypatch):
+    shift, ranges, extracts = incremental
+    store = RedshiftWatermarkStore(shift)
+    monkeypatch.setattr(store, 'get', lambda key: '10')
+    set_calls = []
+    monkeypatch.setattr(store, 'set', lambda *args: set_calls.append(args))
+    shift.copy_table_to_redshift(
+        'events', 'com.simple.mock', 'tmp/',
+        pg_select_statement='SELECT * FROM events', watermark_key='events',
+        watermark_column='id', watermark_store=store)
+    assert ranges == [('(SELECT * FROM events)', 'id', '10', None)]
+    batch = shift.execute.call_args[0][0]
+    assert batch.index('COPY events') < \
+        batch.index('DELETE FROM shiftmanager_watermarks') < \
+        batch.index('INSERT INTO shiftmanager_watermarks')
+    assert set_calls == []
+
+
+def test_incremental_load_staged(incremental, mock_connection):
+    shift, ranges, extracts = incremental
+    # No watermark yet, then the COPY and staging table row counts
+    mock_connection.cursor().return_rows = [(None,), (0,), (0,)]
+    store = RedshiftWatermarkStore(shift)
+    store._created = True
+    shift.copy_table_to_redshift(
+        'events', 'com.simple.mock', 'tmp/', pg_table_name='events',
+        mode='staged', watermark_column='id', watermark_store=store)
+    batches = [c[0][0] for c in shift.execute.call_args_list]
+    assert 'STATUPDATE OFF' in batches[0]
+    assert 'shiftmanager_watermarks' not in batches[0]
+    assert batches[1].startswith('ALTER TABLE events APPEND FROM events$')
+    assert batches[2].startswith('DROP TABLE IF EXISTS events$append_')
+    # The watermark only advances once the rows are appended
+    assert batches[3].startswith('DELETE FROM shiftmanager_watermarks')
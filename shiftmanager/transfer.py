@@ -0,0 +1,225 @@
+"""
+Copy tables from one cluster to another through S3.
+
+`copy_table_between_clusters` reflects each table's DDL on the source,
+UNLOADs it in parallel from every source slice, then creates the table on
+the target and COPYs straight from the UNLOAD manifest in one
+transaction. Nothing passes through the local machine.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+from multiprocessing.pool import ThreadPool
+import uuid
+
+from shiftmanager import queries
+from shiftmanager.catalog import split_name
+from shiftmanager.compression import get_codec
+from shiftmanager.instrumentation import LoadReport
+
+# UNLOAD and COPY options for each transfer format; UNLOAD must write a
+# verbose manifest for COPY to read Parquet through it
+FORMATS = {
+    'parquet': ('MANIFEST VERBOSE ALLOWOVERWRITE FORMAT AS PARQUET',
+                'FORMAT AS PARQUET'),
+    'csv': (r"MANIFEST ALLOWOVERWRITE FORMAT AS CSV NULL AS '\N' {codec}",
+            r"FORMAT AS CSV NULL AS '\N' {codec}"),
+}
+
+IF_EXISTS = ('fail', 'replace', 'append')
+
+
+def _qualified(schema, name):
+    return name if schema is None else '{}.{}'.format(schema, name)
+
+
+class TableTransfer(object):
+    """
+    The statements moving one table; built on the calling thread so that
+    only UNLOAD and COPY run in worker threads.
+    """
+
+    def __init__(self, schema, name, ddl, exists, identity):
+        self.schema = schema
+        self.name = name
+        self.ddl = ddl
+        self.exists = exists
+        self.identity = identity
+
+    @property
+    def qualified_name(self):
+        return _qualified(self.schema, self.name)
+
+    def unload_statement(self, source, s3_path, file_format, codec):
+        options = FORMATS[file_format][0].format(
+            codec=get_codec(codec).copy_option)
+        return queries.unload_to_s3.format(
+            select='SELECT * FROM {}'.format(self.qualified_name),
+            s3_path=s3_path, creds=source.aws_credentials,
+            options=options.strip())
+
+    def load_batch(self, target, manifest_url, file_format, codec,
+                   if_exists):
+        """Return the target batch creating the table if needed and
+        loading it."""
+        statements = []
+        if self.schema is not None:
+            statements.append(
+                'CREATE SCHEMA IF NOT EXISTS {}'.format(self.schema))
+        if self.exists and if_exists == 'replace':
+            statements.append('DROP TABLE {}'.format(self.qualified_name))
+        if not self.exists or if_exists == 'replace':
+            statements.append(self.ddl)
+        options = FORMATS[file_format][1].format(
+            codec=get_codec(codec).copy_option).strip()
+        if self.identity:
+            options += ' EXPLICIT_IDS'
+        statements.append(queries.copy_from_manifest.format(
+            table=self.qualified_name, manifest_key=manifest_url,
+            creds=target.aws_credentials,
+            options=options + ' COMPUPDATE OFF').strip())
+        return ';\n'.join(statements) + ';'
+
+
+def _plan(source, target, tables, schema, if_exists, copy_privileges):
+    transfers = []
+    for table in tables:
+        table_schema, name = split_name(table, schema)
+        exists = target.table_exists(name, table_schema)
+        if exists and if_exists == 'fail':
+            raise ValueError("Table {} already exists on the target; pass "
+                             "if_exists='replace' or 'append'".format(
+                                 _qualified(table_schema, name)))
+        ddl = source.table_definition(name, schema=table_schema,
+                                      copy_privileges=copy_privileges)
+        identity = source._get_identity_columns(name, table_schema)
+        transfers.append(TableTransfer(table_schema, name,
+                                       ddl.strip().rstrip(';').strip(),
+                                       exists, identity))
+    return transfers
+
+
+def _run_transfer(source, target, transfer, bucket, prefix, file_format,
+                  codec, if_exists, clean_up_s3):
+    report = LoadReport(transfer.qualified_name)
+    report.codec = 'parquet' if file_format == 'parquet' else codec
+    storage = source.get_storage(bucket)
+    try:
+        print("Unloading {}...".format(transfer.qualified_name))
+        with report.phase('unload'):
+            source.execute(transfer.unload_statement(
+                source, storage.url(prefix), file_format, codec))
+        report.files = len([key for key in storage.list(prefix)
+                            if not key.endswith('manifest')])
+
+        print("Copying {} to the target...".format(
+            transfer.qualified_name))
+        with report.phase('copy'):
+            target.execute(transfer.load_batch(
+                target, storage.url(prefix + 'manifest'), file_format,
+                codec, if_exists))
+        report.copy_count = target._last_copy_count()
+    finally:
+        if clean_up_s3:
+            with report.phase('cleanup'):
+                storage.delete(storage.list(prefix))
+    return report.finish()
+
+
+def copy_table_between_clusters(source, target, table, bucket,
+                                keypath='shiftmanager/transfers/',
+                                schema=None, file_format='parquet',
+                                codec='zstd', if_exists='fail',
+                                copy_privileges=False, max_workers=4,
+                                clean_up_s3=True):
+    """
+    Copy *table* (or a list of tables) from *source* to *target*.
+
+    Each table's DDL is reflected from *source* with `table_definition`.
+    The table is UNLOADed to *bucket*, and then created and COPYed on
+    *target* from the UNLOAD manifest in a single transaction, so readers
+    never see it missing or half-loaded.
+
+    Parameters
+    ----------
+    source, target : `~shiftmanager.Redshift`
+        Clusters (or databases) to copy from and to; both need read and
+        write access to *bucket*
+    table : str or list of str
+        Table names, optionally schema-qualified
+    bucket : str
+        S3 bucket for the unloaded files
+    keypath : str
+        Key prefix under which each transfer writes its files
+    schema : str
+        Schema of unqualified table names; defaults to the search path
+    file_format : str
+        ``'parquet'`` (the default) or ``'csv'``, for column types COPY
+        can't read from Parquet
+    codec : str
+        Compression for ``'csv'`` files: ``'zstd'``, ``'gzip'``,
+        ``'bzip2'``, or ``'none'`` or None for uncompressed files. Parquet
+        files are always Snappy-compressed.
+    if_exists : str
+        What to do when a table already exists on *target*: ``'fail'``
+        before anything is unloaded, ``'replace'`` it, or ``'append'`` to
+        it
+    copy_privileges : bool
+        Copy ownership and grants, which requires the same users to exist
+        on *target*
+    max_workers : int
+        Tables transferred at once. Each transfer holds one connection to
+        each cluster; keep this within the clusters' WLM concurrency.
+    clean_up_s3 : bool
+        Delete the unloaded files afterwards, whether or not the copy
+        succeeds
+
+    Returns
+    -------
+    `~shiftmanager.instrumentation.LoadReport` for *table*, or a list of
+    them in the order given if *table* is a list
+    """
+    if file_format not in FORMATS:
+        raise ValueError("file_format must be one of {}".format(
+            ', '.join(sorted(FORMATS))))
+    if if_exists not in IF_EXISTS:
+        raise ValueError("if_exists must be one of {}".format(
+            ', '.join(IF_EXISTS)))
+    if file_format == 'csv' and \
+            codec not in ('zstd', 'gzip', 'bzip2', 'none', None):
+        raise ValueError("UNLOAD can't compress with {!r}".format(codec))
+
+    many = isinstance(table, (list, tuple))
+    tables = list(table) if many else [table]
+    transfers = _plan(source, target, tables, schema, if_exists,
+                      copy_privileges)
+    run_id = uuid.uuid4().hex
+    prefix = '{}{}/'.format(keypath, run_id)
+
+    def run(transfer, parallel):
+        table_prefix = '{}{}/'.format(prefix, transfer.qualified_name)
+        if not parallel:
+            return _run_transfer(source, target, transfer, bucket,
+                                 table_prefix, file_format, codec, if_exists,
+                                 clean_up_s3)
+        # Each worker needs its own connections and transactions
+        src, tgt = source.clone(), target.clone()
+        try:
+            return _run_transfer(src, tgt, transfer, bucket, table_prefix,
+                                 file_format, codec, if_exists, clean_up_s3)
+        finally:
+            src.close()
+            tgt.close()
+
+    workers = min(max_workers, len(transfers))
+    if workers <= 1:
+        reports = [run(transfer, False) for transfer in transfers]
+    else:
+        pool = ThreadPool(workers)
+        try:
+            reports = pool.map(lambda transfer: run(transfer, True),
+                               transfers)
+        finally:
+            pool.close()
+            pool.join()
+    return reports if many else reports[0]
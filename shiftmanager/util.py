@@ -1,23 +1,20 @@
 #!/usr/bin/env python
 
-from functools import wraps
 import math
+import os
+
+from shiftmanager.cache import cached
+
+# str on Python 3, unicode on Python 2
+text_type = type(u'')
 
 
 def memoize(f):
     """
-    Memoization decorator for single argument methods.
+    Memoization decorator for methods, storing results in the instance's
+    bounded caches. Deprecated; use `shiftmanager.cache.cached`.
     """
-    memo = {}
-
-    @wraps(f)
-    def wrapper(self, key):
-        val = memo.get(key)
-        if not val:
-            val = memo[key] = f(self, key)
-        return val
-
-    return wrapper
+    return cached()(f)
 
 
 def recur_dict(accum, value, parent=None, list_idx=None):
@@ -73,3 +70,57 @@ def linspace(start, stop, num):
             break
         res.append(int(math.floor(accum)))
     return res
+
+
+def balanced_ranges(sizes, num):
+    """
+    Split a sequence of item *sizes* into *num* contiguous (start, stop)
+    index ranges of roughly equal total size.
+
+    Example
+    -------
+    >>> balanced_ranges([10, 1, 1, 1, 1, 1, 1, 1, 1, 1, 1], 2)
+    [(0, 1), (1, 11)]
+    >>> balanced_ranges([1, 1, 1], 5)
+    [(0, 1), (1, 2), (2, 3), (3, 3), (3, 3)]
+    """
+    total = float(sum(sizes))
+    bounds = [0]
+    accum = 0
+    for i, size in enumerate(sizes):
+        # Close ranges as their share of the total is reached, leaving at
+        # least one item for each range still to come where possible
+        while (len(bounds) < num and
+               accum + size / 2.0 > total * len(bounds) / num and
+               i > bounds[-1]):
+            bounds.append(i)
+        accum += size
+    while len(bounds) < num:
+        bounds.append(min(bounds[-1] + 1, len(sizes)))
+    bounds.append(len(sizes))
+    return [(bounds[i], max(bounds[i], bounds[i + 1])) for i in range(num)]
+
+
+def file_count(raw_bytes, compression_ratio, slices, target_file_bytes):
+    """
+    Number of files to split *raw_bytes* into for COPY: the smallest
+    multiple of *slices* keeping each compressed file within
+    *target_file_bytes*.
+
+    >>> file_count(10 * 2 ** 30, 0.25, 4, 128 * 2 ** 20)
+    20
+    >>> file_count(1000, 0.25, 4, 128 * 2 ** 20)
+    4
+    """
+    compressed = float(raw_bytes) * compression_ratio
+    per_slice = int(math.ceil(compressed / (slices * target_file_bytes)))
+    return slices * max(1, per_slice)
+
+
+def which(command):
+    """Return the path of the executable *command* on PATH, or None."""
+    for directory in os.environ.get('PATH', '').split(os.pathsep):
+        path = os.path.join(directory, command)
+        if os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return None
@@ -0,0 +1,281 @@
+"""
+Check documents against a table's columns before they are staged.
+
+COPY reports type errors, oversized strings and bad timestamps only after
+every chunk has been written and uploaded. A `Validator` compiles one
+`ColumnCheck` per column of the reflected target table and runs them
+while documents are serialized. Invalid documents never leave the machine
+and can be written to a reject file along with the reasons they failed.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import datetime
+import decimal
+import io
+import json
+import re
+
+from shiftmanager.inference import (BIGINT_MAX, INTEGER_MAX, SMALLINT_MAX,
+                                    TIMESTAMP_RE, value_type)
+from shiftmanager.projection import Projection
+from shiftmanager.util import text_type
+
+# Strings COPY accepts for BOOLEAN columns
+BOOLEAN_STRINGS = {'t', 'true', 'y', 'yes', '1', 'f', 'false', 'n', 'no',
+                   '0'}
+
+# Anything TIMEFORMAT 'auto' reads has at least a year or day in digits
+DIGIT_RE = re.compile(r'\d')
+
+
+def _integer(value):
+    kind = value_type(value)
+    if kind == 'integer':
+        return value
+    if kind == 'number':
+        try:
+            if value == int(value):
+                return int(value)
+        except (OverflowError, ValueError):
+            pass
+    if kind == 'string':
+        try:
+            return int(value.strip())
+        except ValueError:
+            pass
+    return None
+
+
+def _decimal(value):
+    if value_type(value) in ('integer', 'number', 'string'):
+        try:
+            return decimal.Decimal(str(value).strip())
+        except decimal.InvalidOperation:
+            pass
+    return None
+
+
+def _check_calendar(value):
+    try:
+        datetime.datetime.strptime(value[:10], '%Y-%m-%d')
+    except ValueError:
+        return '{!r} is not a valid date'.format(value)
+
+
+class ColumnCheck(object):
+    """
+    Validates the values loaded into one column.
+
+    Parameters
+    ----------
+    name : str
+        Column name
+    kind : str
+        'string', 'integer', 'decimal', 'float', 'boolean', 'date',
+        'timestamp', or None to check only for nulls
+    nullable : bool
+        Whether the column accepts nulls
+    length : int
+        Longest string in bytes, for 'string'
+    high : int
+        Largest magnitude, for 'integer'
+    precision, scale : int
+        Digits in total and after the point, for 'decimal'
+
+    Notes
+    -----
+    COPY reads timestamps with TIMEFORMAT 'auto', which accepts far more
+    than ISO 8601, so only values it can't read are flagged: non-strings,
+    strings without digits, and ISO 8601 values that aren't real dates.
+    Dates are read with the default DATEFORMAT, 'YYYY-MM-DD'.
+    """
+
+    def __init__(self, name, kind=None, nullable=True, length=None,
+                 high=None, precision=None, scale=None):
+        self.name = name
+        self.kind = kind
+        self.nullable = nullable
+        self.length = length
+        self.high = high
+        self.precision = precision
+        self.scale = scale
+
+    @classmethod
+    def from_column(cls, column):
+        """Compile a check from a :class:`~sqlalchemy.schema.Column`."""
+        import sqlalchemy as sa
+
+        type_ = column.type
+        kwargs = {'nullable': column.nullable}
+        if isinstance(type_, sa.String):
+            # Redshift stores TEXT as VARCHAR(256)
+            kwargs.update(kind='string', length=type_.length or 256)
+        elif isinstance(type_, sa.SmallInteger):
+            kwargs.update(kind='integer', high=SMALLINT_MAX)
+        elif isinstance(type_, sa.BigInteger):
+            kwargs.update(kind='integer', high=BIGINT_MAX)
+        elif isinstance(type_, sa.Integer):
+            kwargs.update(kind='integer', high=INTEGER_MAX)
+        elif isinstance(type_, sa.Float):
+            kwargs.update(kind='float')
+        elif isinstance(type_, sa.Numeric):
+            # Redshift's default is DECIMAL(18, 0)
+            kwargs.update(kind='decimal', precision=type_.precision or 18,
+                          scale=type_.scale or 0)
+        elif isinstance(type_, sa.Boolean):
+            kwargs.update(kind='boolean')
+        elif isinstance(type_, sa.DateTime):
+            kwargs.update(kind='timestamp')
+        elif isinstance(type_, sa.Date):
+            kwargs.update(kind='date')
+        return cls(column.name, **kwargs)
+
+    def __call__(self, value):
+        """Return why *value* can't be loaded, or None if it can."""
+        if value is None:
+            return None if self.nullable else 'null in NOT NULL column'
+        if self.kind is None:
+            return None
+        return getattr(self, '_check_' + self.kind)(value)
+
+    def _check_string(self, value):
+        if not isinstance(value, (str, text_type)):
+            value = json.dumps(value)
+        size = len(value.encode('utf-8'))
+        if size > self.length:
+            return '{} bytes exceeds VARCHAR({})'.format(size, self.length)
+
+    def _check_integer(self, value):
+        number = _integer(value)
+        if number is None:
+            return '{!r} is not an integer'.format(value)
+        if not -self.high - 1 <= number <= self.high:
+            return '{} is out of range'.format(number)
+
+    def _check_decimal(self, value):
+        number = _decimal(value)
+        if number is None or not number.is_finite():
+            return '{!r} is not a number'.format(value)
+        _, digits, exponent = number.as_tuple()
+        whole_digits = len(digits) + exponent
+        if whole_digits > self.precision - self.scale:
+            return '{} exceeds DECIMAL({}, {})'.format(
+                value, self.precision, self.scale)
+
+    def _check_float(self, value):
+        if value_type(value) in ('integer', 'number'):
+            return None
+        if value_type(value) == 'string':
+            try:
+                float(value)
+                return None
+            except ValueError:
+                pass
+        return '{!r} is not a number'.format(value)
+
+    def _check_boolean(self, value):
+        if isinstance(value, bool) or value in (0, 1):
+            return None
+        if isinstance(value, (str, text_type)) and \
+                value.strip().lower() in BOOLEAN_STRINGS:
+            return None
+        return '{!r} is not a boolean'.format(value)
+
+    def _check_timestamp(self, value):
+        if not isinstance(value, (str, text_type)) or \
+                not DIGIT_RE.search(value):
+            return '{!r} is not a timestamp'.format(value)
+        if TIMESTAMP_RE.match(value):
+            return _check_calendar(value)
+
+    def _check_date(self, value):
+        match = (isinstance(value, (str, text_type)) and
+                 TIMESTAMP_RE.match(value))
+        if not match or match.group('time'):
+            return '{!r} is not a date'.format(value)
+        return _check_calendar(value)
+
+
+class Validator(object):
+    """
+    Checks documents against the columns of a table they'll be COPYed
+    into with *jsonpaths*, which COPY maps to columns by position.
+
+    Validators pickle, so they can be sent to worker processes.
+
+    Parameters
+    ----------
+    table : :class:`~sqlalchemy.schema.Table`
+        The reflected target table
+    jsonpaths : dict
+        Redshift jsonpaths
+    reject_path : str
+        Local JSON lines file to which invalid documents are appended
+    max_rejects : int or None
+        Invalid documents tolerated before the load fails; None for any
+        number
+    """
+
+    def __init__(self, table, jsonpaths, reject_path=None, max_rejects=0):
+        paths = jsonpaths['jsonpaths']
+        if len(paths) != len(table.columns):
+            raise ValueError("{} jsonpaths given for the {} columns of {}"
+                             .format(len(paths), len(table.columns),
+                                     table.name))
+        self.projection = Projection(paths)
+        self.checks = [ColumnCheck.from_column(col) for col in table.columns]
+        self.reject_path = reject_path
+        self.max_rejects = max_rejects
+
+    def errors(self, doc):
+        """Return a list of reasons *doc* can't be loaded."""
+        errors = []
+        for check, value in zip(self.checks, self.projection.values(doc)):
+            reason = check(value)
+            if reason is not None:
+                errors.append('{}: {}'.format(check.name, reason))
+        return errors
+
+    def split(self, docs):
+        """
+        Return (valid documents, list of (invalid document, reasons)).
+        """
+        valid = []
+        rejects = []
+        for doc in docs:
+            errors = self.errors(doc)
+            if errors:
+                rejects.append((doc, errors))
+            else:
+                valid.append(doc)
+        return valid, rejects
+
+    def handle_rejects(self, rejects):
+        """
+        Write *rejects*, as returned by `split`, to the reject file, then
+        raise ValueError if there are more than *max_rejects*.
+        """
+        if not rejects:
+            return
+        if self.reject_path is not None:
+            print("Writing {} rejected documents to {}...".format(
+                len(rejects), self.reject_path))
+            write_rejects(self.reject_path, rejects)
+        if self.max_rejects is not None and len(rejects) > self.max_rejects:
+            doc, errors = rejects[0]
+            raise ValueError(
+                "{} documents failed validation, more than the {} allowed; "
+                "the first failed with {}".format(
+                    len(rejects), self.max_rejects, '; '.join(errors)))
+
+
+def write_rejects(path, rejects):
+    """
+    Append *rejects* to the JSON lines file at *path*, one object per
+    document with its ``record`` and the ``errors`` found in it.
+    """
+    with io.open(path, 'a', encoding='utf-8') as f:
+        for doc, errors in rejects:
+            f.write(u'{}\n'.format(
+                json.dumps({'record': doc, 'errors': errors})))
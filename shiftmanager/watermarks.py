@@ -0,0 +1,153 @@
+"""
+State stores for high-watermark incremental loads.
+
+An incremental load extracts only rows whose watermark column (an
+``updated_at`` timestamp or serial id) is above the highest value already
+loaded, then records the new high watermark once the load has committed.
+A store keeps one watermark per key, usually the source table name.
+
+Watermarks are kept as strings, which Postgres compares correctly against
+timestamp and integer columns.
+"""
+
+from __future__ import absolute_import, division, print_function
+
+import json
+import os
+import tempfile
+import threading
+
+
+class WatermarkStore(object):
+    """Base class for watermark stores."""
+
+    def get(self, key):
+        """Return the watermark recorded for *key*, or None."""
+        raise NotImplementedError
+
+    def set(self, key, value):
+        """Record *value* as the watermark for *key*."""
+        raise NotImplementedError
+
+    def statements(self, redshift, key, value):
+        """
+        Return SQL statements recording *value* for *key* that can run in
+        the load's final transaction on *redshift*, so the watermark
+        advances atomically with the COPY.
+
+        Stores that can't do so return an empty list, and `set` is called
+        once the load has committed.
+        """
+        return []
+
+
+class MemoryWatermarkStore(WatermarkStore):
+    """Watermarks kept in a dict, for tests and one-off scripts."""
+
+    def __init__(self, watermarks=None):
+        self.watermarks = dict(watermarks or {})
+
+    def get(self, key):
+        return self.watermarks.get(key)
+
+    def set(self, key, value):
+        self.watermarks[key] = None if value is None else str(value)
+
+
+class FileWatermarkStore(WatermarkStore):
+    """
+    Watermarks kept in a local JSON file.
+
+    The file is rewritten atomically on each update, so a crash never
+    leaves it half-written.
+
+    Parameters
+    ----------
+    path : str
+        JSON file holding an object mapping keys to watermarks
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (IOError, OSError):
+            return {}
+
+    def get(self, key):
+        return self._read().get(key)
+
+    def set(self, key, value):
+        with self._lock:
+            watermarks = self._read()
+            watermarks[key] = None if value is None else str(value)
+            directory = os.path.dirname(os.path.abspath(self.path))
+            fd, tmp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(watermarks, f, indent=2, sort_keys=True)
+            getattr(os, 'replace', os.rename)(tmp_path, self.path)
+
+
+class RedshiftWatermarkStore(WatermarkStore):
+    """
+    Watermarks kept in a table on a Redshift cluster.
+
+    When the load targets the same cluster, the watermark is updated in
+    the same transaction as the final COPY.
+
+    Parameters
+    ----------
+    redshift : `~shiftmanager.Redshift`
+        Cluster holding the table
+    table : str
+        Table name, created if needed
+    """
+
+    def __init__(self, redshift, table='shiftmanager_watermarks'):
+        self.redshift = redshift
+        self.table = table
+        self._created = False
+
+    def _create(self):
+        if not self._created:
+            self.redshift.execute(
+                "CREATE TABLE IF NOT EXISTS {} (\n"
+                "  watermark_key VARCHAR(512),\n"
+                "  watermark_value VARCHAR(256),\n"
+                "  updated_at TIMESTAMP DEFAULT GETDATE()\n"
+                ")".format(self.table))
+            self._created = True
+
+    def get(self, key):
+        self._create()
+        with self.redshift.connection as conn, conn.cursor() as cur:
+            cur.execute("SELECT watermark_value FROM {} "
+                        "WHERE watermark_key = %s".format(self.table),
+                        (key,))
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    def _statements(self, key, value):
+        return [
+            self.redshift.mogrify(
+                "DELETE FROM {} WHERE watermark_key = %s".format(self.table),
+                (key,)),
+            self.redshift.mogrify(
+                "INSERT INTO {} (watermark_key, watermark_value) "
+                "VALUES (%s, %s)".format(self.table),
+                (key, None if value is None else str(value))),
+        ]
+
+    def set(self, key, value):
+        self._create()
+        self.redshift.execute(';\n'.join(self._statements(key, value)))
+
+    def statements(self, redshift, key, value):
+        if redshift is not self.redshift:
+            return []
+        self._create()
+        return self._statements(key, value)